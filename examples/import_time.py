@@ -0,0 +1,55 @@
+"""
+Measures how long it takes to import approxeng.hwsupport and to augment a motor-only board, and checks that
+optional modules such as yaml, the LED colour tables, snapshots and controllers aren't loaded unless they're needed.
+Each measurement is made in a fresh interpreter so nothing is already cached in sys.modules.
+
+Run with 'python import_time.py [repeats]', defaults to 20 repeats, and reports the median of each measurement.
+"""
+import statistics
+import subprocess
+import sys
+
+SCRIPT = '''
+import sys, time
+start = time.perf_counter()
+from approxeng.hwsupport import add_properties
+imported = time.perf_counter()
+
+class MotorBoard:
+    def __init__(self):
+        add_properties(self, motors=[0, 1])
+
+    def _set_motor_speed(self, motor, speed):
+        pass
+
+MotorBoard()
+augmented = time.perf_counter()
+lazy = [m for m in ('yaml', 'colorsys', 'struct', 'approxeng.hwsupport.leds', 'approxeng.hwsupport.css4_colours',
+                    'approxeng.hwsupport.controllers', 'approxeng.hwsupport.encoders', 'approxeng.hwsupport.gpios',
+                    'approxeng.hwsupport.loop', 'approxeng.hwsupport.snapshots', 'approxeng.hwsupport.transactions')
+        if m in sys.modules]
+print(imported - start, augmented - imported, ','.join(lazy))
+'''
+
+
+def measure(repeats):
+    import_times = []
+    augment_times = []
+    loaded = set()
+    for _ in range(repeats):
+        output = subprocess.run([sys.executable, '-c', SCRIPT], stdout=subprocess.PIPE, check=True,
+                                universal_newlines=True).stdout.split()
+        import_times.append(float(output[0]))
+        augment_times.append(float(output[1]))
+        if len(output) > 2:
+            loaded.update(output[2].split(','))
+    return statistics.median(import_times), statistics.median(augment_times), loaded
+
+
+if __name__ == '__main__':
+    import_time, augment_time, loaded = measure(int(sys.argv[1]) if len(sys.argv) > 1 else 20)
+    print(f'import approxeng.hwsupport : {import_time * 1000:.2f} ms')
+    print(f'add_properties(motors=...) : {augment_time * 1000:.2f} ms')
+    if loaded:
+        print(f'unexpectedly loaded        : {", ".join(sorted(loaded))}')
+        sys.exit(1)
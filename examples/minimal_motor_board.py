@@ -20,12 +20,13 @@ class LoggingMotorBoard:
         # Motors, servos, adcs, and leds are optional, include those for your hardware
         # and implement the corresponding private methods as shown below. This example
         # includes a couple of motors, four servos (note that numbers do not have to be
-        # consecutive), three ADC channels and a pair of LEDs
+        # consecutive), three ADC channels, a pair of LEDs and an encoder on each motor
         add_properties(board=self,
                        motors=[0, 1],
                        servos=[0, 1, 5, 6],
                        adcs=[0, 1, 2],
-                       leds=[0, 1])
+                       leds=[0, 1],
+                       encoders=[0, 1])
 
     def _set_motor_speed(self, motor, speed: float):
         """
@@ -55,6 +56,31 @@ class LoggingMotorBoard:
         LOGGER.info(f'Reading from ADC channel {adc}, returning 12345')
         return 12345
 
+    def _read_adcs(self, adcs):
+        """
+        Optional, if your hardware can read several channels in one transaction provide this as well as _read_adc
+
+        :param adcs:
+            List of ADC channel numbers to read
+        :return:
+            A dict of channel number to raw value
+        """
+        LOGGER.info(f'Reading from ADC channels {adcs}, returning 12345 for each')
+        return {adc: 12345 for adc in adcs}
+
+    def _read_encoders(self, encoders):
+        """
+        Either this or _read_encoder(encoder), provide this one if your hardware can read every encoder in one
+        transaction
+
+        :param encoders:
+            List of encoder numbers to read, from the values in 'encoders=[0, 1]' above
+        :return:
+            A dict of encoder number to count
+        """
+        LOGGER.info(f'Reading encoders {encoders}, returning 0 for each')
+        return {encoder: 0 for encoder in encoders}
+
     def _set_led_rgb(self, led, red, green, blue):
         """
         :param led:
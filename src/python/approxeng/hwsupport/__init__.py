@@ -1,17 +1,39 @@
-# -*- coding: future_fstrings -*-
-
+import importlib
 import logging
 
-import yaml
 from approxeng.hwsupport.adcs import ADCS, ADC, ReadADCsMixin
+from approxeng.hwsupport.drive import Mixer, DifferentialDrive, SkidSteerDrive, MecanumDrive, DriveMixin
 from approxeng.hwsupport.motors import MOTORS, Motor, SetMotorsMixin
 from approxeng.hwsupport.servos import SERVOS, Servo, SetServosMixin
-from approxeng.hwsupport.leds import LEDS, LED, SetLEDsMixin
+from approxeng.hwsupport.util import NO_LOCK
 
 LOGGER = logging.getLogger(name='approxeng.hwsupport')
 
-
-def add_properties(board, motors=None, servos=None, adcs=None, default_adc_divisor=7891, leds=None):
+# Same as approxeng.hwsupport.leds.LEDS, defined here so the LED and colour modules are only imported for boards with
+# LEDs. Similarly yaml is only imported when configuration is read or written as YAML, the bus module only when the bus
+# thread is requested, the derived channel module only when derived channels are declared, the shared memory module
+# only when shared state is requested, and the encoder and GPIO modules only for boards with encoders or GPIO pins.
+LEDS = 'leds'
+ENCODERS = 'encoders'
+GPIOS = 'gpios'
+CONTROLLERS = 'controllers'
+
+# Mixins every board gets, by module, with the methods and properties they provide. Each module is imported, and its
+# mixin's attributes added to the board's class, the first time one of these is used, so a board which never runs a
+# loop or takes a snapshot doesn't pay for importing them.
+_LAZY_MIXINS = {
+    ('approxeng.hwsupport.loop', 'RunLoopMixin'): ('run_loop',),
+    ('approxeng.hwsupport.transactions', 'TransactionMixin'): ('transaction',),
+    ('approxeng.hwsupport.controllers', 'ControllersMixin'): ('add_controller', 'remove_controller', 'controllers',
+                                                              'run_controllers', '_update_controllers'),
+    ('approxeng.hwsupport.snapshots', 'SnapshotMixin'): ('snapshot', 'restore', 'save_snapshot', 'load_snapshot',
+                                                         'persist_snapshots')}
+_LAZY_ATTRIBUTES = {name: mixin for mixin, names in _LAZY_MIXINS.items() for name in names}
+
+
+def add_properties(board, motors=None, servos=None, adcs=None, default_adc_divisor=7891, leds=None,
+                   drive=None, bus_thread=False, derived=None, shared_state=None, resilience=False,
+                   encoders=None, gpios=None):
     """
     Augment an existing instance of a motor, servo, adc, or combination driver class. This wraps up any provided
     methods in ones which check their input ranges properly, exposes those as properties (read and write), adds
@@ -32,6 +54,15 @@ def add_properties(board, motors=None, servos=None, adcs=None, default_adc_divis
     to subsequent motor speed calls - handy if you've not quite got your wiring right first time.
     4. For each motor, a set of properties mXX_scale and motorXX_scale which allow you to set the full scale range
     set for subsequent calls between 0.0 for no movement ever to 1.0 for full range.
+    5. A new method set_motor_speeds(speeds) taking a dict of motor index to speed. If the underlying board provides a
+    _set_motor_speeds(speeds) method this is called once with all the speeds, otherwise _set_motor_speed is called for
+    each motor in turn.
+    6. If a mixer is supplied in the 'drive' parameter, a new method drive(x, y, rotate) which uses the mixer to
+    convert the requested motion into wheel speeds, applies each motor's scale, and sets all motors in one call to
+    set_motor_speeds.
+    7. For each motor, a set of properties mXX_curve and motorXX_curve which read and write a calibration curve as a
+    list of (input, output) points, or None for a straight line. The curve is compiled to a lookup table when set, and
+    applied after scale and before invert by both set_motor_speed and set_motor_speeds.
 
     For servos, the underlying board must provide a method _set_servo_pulsewidth(servo, pulse_width) accepting an int
     servo index and a desired pulse width specified in microseconds. If this method exists, and there are items in the
@@ -47,6 +78,9 @@ def add_properties(board, motors=None, servos=None, adcs=None, default_adc_divis
     values are the minimum and maximum pulse widths accepted by the servo on this channel. These default to 500,2500
     unless otherwise set, and are used to interpret the position value of the servo when converting to a pulse width
     for the corresponding output.
+    5. For each servo, a set of properties sXX_curve and servoXX_curve which read and write a calibration curve as a
+    list of (input, output) points, or None for a straight line. Positions are mapped through the curve before being
+    converted to a pulse width.
 
     For ADC channels, the underlying board must provide a method _read_adc(adc) accepting an integer adc channel number
     and returning a raw ADC value. If this method exists and there are items in the 'adc' parameter, the following are
@@ -55,12 +89,23 @@ def add_properties(board, motors=None, servos=None, adcs=None, default_adc_divis
     1. A new method, read_adc(adc), taking the same integer adc index as the underlying _read_adc method, and returning
     a floating point voltage. This voltage is calculated by dividing the raw read value by a per-adc-channel divisor.
     2. For each channel, an adcXX property which exposes the value for that channel.
-    3. For each channel, an adcXX_divisor property which can be written and read to set and get the per-channel divisor
-    4. For each channel, an adcXX_cache_time property, defaulting to 0 to disable caching, interpreted as a number of
+    3. A new method read_adcs(adcs) reading several channels at once. If the underlying board provides a
+    _read_adcs(adcs) method returning a dict of channel to raw value this is called once, otherwise _read_adc is called
+    for each channel in turn.
+    4. For each channel, an adcXX_divisor property which can be written and read to set and get the per-channel divisor
+    5. For each channel, an adcXX_cache_time property, defaulting to 0 to disable caching, interpreted as a number of
     seconds for which reads should be cached and returned. This is particularly useful when an ADC channel is attached
     to a very slowly changing voltage such as a battery, allowing consumers of this API to read it within a control loop
     without creating excessive traffic to the ADC itself. It may also be necessary to prevent very rapid reads from ADC
     hardware unable to handle this.
+    6. For each channel, an adcXX_calibration property taking a list of (raw, measured) points, or a tuple of (points,
+    degree) for a least squares polynomial fit. If set this is used in place of the divisor. Set to None to go back to
+    the divisor.
+    7. For each channel, a read-only adcXX_raw property which reads the uncalibrated value from the hardware, ignoring
+    the cache.
+    8. A new method on_adc(adc, callback, above, below, hysteresis) which calls back when a channel crosses a threshold
+    or changes, checked whenever the channel is read from the hardware, and a method sample_adcs(interval) which starts
+    a background thread reading channels with subscriptions.
 
     For LEDs, the underlying board must provide a method _set_led_rgb(led, r, g, b) taking RGB values as floats from 0.0
     to 1.0. If this method exists and there are entries in the 'leds' parameter, the following are added to the driver
@@ -72,8 +117,9 @@ def add_properties(board, motors=None, servos=None, adcs=None, default_adc_divis
     2. A new method, set_led_brightness(led, brightness) which takes a brightness value from 0.0-1.0 and uses it to
     scale the value part of any colours set subsequently. Handy for when you don't want to blind yourself. Brightness
     is initially 1.0
-    3. For each LED, a read / write property ledXX, this can be written to with either a tuple (h, s, v) or a colour
-    name from the CSS4 standard colours. Reading the property will always return an HSV tuple
+    3. For each LED, a read / write property ledXX, this can be written to with a tuple (h, s, v), a colour name from
+    the CSS4 standard colours, a hex string such as '#ff8800', an 'rgb(255, 136, 0)' or 'hsv(0.1, 1.0, 1.0)' string,
+    or three RGB bytes. Reading the property will always return an HSV tuple
     4. For each LED, a read / write property ledXX_rgb, this can be written to with a tuple of 0.0-1.0 rgb values, and
     will return the same. Internally this is converted to HSV and scaled by the brightness, so your actual RGB values
     pushed to the LED may be different to those returned from this call if brightness is not 1.0
@@ -84,7 +130,48 @@ def add_properties(board, motors=None, servos=None, adcs=None, default_adc_divis
     7. For each LED, a read / write property ledXX_saturation which can be used to increase perceived saturation for
     paler colours, this applies a power of 1/value to the saturation component of each colour set, defaults to 1.0 for
     no correction, a value of 2 gives better pale colours when using the CSS4 colour names.
-
+    8. For each LED, a read only property ledXX_name which returns the name of the CSS4 colour closest to the colour
+    currently set, before any brightness, gamma, or saturation correction
+    9. For each LED, a read / write property ledXX_bits, None by default. If set to a bit depth, the output is quantised
+    to that many bits per colour before being sent to _set_led_rgb, and updates which wouldn't change the quantised
+    colour aren't sent at all.
+    10. For each LED, a read / write property ledXX_dither, False by default. If True and ledXX_bits is set, the output
+    is dithered over time, moving on a frame each time the new advance_led_frame() method is called.
+
+    For encoders, the underlying board must provide a method _read_encoder(encoder) accepting an integer encoder number
+    and returning its count, or a method _read_encoders(encoders) taking a list of encoder numbers and returning a dict
+    of encoder to count. If either exists and there are items in the 'encoders' parameter, the following are added:
+
+    1. A new method read_encoder(encoder) returning the count from one encoder.
+    2. A new method read_encoders(encoders) reading several encoders at once, in a single call to _read_encoders if the
+    board provides it, otherwise calling _read_encoder for each encoder in turn.
+    3. For each encoder, an encXX property which reads the count.
+    4. For each encoder, an encXX_velocity property which reads the count and returns the speed in revolutions per
+    second, calculated from the readings taken over the last encXX_velocity_window seconds, and a new method
+    encoder_velocities(encoders) which calculates the same for several encoders from the readings already taken.
+    5. For each encoder, read / write properties encXX_counts_per_revolution, defaulting to 1.0, encXX_invert,
+    defaulting to False, and encXX_velocity_window, defaulting to 0.1 seconds.
+
+    For GPIO pins, the underlying board must provide one or more of a method _read_gpio(gpio) accepting an integer pin
+    number and returning its level, a method _read_gpios() returning the levels of all pins as an integer bitmask with
+    bit N for pin N, and a method _write_gpio(gpio, level) accepting a pin number and a boolean level. If any of these
+    exist and there are items in the 'gpios' parameter, the following are added:
+
+    1. New methods read_gpio(gpio) and read_gpios(gpios) returning debounced levels as booleans, reading every pin in a
+    single call to _read_gpios if the board provides it, and write_gpio(gpio, level).
+    2. For each pin, a gpioXX property which reads the debounced level and writes the output level.
+    3. For each pin, a read / write property gpioXX_invert, False by default, which inverts reads and writes for active
+    low pins, and gpioXX_debounce, the number of seconds a new level must be stable before it's accepted, 0 by default.
+    4. A new method on_gpio(gpio, callback, edge) which calls back on rising or falling edges of the debounced level,
+    and a method poll_gpios(interval) which starts a single background thread reading all pins at once and making
+    the callbacks. While polling, reads return the level from the latest poll without reading the hardware.
+
+    For derived channels, supplied in the 'derived' parameter and requiring ADC channels, the following are added:
+
+    1. For each derived channel, a read-only property with the channel's name. Reading it reads each ADC channel it
+    depends on once, directly or through other derived channels, then calculates the value.
+    2. A new method read_derived(*names) returning a dict of name to value for several derived channels, sharing one
+    read of each ADC channel between all of them.
 
     Configuration properties are also injected, specifically a read / write property 'config' which contains the entire
     configuration for all motors, servos, and adc channels as a dict - writing to this property will only set values
@@ -93,7 +180,27 @@ def add_properties(board, motors=None, servos=None, adcs=None, default_adc_divis
     current configuration to be read into a YAML string.
 
     A method 'stop()' is also injected, this will set any motor speeds to zero, disable any servos, and then, if
-    provided by the original object, call a '_stop()' function.
+    provided by the original object, call a '_stop()' function. If the bus thread is enabled, stop() sends these writes
+    ahead of any other traffic, ignoring bandwidth and rate limits, and waits for them to reach the hardware before
+    calling '_stop()'.
+
+    A method 'run_loop(callback, hz)' is also injected, which calls a function at a fixed rate without drifting,
+    optionally reading a set of ADC channels before each call, and records jitter, overruns, and where the time went. If
+    the function raises an exception or the loop is interrupted, stop() is called.
+
+    A method 'add_controller(input, output, kp, ki, kd)' is also injected, which adds a PID controller reading an ADC
+    channel or encoder and driving a motor or servo, with output limits and integral anti-windup. A method
+    'run_controllers(hz)' runs every controller on one background thread at a fixed rate, reading all their inputs and
+    writing all their outputs together on each tick. Controller gains are included in the configuration.
+
+    Methods 'add_channels(...)' and 'remove_channels(...)' are also injected, taking the same channel lists as this
+    function. They add or remove channels on a board in use, with their properties, configuration, and stop() handling,
+    without affecting existing channels.
+
+    A method 'transaction()' is also injected, returning a context manager. Writes to motors, servos, LEDs and GPIO
+    pins made inside the with block are held back and sent together when it ends, only the last write to each channel
+    being sent, while properties read inside the block return the values set inside it. If the block raises an
+    exception its writes are discarded unless transaction(flush_on_error=True) was used.
 
     Note - all injected methods take an optional **kwargs argument which will be passed through to the underlying
     object's methods.
@@ -108,28 +215,74 @@ def add_properties(board, motors=None, servos=None, adcs=None, default_adc_divis
         An array of integer ADC channel numbers to be exposed for this board, defaults to None for no ADC channels
     :param default_adc_divisor:
         Initial value for all ADC divisor configs, defaults to 7891
+    :param leds:
+        An array of integer LED numbers to be exposed for this board, defaults to None for no LEDs
+    :param drive:
+        A Mixer, such as DifferentialDrive, SkidSteerDrive or MecanumDrive, used to provide the drive() method. All
+        motors used by the mixer must be in the 'motors' parameter. Defaults to None for no drive() method
+    :param bus_thread:
+        If True, all writes to motors, servos and LEDs are handed to a single bus thread which sends only the latest
+        value for each channel, and ADC reads are serialised with these writes. This makes the board safe to use from
+        multiple threads. Writes return before the hardware has been updated. Traffic is prioritised and can be rate
+        limited, see BusWriter. Defaults to False
+    :param derived:
+        A dict of name to function defining read-only derived channels, each exposed as a property with that name. The
+        names of each function's parameters are the channels it needs, either adcXX or another derived channel, i.e.
+        {'battery_pct': lambda adc0: (adc0 - 6.4) / 2.0 * 100}. Defaults to None for no derived channels
+    :param shared_state:
+        If set, the value of every motor, servo, LED and ADC channel is mirrored into a shared memory block which other
+        processes can read with approxeng.hwsupport.shared.attach_board_state. Either the name of the block, or True to
+        have one generated, available from the shared_state property. Requires Python 3.8 or later. Defaults to None
+    :param encoders:
+        An array of integer encoder numbers to be exposed for this board, defaults to None for no encoders
+    :param gpios:
+        An array of integer GPIO pin numbers to be exposed for this board, defaults to None for no GPIO pins
+    :param resilience:
+        If True, calls to the underlying driver are protected by a ResiliencePolicy, available from the resilience
+        property, which can time out hung calls, retries failed writes, and stops calling the driver for a while after
+        repeated failures, serving cached ADC values and storing writes to send once the driver recovers. Defaults to
+        False
     """
 
-    # Replace default values with empty lists
-    if motors is None:
-        motors = []
-    if servos is None:
-        servos = []
-    if adcs is None:
-        adcs = []
-    if leds is None:
-        leds = []
+    # Replace default values with empty lists, copying supplied lists as add_channels and remove_channels change them
+    motors = list(motors or [])
+    servos = list(servos or [])
+    adcs = list(adcs or [])
+    leds = list(leds or [])
+    encoders = list(encoders or [])
+    gpios = list(gpios or [])
+    if derived is None:
+        derived = {}
 
     # Construct a set of superclasses, applying mixins for each of motors, servos, and adc channels where present
     superclasses = [board.__class__]
     if callable(getattr(board, '_set_motor_speed', None)) and motors:
         superclasses += [SetMotorsMixin]
+        if drive is not None:
+            for motor in drive.motors:
+                if motor not in motors:
+                    raise ValueError(f'drive mixer uses motor m{motor}, not in {motors}')
+            superclasses += [DriveMixin]
     if callable(getattr(board, '_set_servo_pulsewidth', None)) and servos:
         superclasses += [SetServosMixin]
     if callable(getattr(board, '_read_adc', None)) and adcs:
         superclasses += [ReadADCsMixin]
+    if (callable(getattr(board, '_read_encoder', None)) or callable(getattr(board, '_read_encoders', None))) \
+            and encoders:
+        from approxeng.hwsupport.encoders import ReadEncodersMixin
+        superclasses += [ReadEncodersMixin]
+    if any(callable(getattr(board, hook, None)) for hook in ('_read_gpio', '_read_gpios', '_write_gpio')) and gpios:
+        from approxeng.hwsupport.gpios import GPIOsMixin
+        superclasses += [GPIOsMixin]
     if callable(getattr(board, '_set_led_rgb', None)) and leds:
+        from approxeng.hwsupport.leds import SetLEDsMixin
         superclasses += [SetLEDsMixin]
+    if derived:
+        from approxeng.hwsupport.derived import DerivedChannelsMixin, build_derived_channels
+        if ReadADCsMixin not in superclasses:
+            raise ValueError(f'derived channels {list(derived.keys())} need ADC channels, board has none')
+        derived = build_derived_channels(derived=derived, adcs=adcs, board=board)
+        superclasses += [DerivedChannelsMixin]
 
     class Board(*superclasses):
         """
@@ -137,22 +290,154 @@ def add_properties(board, motors=None, servos=None, adcs=None, default_adc_divis
         motor, servo, and ADC properties.
         """
 
+        def __getattr__(self, item):
+            """
+            Only called when normal lookup fails, adds the mixin providing item on first use
+            """
+            mixin = _LAZY_ATTRIBUTES.get(item)
+            if mixin is None or item in Board.__dict__:
+                fallback = getattr(super(), '__getattr__', None)
+                if fallback is None:
+                    raise AttributeError(f'{type(self).__name__!r} object has no attribute {item!r}')
+                return fallback(item)
+            module, name = mixin
+            mixin_class = getattr(importlib.import_module(module), name)
+            for attribute, value in vars(mixin_class).items():
+                if not attribute.startswith('__'):
+                    setattr(Board, attribute, value)
+            return getattr(self, item)
+
         def stop(self, **kwargs):
             """
             Used to stop all activity on a board.
 
+            Background threads started on the board, such as ADC sampling, GPIO polling and controllers, are stopped
+            first, and any ADC callbacks already running are allowed to finish. They aren't restarted, call
+            sample_adcs, poll_gpios or run_controllers again if needed.
+
             If there are servos, these are disabled. If there are motors, they are set to 0 speed. LEDs are disabled.
-            Finally, if the underlying board's _stop() function is called, if present, to do any additional
-            board-specific cleanup.
+            With bus_thread these writes are sent before the bus thread is closed, after which writes go straight to
+            the hardware. Finally, if the underlying board's _stop() function is called, if present, to do any
+            additional board-specific cleanup. The driver thread used for resilience deadlines is then stopped, and
+            started again by the next driver call. If the board's state is being published to shared memory, publishing
+            stops after the stopped values have been published.
+
+            If snapshots are being persisted, a final snapshot of the values from before the board was stopped is
+            written once everything else has been done. Failing to write it is logged rather than raised.
             """
+            snapshot_writer, final_snapshot = self._snapshot_writer, None
+            if snapshot_writer is not None:
+                self._snapshot_writer = None
+                snapshot_writer.halt()
+                try:
+                    final_snapshot = self.snapshot()
+                except Exception:
+                    LOGGER.exception('unable to take final snapshot')
+            if self._adc_sampler is not None:
+                self._adc_sampler.close()
+                self._adc_sampler = None
+            if self._gpio_poller is not None:
+                self._gpio_poller.close()
+                self._gpio_poller = None
+            if self._controller_scheduler is not None:
+                self._controller_scheduler.close()
+                self._controller_scheduler = None
+            if self._adc_dispatcher is not None:
+                # Let callbacks already running finish, so none of them write to the board once it's stopped
+                self._adc_dispatcher.close()
+                self._adc_dispatcher = None
+            if self._transaction is not None:
+                self._transaction.cancel()
             for motor in motors:
                 self.set_motor_speed(motor, 0)
             for servo in servos:
                 self.disable_servo(servo)
             for led in leds:
                 self.set_led_hsv(led, 0, 0, 0)
+            if self._bus is not None:
+                self._bus.close()
             if callable(getattr(self, '_stop', None)):
                 self._stop(**kwargs)
+            if self._resilience is not None:
+                # Writes stored while the breaker is open are kept, so the stopped values are sent on recovery
+                self._resilience.close()
+            if self._shared_state is not None:
+                self._shared_state.close()
+            if final_snapshot is not None:
+                try:
+                    snapshot_writer.close(final_snapshot)
+                except Exception:
+                    LOGGER.exception('unable to write final snapshot')
+
+        def add_channels(self, motors=None, servos=None, adcs=None, leds=None, encoders=None, gpios=None):
+            """
+            Add channels to a board which is already in use, for example after detecting extra hardware. The new
+            channels get the same properties, default configuration, and stop() behaviour as channels supplied to
+            add_properties, and existing channels are left alone. Channels can only be added to kinds the board
+            already had when add_properties was called. While shared state is being published, motors, servos, ADC
+            channels and LEDs can't be added as the shared memory block has a fixed layout.
+
+            :raises:
+                ValueError if a kind of channel wasn't set up by add_properties, can't be added while shared state is
+                being published, or a channel already exists, in which case no channels are added
+            """
+            requested = {MOTORS: motors, SERVOS: servos, ADCS: adcs, LEDS: leds, ENCODERS: encoders, GPIOS: gpios}
+            requested = {kind: list(indices) for kind, indices in requested.items() if indices}
+            for kind, indices in requested.items():
+                check_shared_state(kind, indices, 'add')
+                if kind not in self._config:
+                    raise ValueError(f'board was created without {kind}, unable to add {indices}')
+                prefix = channel_kinds[kind][2]
+                for index in indices:
+                    if index in self._config[kind] or indices.count(index) > 1:
+                        raise ValueError(f'{prefix}{index} already exists')
+                    if hasattr(Board, f'{prefix}{index}'):
+                        raise ValueError(f'{prefix}{index} has the same name as an existing property or method')
+            for kind, indices in requested.items():
+                channel_list, add_channel, _ = channel_kinds[kind]
+                for index in indices:
+                    add_channel(index)
+                    channel_list.append(index)
+            if requested:
+                self._channel_generation += 1
+
+        def remove_channels(self, motors=None, servos=None, adcs=None, leds=None, encoders=None, gpios=None):
+            """
+            Remove channels from a board which is already in use, along with their properties and configuration. No
+            values are written to the removed channels, so stop or disable them first if the hardware is still there.
+            While shared state is being published, motors, servos, ADC channels and LEDs can't be removed.
+
+            :raises:
+                ValueError if a channel doesn't exist, can't be removed while shared state is being published, or is
+                used by the drive mixer, a derived channel or a controller, in which case no channels are removed
+            """
+            requested = {MOTORS: motors, SERVOS: servos, ADCS: adcs, LEDS: leds, ENCODERS: encoders, GPIOS: gpios}
+            requested = {kind: list(indices) for kind, indices in requested.items() if indices}
+            for kind, indices in requested.items():
+                check_shared_state(kind, indices, 'remove')
+                prefix = channel_kinds[kind][2]
+                for index in indices:
+                    if index not in self._config.get(kind, {}):
+                        raise ValueError(f'{prefix}{index} does not exist')
+                    name = f'{prefix}{index}'
+                    if kind == MOTORS and self._mixer is not None and index in self._mixer.motors:
+                        raise ValueError(f'{name} is used by the drive mixer')
+                    if kind == ADCS:
+                        for derived_name, channel in self._derived.items():
+                            if index in channel.adcs:
+                                raise ValueError(f'{name} is used by derived channel {derived_name}')
+                    for output, controller in self._controllers.items():
+                        if name in (output, controller.input) or controller.input == f'{name}_velocity':
+                            raise ValueError(f'{name} is used by the controller for {output}')
+            for kind, indices in requested.items():
+                channel_list = channel_kinds[kind][0]
+                for index in indices:
+                    for name in injected.pop((kind, index)):
+                        delattr(Board, name)
+                    del self._config[kind][index]
+                    channel_list.remove(index)
+            if requested:
+                self._channel_generation += 1
 
         @property
         def config(self):
@@ -166,6 +451,13 @@ def add_properties(board, motors=None, servos=None, adcs=None, default_adc_divis
                 result[MOTORS] = {index: m.config for index, m in self._config[MOTORS].items()}
             if SERVOS in self._config:
                 result[SERVOS] = {index: s.config for index, s in self._config[SERVOS].items()}
+            if ENCODERS in self._config:
+                result[ENCODERS] = {index: e.config for index, e in self._config[ENCODERS].items()}
+            if GPIOS in self._config:
+                result[GPIOS] = {index: g.config for index, g in self._config[GPIOS].items()}
+            if self._controllers or self._controller_config:
+                result[CONTROLLERS] = dict(self._controller_config)
+                result[CONTROLLERS].update({output: c.config for output, c in self._controllers.items()})
             return result
 
         @config.setter
@@ -191,11 +483,33 @@ def add_properties(board, motors=None, servos=None, adcs=None, default_adc_divis
                         self._config[SERVOS][index].config = servo
                     else:
                         LOGGER.warning(f'config contained servo configuration for invalid index {index}')
+            if ENCODERS in d and ENCODERS in self._config:
+                for index, e in d[ENCODERS].items():
+                    if index in self._config[ENCODERS]:
+                        self._config[ENCODERS][index].config = e
+                    else:
+                        LOGGER.warning(f'config contained encoder configuration for invalid index {index}')
+            if GPIOS in d and GPIOS in self._config:
+                for index, g in d[GPIOS].items():
+                    if index in self._config[GPIOS]:
+                        self._config[GPIOS][index].config = g
+                    else:
+                        LOGGER.warning(f'config contained gpio configuration for invalid index {index}')
+            if CONTROLLERS in d:
+                for output, c in d[CONTROLLERS].items():
+                    if output in self._controllers:
+                        self._controllers[output].config = c
+                    else:
+                        # Kept until add_controller is called for this output
+                        LOGGER.debug(f'config contained controller configuration for {output}, which has no '
+                                     f'controller yet')
+                        self._controller_config[output] = dict(c)
 
         def save_config(self, filename):
             """
             Write current configuration to the specified file
             """
+            import yaml
             with open(filename, 'w') as file:
                 yaml.dump(self.config, file)
 
@@ -203,6 +517,7 @@ def add_properties(board, motors=None, servos=None, adcs=None, default_adc_divis
             """
             Read configuration from the specified file
             """
+            import yaml
             with open(filename) as file:
                 self.config = yaml.load(file, Loader=yaml.FullLoader)
 
@@ -237,17 +552,85 @@ def add_properties(board, motors=None, servos=None, adcs=None, default_adc_divis
             """
             return leds
 
+        @property
+        def encoders(self):
+            """
+            An array of encoder indices, corresponding to the encXX and encXX_velocity properties
+            """
+            return encoders
+
+        @property
+        def gpios(self):
+            """
+            An array of GPIO pin indices, corresponding to the gpioXX properties
+            """
+            return gpios
+
+        @property
+        def derived(self):
+            """
+            An array of derived channel names, each of these is also a read-only property
+            """
+            return list(derived.keys())
+
+        @property
+        def counters(self):
+            """
+            The number of writes sent to each motor, servo, and LED, and the number of hardware reads made from each ADC
+            channel, encoder and GPIO pin, as a dict keyed by property name, i.e. {'m0': 12, 's3': 2, 'adc1': 40}
+            """
+            result = {}
+            for prefix, key, count in (('m', MOTORS, 'write_count'), ('s', SERVOS, 'write_count'),
+                                       ('adc', ADCS, 'read_count'), ('led', LEDS, 'write_count'),
+                                       ('enc', ENCODERS, 'read_count'), ('gpio', GPIOS, 'read_count')):
+                for index, c in self._config.get(key, {}).items():
+                    result[f'{prefix}{index}'] = getattr(c, count)
+            return result
+
+        @property
+        def shared_state(self):
+            """
+            The StatePublisher mirroring this board's state into shared memory if add_properties was called with
+            shared_state, otherwise None. Its name property is the name other processes use to attach to it.
+            """
+            return self._shared_state
+
+        @property
+        def bus_writer(self):
+            """
+            The BusWriter handling hardware access if add_properties was called with bus_thread=True, otherwise None
+            """
+            return self._bus
+
+        @property
+        def resilience(self):
+            """
+            The ResiliencePolicy protecting calls to the driver if add_properties was called with resilience=True,
+            otherwise None. Set its deadline, retries, backoff, failure_threshold and reset_timeout properties to
+            configure it, and read its telemetry property for failure counts and circuit breaker state.
+            """
+            return self._resilience
+
         @property
         def config_yaml(self):
             """
             Config dict as a YAML string, set to update config from a YAML string.
             """
+            import yaml
             return yaml.dump(self.config)
 
         @config_yaml.setter
         def config_yaml(self, yaml_string):
+            import yaml
             self.config = yaml.load(yaml_string, Loader=yaml.FullLoader)
 
+    # Names of the properties injected for each channel, keyed by (kind, index), so they can be removed again
+    injected = {}
+
+    def inject(key, name, prop):
+        setattr(Board, name, prop)
+        injected.setdefault(key, []).append(name)
+
     # Set up configuration dict, we only add top level keys if the corresponding facility is requested
     config = {}
     if motors:
@@ -258,42 +641,131 @@ def add_properties(board, motors=None, servos=None, adcs=None, default_adc_divis
         config[ADCS] = {}
     if leds:
         config[LEDS] = {}
+    if encoders:
+        config[ENCODERS] = {}
+    if gpios:
+        config[GPIOS] = {}
 
-    # Inject mXX, motorXX, mXX_invert, and motorXX_invert properties
-    for motor in motors:
+    # Inject mXX, motorXX, mXX_invert, motorXX_invert, mXX_scale, motorXX_scale, mXX_curve, and motorXX_curve properties
+    def add_motor(motor):
         m = Motor(motor=motor, invert=False, scale=1.0, board=board)
         config['motors'][motor] = m
+        key = (MOTORS, motor)
         for prefix in ['m', 'motor']:
-            setattr(Board, f'{prefix}{motor}', property(fget=m.get_value, fset=m.set_value))
-            setattr(Board, f'{prefix}{motor}_invert', property(fset=m.set_invert, fget=m.get_invert))
-            setattr(Board, f'{prefix}{motor}_scale', property(fset=m.set_scale, fget=m.get_scale))
+            inject(key, f'{prefix}{motor}', property(fget=m.get_value, fset=m.set_value))
+            inject(key, f'{prefix}{motor}_invert', property(fset=m.set_invert, fget=m.get_invert))
+            inject(key, f'{prefix}{motor}_scale', property(fset=m.set_scale, fget=m.get_scale))
+            inject(key, f'{prefix}{motor}_curve', property(fset=m.set_curve, fget=m.get_curve))
 
-    # Inject sXX, servoXX, sXX_config, and servoXX_config properties
-    for servo in servos:
+    # Inject sXX, servoXX, sXX_config, servoXX_config, sXX_curve, and servoXX_curve properties
+    def add_servo(servo):
         s = Servo(servo=servo, pulse_min=500, pulse_max=2500, board=board)
         config['servos'][servo] = s
+        key = (SERVOS, servo)
         for prefix in ['s', 'servo']:
-            setattr(Board, f'{prefix}{servo}', property(fset=s.set_value, fget=s.get_value))
-            setattr(Board, f'{prefix}{servo}_config', property(fset=s.set_config, fget=s.get_config))
+            inject(key, f'{prefix}{servo}', property(fset=s.set_value, fget=s.get_value))
+            inject(key, f'{prefix}{servo}_config', property(fset=s.set_config, fget=s.get_config))
+            inject(key, f'{prefix}{servo}_curve', property(fset=s.set_curve, fget=s.get_curve))
 
-    # Inject adcXX and adcXX_divisor properties
-    for adc in adcs:
+    # Inject adcXX, adcXX_divisor, adcXX_cache_time, adcXX_calibration, and adcXX_raw properties
+    def add_adc(adc):
         a = ADC(adc=adc, divisor=default_adc_divisor, cache_time=0, board=board)
         config[ADCS][adc] = a
-        setattr(Board, f'adc{adc}', property(fget=a.get_value))
-        setattr(Board, f'adc{adc}_divisor', property(fset=a.set_divisor, fget=a.get_divisor))
-        setattr(Board, f'adc{adc}_cache_time', property(fset=a.set_cache_time, fget=a.get_cache_time))
+        key = (ADCS, adc)
+        inject(key, f'adc{adc}', property(fget=a.get_value))
+        inject(key, f'adc{adc}_divisor', property(fset=a.set_divisor, fget=a.get_divisor))
+        inject(key, f'adc{adc}_cache_time', property(fset=a.set_cache_time, fget=a.get_cache_time))
+        inject(key, f'adc{adc}_calibration', property(fset=a.set_calibration, fget=a.get_calibration))
+        inject(key, f'adc{adc}_raw', property(fget=a.get_raw))
+
+    # Inject encXX, encXX_velocity, encXX_counts_per_revolution, encXX_invert, and encXX_velocity_window properties
+    def add_encoder(encoder):
+        from approxeng.hwsupport.encoders import Encoder
+        e = Encoder(encoder=encoder, board=board)
+        config[ENCODERS][encoder] = e
+        key = (ENCODERS, encoder)
+        inject(key, f'enc{encoder}', property(fget=e.get_value))
+        inject(key, f'enc{encoder}_velocity', property(fget=e.get_velocity))
+        inject(key, f'enc{encoder}_counts_per_revolution',
+               property(fget=e.get_counts_per_revolution, fset=e.set_counts_per_revolution))
+        inject(key, f'enc{encoder}_invert', property(fget=e.get_invert, fset=e.set_invert))
+        inject(key, f'enc{encoder}_velocity_window', property(fget=e.get_velocity_window, fset=e.set_velocity_window))
+
+    # Inject gpioXX, gpioXX_invert, and gpioXX_debounce properties
+    def add_gpio(gpio):
+        from approxeng.hwsupport.gpios import GPIO
+        g = GPIO(gpio=gpio, board=board)
+        config[GPIOS][gpio] = g
+        key = (GPIOS, gpio)
+        inject(key, f'gpio{gpio}', property(fget=g.get_value, fset=g.set_value))
+        inject(key, f'gpio{gpio}_invert', property(fget=g.get_invert, fset=g.set_invert))
+        inject(key, f'gpio{gpio}_debounce', property(fget=g.get_debounce, fset=g.set_debounce))
 
     # Inject ledXX, ledXX_brightness, ledXX_gamma, and ledXX_saturation properties
-    for led in leds:
+    def add_led(led):
+        from approxeng.hwsupport.leds import LED
         l = LED(led=led, board=board)
         config[LEDS][led] = l
-        setattr(Board, f'led{led}', property(fget=l.get_colour, fset=l.set_colour))
-        setattr(Board, f'led{led}_brightness', property(fget=l.get_brightness, fset=l.set_brightness))
-        setattr(Board, f'led{led}_gamma', property(fget=l.get_gamma, fset=l.set_gamma))
-        setattr(Board, f'led{led}_saturation', property(fget=l.get_saturation, fset=l.set_saturation))
-        setattr(Board, f'led{led}_rgb', property(fget=l.get_colour_rgb, fset=l.set_colour_rgb))
+        key = (LEDS, led)
+        inject(key, f'led{led}', property(fget=l.get_colour, fset=l.set_colour))
+        inject(key, f'led{led}_brightness', property(fget=l.get_brightness, fset=l.set_brightness))
+        inject(key, f'led{led}_gamma', property(fget=l.get_gamma, fset=l.set_gamma))
+        inject(key, f'led{led}_saturation', property(fget=l.get_saturation, fset=l.set_saturation))
+        inject(key, f'led{led}_rgb', property(fget=l.get_colour_rgb, fset=l.set_colour_rgb))
+        inject(key, f'led{led}_name', property(fget=l.get_colour_name))
+        inject(key, f'led{led}_bits', property(fget=l.get_bits, fset=l.set_bits))
+        inject(key, f'led{led}_dither', property(fget=l.get_dither, fset=l.set_dither))
+
+    # The shared memory block's layout is fixed when it's created, so the channels it mirrors can't change while it's
+    # being published, otherwise readers in other processes would silently see stale or missing channels
+    def check_shared_state(kind, indices, action):
+        if board._shared_state is not None and kind in (MOTORS, SERVOS, ADCS, LEDS):
+            raise ValueError(f'unable to {action} {kind} {indices} while shared state is being published, close '
+                             f'shared_state first')
+
+    # For each kind of channel, the list of indices, the function adding a channel, and the prefix of its main property
+    channel_kinds = {MOTORS: (motors, add_motor, 'm'), SERVOS: (servos, add_servo, 's'), ADCS: (adcs, add_adc, 'adc'),
+                     ENCODERS: (encoders, add_encoder, 'enc'), GPIOS: (gpios, add_gpio, 'gpio'),
+                     LEDS: (leds, add_led, 'led')}
+    for indices, add_channel, _ in channel_kinds.values():
+        for index in indices:
+            add_channel(index)
+
+    # Inject a read-only property for each derived channel
+    for name, channel in derived.items():
+        if hasattr(Board, name) or name in _LAZY_ATTRIBUTES:
+            raise ValueError(f'derived channel {name} has the same name as an existing property or method')
+        setattr(Board, name, property(fget=channel.get_value))
 
     # Set the supplied object's class to the newly created subclass
     board._config = config
+    board._mixer = drive
+    board._derived = derived
+    board._adc_dispatcher = None
+    board._adc_sampler = None
+    board._gpio_poller = None
+    board._controllers = {}
+    board._controller_config = {}
+    board._controller_scheduler = None
+    board._shared_state = None
+    board._transaction = None
+    board._state_lock = NO_LOCK
+    board._snapshot_writer = None
+    # Incremented by add_channels and remove_channels, so anything caching the board's properties knows to look again
+    board._channel_generation = 0
     board.__class__ = Board
+    if resilience:
+        # Before the bus writer, so the bus thread calls the driver through the policy
+        from approxeng.hwsupport.resilience import ResiliencePolicy
+        board._resilience = ResiliencePolicy(board)
+    else:
+        board._resilience = None
+    if shared_state:
+        from approxeng.hwsupport.shared import StatePublisher
+        board._shared_state = StatePublisher(board, name=None if shared_state is True else shared_state)
+    if bus_thread:
+        from approxeng.hwsupport.bus import BusWriter
+        board._bus = BusWriter(board)
+        board._state_lock = board._bus.state_lock
+    else:
+        board._bus = None
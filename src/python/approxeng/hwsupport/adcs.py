@@ -1,12 +1,110 @@
-# -*- coding: future_fstrings -*-
-
 import logging
 import time
+from bisect import bisect_right
 
 LOGGER = logging.getLogger(name='approxeng.hwsupport.adcs')
 ADCS = 'adcs'
 
 
+class Calibration:
+    """
+    Converts raw ADC readings to measured values using a set of (raw, measured) calibration points. You won't normally
+    use this class directly, set the adcXX_calibration property instead.
+
+    With no degree the points are joined by straight lines, readings beyond the first or last point are extrapolated
+    along the first or last line, and a single point is treated as a line through zero. With a degree a least squares
+    polynomial is fitted through the points, which needs more points than the degree but copes better with noisy
+    measurements. Either way the fit is calculated once when the calibration is set, not on each reading.
+    """
+
+    def __init__(self, points, degree=None):
+        """
+        :param points:
+            A sequence of (raw, measured) pairs
+        :param degree:
+            None for piecewise-linear interpolation, or an int >= 1 for a least squares polynomial fit
+        :raises:
+            ValueError if the points can't be fitted
+        """
+        try:
+            points = sorted((float(raw), float(measured)) for raw, measured in points)
+        except (TypeError, ValueError):
+            raise ValueError(f'calibration must be a sequence of (raw, measured) pairs, was {points}')
+        if not points:
+            raise ValueError('calibration must have at least one point')
+        self.points = points
+        self.degree = degree
+        if degree is None:
+            for (r1, _), (r2, _) in zip(points, points[1:]):
+                if r1 == r2:
+                    raise ValueError(f'calibration has more than one point with raw value {r1}')
+            self.raws = [raw for raw, _ in points]
+            if len(points) == 1:
+                raw, measured = points[0]
+                if raw == 0:
+                    raise ValueError('single point calibration must have a non-zero raw value')
+                ratio = measured / raw
+                self.convert = lambda value: value * ratio
+            else:
+                # Gradient and intercept for each segment, extending the first and last segments outwards
+                segments = []
+                for (r1, m1), (r2, m2) in zip(points, points[1:]):
+                    gradient = (m2 - m1) / (r2 - r1)
+                    segments.append((gradient, m1 - gradient * r1))
+                self.lines = [segments[0]] + segments + [segments[-1]]
+                self.convert = self._interpolate
+        else:
+            if not isinstance(degree, int) or degree < 1:
+                raise ValueError(f'calibration degree must be None or an int >= 1, was {degree}')
+            if len(set(raw for raw, _ in points)) <= degree:
+                raise ValueError(f'degree {degree} calibration needs at least {degree + 1} distinct raw values')
+            self.coefficients = self._fit(points, degree)
+            self.convert = self._evaluate
+
+    def _interpolate(self, value):
+        gradient, intercept = self.lines[bisect_right(self.raws, value)]
+        return gradient * value + intercept
+
+    def _evaluate(self, value):
+        x = value / self.x_scale
+        result = 0.0
+        for coefficient in self.coefficients:
+            result = result * x + coefficient
+        return result
+
+    def _fit(self, points, degree):
+        """
+        Least squares polynomial fit by solving the normal equations, raw values are scaled to at most 1.0 first to
+        keep the matrix well conditioned. Returns coefficients, highest power first.
+        """
+        self.x_scale = max(abs(raw) for raw, _ in points) or 1.0
+        xs = [raw / self.x_scale for raw, _ in points]
+        ys = [measured for _, measured in points]
+        size = degree + 1
+        powers = [sum(x ** n for x in xs) for n in range(2 * size - 1)]
+        matrix = [[powers[row + column] for column in range(size)] +
+                  [sum(y * x ** row for x, y in zip(xs, ys))] for row in range(size)]
+        # Gaussian elimination with partial pivoting
+        for column in range(size):
+            pivot = max(range(column, size), key=lambda row: abs(matrix[row][column]))
+            if abs(matrix[pivot][column]) < 1e-12:
+                raise ValueError(f'unable to fit degree {degree} calibration to {points}')
+            matrix[column], matrix[pivot] = matrix[pivot], matrix[column]
+            for row in range(column + 1, size):
+                factor = matrix[row][column] / matrix[column][column]
+                for c in range(column, size + 1):
+                    matrix[row][c] -= factor * matrix[column][c]
+        solution = [0.0] * size
+        for row in reversed(range(size)):
+            solution[row] = (matrix[row][size] - sum(matrix[row][c] * solution[c]
+                                                     for c in range(row + 1, size))) / matrix[row][row]
+        return list(reversed(solution))
+
+    @property
+    def config(self):
+        return [[raw, measured] for raw, measured in self.points]
+
+
 class ADC:
     """
     Holds configuration for a single ADC channel, you won't use this class directly.
@@ -19,10 +117,15 @@ class ADC:
         self.board = board
         self.last_reading_time = None
         self.last_reading_value = None
+        self.read_count = 0
+        self.calibration = None
+        self.subscriptions = []
 
     @property
     def config(self):
-        return {'divisor': self.divisor, 'cache_time': self.cache_time}
+        return {'divisor': self.divisor, 'cache_time': self.cache_time,
+                'calibration': self.calibration.config if self.calibration else None,
+                'calibration_degree': self.calibration.degree if self.calibration else None}
 
     @config.setter
     def config(self, d):
@@ -30,6 +133,41 @@ class ADC:
             self.set_divisor(None, d['divisor'])
         if 'cache_time' in d:
             self.set_cache_time(None, d['cache_time'])
+        if 'calibration' in d:
+            self.set_calibration(None, (d['calibration'], d.get('calibration_degree')))
+
+    def convert(self, raw_value):
+        """
+        Convert a raw reading using the calibration if there is one, or the divisor otherwise
+        """
+        if self.calibration is not None:
+            return self.calibration.convert(float(raw_value))
+        return float(raw_value) / self.divisor
+
+    def get_calibration(self, _):
+        return self.calibration.config if self.calibration else None
+
+    def set_calibration(self, _, value):
+        """
+        Set the calibration, either a list of (raw, measured) points for piecewise-linear calibration, a tuple of
+        (points, degree) for a least squares polynomial fit, or None to go back to using the divisor
+        """
+        degree = None
+        if isinstance(value, tuple) and len(value) == 2 and (value[1] is None or isinstance(value[1], int)):
+            value, degree = value
+        if not value:
+            self.calibration = None
+        else:
+            try:
+                self.calibration = Calibration(value, degree)
+            except ValueError as e:
+                raise ValueError(f'adc{self.adc}_calibration invalid, {e}')
+        self.last_reading_time = None
+
+    def get_raw(self, _):
+        with self.board._state_lock:
+            self.read_count += 1
+        return self.board._read_adc(adc=self.adc)
 
     def get_divisor(self, _):
         return self.divisor
@@ -58,7 +196,7 @@ class ReadADCsMixin:
 
     def read_adc(self, adc, digits=2, **kwargs):
         """
-        Read an ADC value, applying the configured multiplier
+        Read an ADC value, applying the configured calibration or divisor
 
         :param adc:
             The adc channel to read, must be a value in the array of adcs
@@ -74,26 +212,152 @@ class ReadADCsMixin:
             if adc not in self._config[ADCS]:
                 raise ValueError(f'adc adc{adc} is not in {list(self._config[ADCS].keys())}')
             config = self._config[ADCS][adc]
-            # Check for caching
-            new_value = False
-            if config.cache_time == 0:
-                # Caching is disabled
-                new_value = True
-            else:
-                # Caching is enabled, need the current time
-                now = time.time()
-                if config.last_reading_time is None or config.last_reading_time < (now - config.cache_time):
-                    # Enabled, cached value out of date
-                    new_value = True
-                    config.last_reading_time = now
-            if new_value:
+            with self._state_lock:
+                due = self._adc_reading_due(config)
+                if due:
+                    config.read_count += 1
+            if due:
                 # Need a new value for the cache and to return
                 raw_value = self._read_adc(adc=adc, **kwargs)
-                adjusted_value = round(float(raw_value) / config.divisor, ndigits=digits)
-                config.last_reading_value = adjusted_value
-                return adjusted_value
+                return self._store_adc_reading(config, raw_value, digits)
             else:
                 # Return cached value
                 return config.last_reading_value
         else:
             raise ValueError(f'board has no adc functions, unable to read adc{adc}')
+
+    def read_adcs(self, adcs=None, digits=2, **kwargs):
+        """
+        Read several ADC values at once. Channels with a cached value which is still current aren't read. If the
+        underlying board provides a _read_adcs(adcs) method returning a dict of channel to raw value this is called
+        once for all the channels which need reading, otherwise _read_adc is called for each in turn.
+
+        :param adcs:
+            A list of adc channels to read, defaults to None to read all channels
+        :param digits:
+            Number of digits to round each result, defaults to 2
+        :param kwargs:
+            Any additional arguments to provide to the underlying _read_adcs or _read_adc method
+        :return:
+            A dict of channel to value
+        :raises:
+            ValueError if any of the supplied channels don't exist, in which case no channels are read
+        """
+        if adcs is None:
+            adcs = list(self._config[ADCS].keys())
+        for adc in adcs:
+            if adc not in self._config[ADCS]:
+                raise ValueError(f'adc adc{adc} is not in {list(self._config[ADCS].keys())}')
+        LOGGER.debug(f'read adcs {adcs}')
+        configs = [self._config[ADCS][adc] for adc in adcs]
+        with self._state_lock:
+            due = [config.adc for config in configs if self._adc_reading_due(config)]
+            for adc in due:
+                self._config[ADCS][adc].read_count += 1
+        if due:
+            if callable(getattr(self, '_read_adcs', None)):
+                raw_values = self._read_adcs(due, **kwargs)
+            else:
+                raw_values = {adc: self._read_adc(adc=adc, **kwargs) for adc in due}
+            for adc in due:
+                config = self._config[ADCS][adc]
+                self._store_adc_reading(config, raw_values[adc], digits)
+        return {config.adc: config.last_reading_value for config in configs}
+
+    @staticmethod
+    def _adc_reading_due(config):
+        """
+        True if a channel should be read from the hardware, False if its cached value can be used
+        """
+        if config.cache_time == 0:
+            # Caching is disabled
+            return True
+        # Caching is enabled, need the current time
+        now = time.time()
+        if config.last_reading_time is None or config.last_reading_time < (now - config.cache_time):
+            # Enabled, cached value out of date
+            config.last_reading_time = now
+            return True
+        return False
+
+    def _store_adc_reading(self, config, raw_value, digits):
+        """
+        Convert a raw reading, cache it, and pass it on to shared state and subscriptions
+        """
+        adjusted_value = round(config.convert(raw_value), ndigits=digits)
+        with self._state_lock:
+            config.last_reading_value = adjusted_value
+        if self._shared_state is not None:
+            self._shared_state.update(ADCS, {config.adc: adjusted_value})
+        if config.subscriptions:
+            self._notify_adc_subscriptions(config, adjusted_value)
+        return adjusted_value
+
+    def on_adc(self, adc, callback, above=None, below=None, hysteresis=0.0):
+        """
+        Subscribe to changes on an ADC channel. Subscriptions are checked whenever a new value is read from the
+        hardware, by anything reading the channel or by the sampler started with sample_adcs, so you don't need your
+        own polling loop. Callbacks are made on a small pool of threads shared by all subscriptions, and are
+        dropped with a warning if too many are waiting to run.
+
+        If either above or below is set this is a threshold subscription, and callback(adc, value, event) is called
+        with event 'above' or 'below' when the value crosses the corresponding threshold, and 'in_range' when it
+        returns between them. The value must move back past the threshold by at least hysteresis before it is
+        considered back in range, so a noisy value near a threshold doesn't produce a stream of callbacks. If the
+        first reading is outside the thresholds the callback is called straight away.
+
+        If neither is set this is a change subscription, and callback(adc, value, 'change') is called for the first
+        reading and then whenever the value differs from the last one reported by more than hysteresis.
+
+        :param adc:
+            The adc channel to watch, must be a value in the array of adcs
+        :param callback:
+            Function called as callback(adc, value, event)
+        :param above:
+            Upper threshold, or None
+        :param below:
+            Lower threshold, or None
+        :param hysteresis:
+            Amount by which the value must move back past a threshold, or change for a change subscription, defaults
+            to 0.0
+        :return:
+            The subscription, call cancel() on this to unsubscribe
+        :raises:
+            ValueError if the channel doesn't exist, or the thresholds or hysteresis are invalid
+        """
+        from approxeng.hwsupport.subscriptions import ADCSubscription, Dispatcher
+        if adc not in self._config[ADCS]:
+            raise ValueError(f'adc adc{adc} is not in {list(self._config[ADCS].keys())}')
+        subscription = ADCSubscription(adc=adc, callback=callback, above=above, below=below, hysteresis=hysteresis,
+                                       board=self)
+        if self._adc_dispatcher is None:
+            self._adc_dispatcher = Dispatcher()
+        self._config[ADCS][adc].subscriptions.append(subscription)
+        return subscription
+
+    def sample_adcs(self, interval):
+        """
+        Start or stop a background thread reading every ADC channel with subscriptions at a fixed interval. Reads go
+        through read_adc, so each channel's cache time still applies.
+
+        :param interval:
+            Seconds between reads, or None to stop sampling
+        """
+        from approxeng.hwsupport.subscriptions import Sampler
+        if self._adc_sampler is not None:
+            self._adc_sampler.close()
+            self._adc_sampler = None
+        if interval is not None:
+            if interval <= 0:
+                raise ValueError(f'sample interval must be > 0, was {interval}')
+            self._adc_sampler = Sampler(board=self, interval=interval)
+
+    def _notify_adc_subscriptions(self, config, value):
+        if self._adc_dispatcher is None:
+            # Closed by stop()
+            from approxeng.hwsupport.subscriptions import Dispatcher
+            self._adc_dispatcher = Dispatcher()
+        for subscription in list(config.subscriptions):
+            event = subscription.check(value)
+            if event is not None:
+                self._adc_dispatcher.submit(subscription.callback, config.adc, value, event)
@@ -0,0 +1,430 @@
+import logging
+import threading
+import time
+
+LOGGER = logging.getLogger(name='approxeng.hwsupport.bus')
+
+# Order in which waiting traffic is sent, lowest first. Writes from stop() also skip the bandwidth and rate limits, see
+# BusWriter.flush
+PRIORITIES = {'motor': 0, 'servo': 1, 'adc': 2, 'led': 3}
+
+
+class _PendingRead:
+    """
+    An ADC read in progress, shared by all threads asking for the same channel at the same time
+    """
+
+    def __init__(self):
+        self.done = threading.Event()
+        self.value = None
+        self.error = None
+
+
+class _ClassStatistics:
+    """
+    Queueing statistics for one class of traffic
+    """
+
+    def __init__(self):
+        self.sent = 0
+        self.coalesced = 0
+        self.total_delay = 0.0
+        self.max_delay = 0.0
+
+    def record(self, delay):
+        self.sent += 1
+        self.total_delay += delay
+        self.max_delay = max(self.max_delay, delay)
+
+    @property
+    def summary(self):
+        return {'sent': self.sent, 'coalesced': self.coalesced,
+                'mean_delay': self.total_delay / self.sent if self.sent else 0.0, 'max_delay': self.max_delay}
+
+
+class BusWriter:
+    """
+    Owns all hardware access for a board when add_properties is called with bus_thread=True. You won't normally create
+    this class directly, use the board's bus_writer property to configure it.
+
+    The board's _set_motor_speed, _set_motor_speeds, _set_servo_pulsewidth and _set_led_rgb methods are replaced on the
+    instance by versions which store the requested value in a per-channel slot and return immediately. A single bus
+    thread sends the latest value for each changed channel to the hardware, so a burst of writes to the same channel
+    from any number of threads results in a single call to the driver. Calls to _read_adc and _read_adcs are made while
+    holding the same bus lock, and threads asking for the same channel while a read is in progress share its result.
+    Calls to _read_encoder, _read_encoders, _read_gpio, _read_gpios and _write_gpio also hold the bus lock, but aren't
+    otherwise scheduled.
+
+    Waiting traffic is sent in priority order, motors first, then servos, then ADC reads, then LEDs. Two limits can be
+    set to stop low priority traffic crowding out motor commands on a slow bus:
+
+    bandwidth - the maximum number of hardware operations per second across all channels, None for no limit
+    rate_limits - a dict of maximum updates per second, keyed either by class ('motor', 'servo', 'led') or by class and
+    channel, i.e. ('led', 3), with the per-channel entry taking precedence
+
+    Writes held back by either limit stay in their channel's slot, so later writes replace them and only the latest
+    value is sent when the limit allows. The writes made by the board's stop() method ignore both limits and are sent
+    before any other traffic.
+
+    The board's own record of each channel, such as motor and servo values, write and read counts, and cached ADC
+    readings, is updated while holding state_lock, which the board uses in place of a lock that does nothing when
+    there's no bus thread. Writes hold it while storing a value and handing it to the bus thread, so the value recorded
+    for a channel is always the one which will be sent last.
+    """
+
+    def __init__(self, board, bandwidth=None, rate_limits=None):
+        self._lock = threading.Lock()
+        self._changed = threading.Condition(self._lock)
+        self._bus_lock = threading.RLock()
+        self.state_lock = threading.RLock()
+        self._pending = {}
+        self._reads = {}
+        self._reads_waiting = 0
+        self._last_sent = {}
+        self._busy = False
+        self._running = True
+        self._exited = False
+        self._urgent = 0
+        self.bandwidth = bandwidth
+        self.rate_limits = dict(rate_limits or {})
+        self._tokens = 1.0
+        self._token_time = time.monotonic()
+        self.statistics = {kind: _ClassStatistics() for kind in PRIORITIES}
+        self.writes_requested = 0
+        self.writes_sent = 0
+        self.reads_requested = 0
+        self.reads_sent = 0
+
+        # Capture the original driver methods, then shadow them on the instance
+        self._set_motor_speed = getattr(board, '_set_motor_speed', None)
+        self._set_motor_speeds = getattr(board, '_set_motor_speeds', None)
+        self._set_servo_pulsewidth = getattr(board, '_set_servo_pulsewidth', None)
+        self._set_led_rgb = getattr(board, '_set_led_rgb', None)
+        self._read_adc = getattr(board, '_read_adc', None)
+        self._read_adcs = getattr(board, '_read_adcs', None)
+        self._read_encoder = getattr(board, '_read_encoder', None)
+        self._read_encoders = getattr(board, '_read_encoders', None)
+        self._read_gpio = getattr(board, '_read_gpio', None)
+        self._read_gpios = getattr(board, '_read_gpios', None)
+        self._write_gpio = getattr(board, '_write_gpio', None)
+        if callable(self._set_motor_speed):
+            board._set_motor_speed = lambda motor, speed, **kwargs: self._queue('motor', motor, (speed,), kwargs)
+        if callable(self._set_motor_speeds):
+            board._set_motor_speeds = self._queue_motor_speeds
+        if callable(self._set_servo_pulsewidth):
+            board._set_servo_pulsewidth = lambda servo, pulse_width, **kwargs: self._queue('servo', servo,
+                                                                                          (pulse_width,), kwargs)
+        if callable(self._set_led_rgb):
+            board._set_led_rgb = lambda led, r, g, b, **kwargs: self._queue('led', led, (r, g, b), kwargs)
+        if callable(self._read_adc):
+            board._read_adc = self.read_adc
+        if callable(self._read_adcs):
+            board._read_adcs = self.read_adcs
+        if callable(self._read_encoder):
+            board._read_encoder = self.read_encoder
+        if callable(self._read_encoders):
+            board._read_encoders = self.read_encoders
+        if callable(self._read_gpio):
+            board._read_gpio = self.read_gpio
+        if callable(self._read_gpios):
+            board._read_gpios = self.read_gpios
+        if callable(self._write_gpio):
+            board._write_gpio = self.write_gpio
+
+        self._thread = threading.Thread(target=self._run, name='hwsupport-bus', daemon=True)
+        self._thread.start()
+
+    @property
+    def queue_delays(self):
+        """
+        For each class of traffic, a dict of the number of operations sent, the number of writes replaced by a later
+        write to the same channel before being sent, and the mean and maximum time in seconds spent waiting
+        """
+        with self._lock:
+            return {kind: statistics.summary for kind, statistics in self.statistics.items()}
+
+    def _store(self, kind, channel, args, kwargs, now):
+        key = (kind, channel)
+        previous = self._pending.get(key)
+        if previous is not None:
+            self.statistics[kind].coalesced += 1
+        # Keep the time the channel started waiting, so delays include time spent being replaced by newer values
+        self._pending[key] = (args, kwargs, now if previous is None else previous[2])
+
+    def _queue(self, kind, channel, args, kwargs):
+        now = time.monotonic()
+        with self._lock:
+            self.writes_requested += 1
+            if not self._exited:
+                self._store(kind, channel, args, kwargs, now)
+                self._changed.notify_all()
+                return
+        self._send_now({(kind, channel): (args, kwargs, now)})
+
+    def _queue_motor_speeds(self, speeds, **kwargs):
+        now = time.monotonic()
+        with self._lock:
+            self.writes_requested += len(speeds)
+            if not self._exited:
+                for motor, speed in speeds.items():
+                    self._store('motor', motor, (speed,), kwargs, now)
+                self._changed.notify_all()
+                return
+        self._send_now({('motor', motor): ((speed,), kwargs, now) for motor, speed in speeds.items()})
+
+    def _send_now(self, batch):
+        """
+        Send writes from the calling thread once the bus thread has been closed
+        """
+        with self._bus_lock:
+            self._send(batch)
+
+    def _refill(self, now):
+        """
+        Top up the bandwidth budget, allowing a burst of at most a twentieth of a second's worth of operations
+        """
+        if self.bandwidth:
+            burst = max(1.0, self.bandwidth / 20)
+            self._tokens = min(burst, self._tokens + (now - self._token_time) * self.bandwidth)
+        self._token_time = now
+
+    def _allowed_at(self, key):
+        """
+        The earliest time the rate limits allow another operation on a channel
+        """
+        limit = self.rate_limits.get(key, self.rate_limits.get(key[0]))
+        if limit and key in self._last_sent:
+            return self._last_sent[key] + 1.0 / limit
+        return 0.0
+
+    def _token_wait(self):
+        return (1.0 - self._tokens) / self.bandwidth
+
+    def _select(self, now):
+        """
+        Choose the writes to send next, in priority order and within the bandwidth budget and rate limits. Must be
+        called holding the lock.
+
+        :return:
+            A tuple of a dict of writes to send, and a number of seconds to wait before trying again if nothing could
+            be sent, or None to wait until something changes
+        """
+        urgent = self._urgent or not self._running
+        self._refill(now)
+        eligible = []
+        wake = None
+        for key, (args, kwargs, queued) in self._pending.items():
+            kind, channel = key
+            # LEDs give way to any ADC read waiting for the bus
+            if kind == 'led' and self._reads_waiting and not urgent:
+                continue
+            allowed = self._allowed_at(key)
+            if allowed > now and not urgent:
+                wake = allowed - now if wake is None else min(wake, allowed - now)
+                continue
+            eligible.append((PRIORITIES[kind], queued, key))
+        if not eligible:
+            return {}, wake
+        eligible.sort()
+        if self.bandwidth and not urgent:
+            count = int(self._tokens)
+            if count == 0:
+                return {}, self._token_wait()
+            eligible = eligible[:count]
+            self._tokens -= len(eligible)
+        return {key: self._pending.pop(key) for _, _, key in eligible}, None
+
+    def _run(self):
+        while True:
+            with self._lock:
+                while True:
+                    if not self._running and not self._pending:
+                        self._exited = True
+                        return
+                    batch, wake = self._select(time.monotonic())
+                    if batch:
+                        break
+                    self._changed.wait(timeout=wake)
+                self._busy = True
+            try:
+                with self._bus_lock:
+                    self._send(batch)
+            finally:
+                now = time.monotonic()
+                with self._lock:
+                    for key, (args, kwargs, queued) in batch.items():
+                        self._last_sent[key] = now
+                        self.statistics[key[0]].record(now - queued)
+                    self._busy = False
+                    self._changed.notify_all()
+
+    def _send(self, pending):
+        """
+        Send a set of writes to the hardware. Motor writes without extra arguments are sent in a single call if the
+        board has a _set_motor_speeds method.
+        """
+        if callable(self._set_motor_speeds):
+            speeds = {channel: args[0] for (kind, channel), (args, kwargs, _) in pending.items()
+                      if kind == 'motor' and not kwargs}
+            if speeds:
+                self._call(self._set_motor_speeds, speeds)
+                self.writes_sent += len(speeds)
+                pending = {key: value for key, value in pending.items()
+                           if key[0] != 'motor' or key[1] not in speeds}
+        hooks = {'motor': self._set_motor_speed, 'servo': self._set_servo_pulsewidth, 'led': self._set_led_rgb}
+        for (kind, channel), (args, kwargs, _) in pending.items():
+            self._call(hooks[kind], channel, *args, **kwargs)
+            self.writes_sent += 1
+
+    @staticmethod
+    def _call(hook, *args, **kwargs):
+        try:
+            hook(*args, **kwargs)
+        except Exception:
+            LOGGER.exception(f'error writing to hardware with {hook.__name__}{args}')
+
+    def _wait_for_read_slot(self, adc):
+        """
+        Block until an ADC read may use the bus, after any motor or servo writes which could be sent now and within
+        the bandwidth budget and rate limits. Must be called holding the lock.
+        """
+        queued = time.monotonic()
+        self._reads_waiting += 1
+        try:
+            while True:
+                now = time.monotonic()
+                wake = None
+                ahead = self._running and not self._urgent and any(
+                    PRIORITIES[key[0]] < PRIORITIES['adc'] and self._allowed_at(key) <= now for key in self._pending)
+                if not ahead:
+                    allowed = self._allowed_at(('adc', adc))
+                    if allowed > now:
+                        wake = allowed - now
+                    else:
+                        self._refill(now)
+                        if not self.bandwidth or self._tokens >= 1.0:
+                            if self.bandwidth:
+                                self._tokens -= 1.0
+                            self.statistics['adc'].record(now - queued)
+                            self._last_sent[('adc', adc)] = now
+                            return
+                        wake = self._token_wait()
+                self._changed.wait(timeout=wake)
+        finally:
+            self._reads_waiting -= 1
+
+    def read_adc(self, adc, **kwargs):
+        """
+        Read a raw value from the hardware, sharing the result with any other thread reading the same channel
+        """
+        with self._lock:
+            self.reads_requested += 1
+            key = (adc, tuple(sorted(kwargs.items())))
+            read = self._reads.get(key)
+            leader = read is None
+            if leader:
+                read = self._reads[key] = _PendingRead()
+                self._wait_for_read_slot(adc)
+            else:
+                self.statistics['adc'].coalesced += 1
+        if leader:
+            try:
+                with self._bus_lock:
+                    self.reads_sent += 1
+                    read.value = self._read_adc(adc=adc, **kwargs)
+            except Exception as e:
+                read.error = e
+            finally:
+                with self._lock:
+                    del self._reads[key]
+                    self._changed.notify_all()
+                read.done.set()
+        else:
+            read.done.wait()
+        if read.error is not None:
+            raise read.error
+        return read.value
+
+    def read_adcs(self, adcs, **kwargs):
+        """
+        Read several raw values from the hardware in one call, once each channel may use the bus
+        """
+        with self._lock:
+            self.reads_requested += len(adcs)
+            for adc in adcs:
+                self._wait_for_read_slot(adc)
+        try:
+            with self._bus_lock:
+                self.reads_sent += len(adcs)
+                return self._read_adcs(adcs, **kwargs)
+        finally:
+            with self._lock:
+                self._changed.notify_all()
+
+    def read_encoder(self, encoder, **kwargs):
+        """
+        Read an encoder count from the hardware while holding the bus lock
+        """
+        with self._bus_lock:
+            return self._read_encoder(encoder=encoder, **kwargs)
+
+    def read_encoders(self, encoders, **kwargs):
+        """
+        Read several encoder counts from the hardware in one call while holding the bus lock
+        """
+        with self._bus_lock:
+            return self._read_encoders(encoders, **kwargs)
+
+    def read_gpio(self, gpio, **kwargs):
+        """
+        Read a GPIO pin from the hardware while holding the bus lock
+        """
+        with self._bus_lock:
+            return self._read_gpio(gpio=gpio, **kwargs)
+
+    def read_gpios(self, **kwargs):
+        """
+        Read all GPIO pins from the hardware in one call while holding the bus lock
+        """
+        with self._bus_lock:
+            return self._read_gpios(**kwargs)
+
+    def write_gpio(self, gpio, level, **kwargs):
+        """
+        Set a GPIO pin while holding the bus lock. GPIO writes aren't queued, as a pulse on a pin is a sequence of
+        writes which mustn't be merged.
+        """
+        with self._bus_lock:
+            self._write_gpio(gpio, level, **kwargs)
+
+    def flush(self, timeout=None, urgent=False):
+        """
+        Block until all writes requested so far have been sent to the hardware
+
+        :param timeout:
+            Maximum time to wait in seconds, or None to wait as long as it takes
+        :param urgent:
+            If True, waiting writes are sent immediately ignoring the bandwidth budget and rate limits
+        :return:
+            True if all writes were sent, False if the timeout expired first
+        """
+        with self._lock:
+            if urgent:
+                self._urgent += 1
+                self._changed.notify_all()
+            try:
+                return self._changed.wait_for(lambda: not self._pending and not self._busy, timeout=timeout)
+            finally:
+                if urgent:
+                    self._urgent -= 1
+
+    def close(self):
+        """
+        Send any outstanding writes, ignoring the bandwidth budget and rate limits, then stop the bus thread. Called by
+        the board's stop(). Later writes are sent straight to the hardware from the calling thread, still holding the
+        bus lock, so the board can carry on being used.
+        """
+        with self._lock:
+            self._running = False
+            self._changed.notify_all()
+        self._thread.join()
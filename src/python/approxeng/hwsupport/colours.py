@@ -0,0 +1,146 @@
+import colorsys
+import re
+from functools import lru_cache
+
+from approxeng.hwsupport.css4_colours import CSS4_COLOURS
+
+# The short form needs its '#', otherwise words like 'bad' or 'fed' would be taken as colours rather than rejected
+_HEX = re.compile(r'^(?:#([0-9a-f]{3})|#?([0-9a-f]{6}))$')
+_FUNCTION = re.compile(r'^(rgb|hsv)\(\s*([^,\s]+)\s*,\s*([^,\s]+)\s*,\s*([^,\s)]+)\s*\)$')
+
+
+def parse_colour(value):
+    """
+    Parse a colour into an HSV tuple of floats. Accepts any of:
+
+    1. An HSV tuple, returned unchanged
+    2. A CSS4 colour name, i.e. 'hotpink'
+    3. A hex string, '#ff8800', 'ff8800', or the short form '#f80', which must include the '#'
+    4. 'rgb(255, 136, 0)', each component either 0-255 or a percentage
+    5. 'hsv(0.1, 1.0, 1.0)', with each component from 0.0 to 1.0 as used elsewhere in this library
+    6. Three RGB bytes, as a bytes or bytearray
+
+    Strings are parsed through a bounded cache, so repeatedly setting the same colour doesn't re-parse it.
+
+    :raises:
+        ValueError if the colour can't be parsed
+    """
+    if isinstance(value, tuple):
+        return value
+    if isinstance(value, (bytes, bytearray)):
+        if len(value) != 3:
+            raise ValueError(f'colour bytes must have length 3, was {len(value)}')
+        return colorsys.rgb_to_hsv(value[0] / 255, value[1] / 255, value[2] / 255)
+    if isinstance(value, str):
+        return _parse_colour_string(value)
+    raise ValueError(f'unable to parse colour {value}')
+
+
+@lru_cache(maxsize=256)
+def _parse_colour_string(value):
+    s = value.strip().lower()
+    if s in CSS4_COLOURS:
+        return CSS4_COLOURS[s]
+    match = _HEX.match(s)
+    if match:
+        digits = match.group(1) or match.group(2)
+        if len(digits) == 3:
+            digits = ''.join(d * 2 for d in digits)
+        return colorsys.rgb_to_hsv(*(int(digits[i:i + 2], 16) / 255 for i in (0, 2, 4)))
+    match = _FUNCTION.match(s)
+    if match:
+        function, components = match.group(1), match.group(2, 3, 4)
+        try:
+            if function == 'rgb':
+                return colorsys.rgb_to_hsv(*(_parse_rgb_component(c) for c in components))
+            return float(components[0]) % 1.0, float(components[1]), float(components[2])
+        except ValueError:
+            pass
+    raise ValueError(f'unable to parse colour {value}')
+
+
+def _parse_rgb_component(component):
+    if component.endswith('%'):
+        return min(max(float(component[:-1]) / 100, 0.0), 1.0)
+    return min(max(float(component) / 255, 0.0), 1.0)
+
+
+def _rgb_to_lab(r, g, b):
+    """
+    Convert sRGB, 0.0 to 1.0, to CIELAB, in which euclidean distance roughly matches perceived colour difference
+    """
+
+    def linear(c):
+        return c / 12.92 if c <= 0.04045 else ((c + 0.055) / 1.055) ** 2.4
+
+    r, g, b = linear(r), linear(g), linear(b)
+    # D65 white point
+    x = (0.4124 * r + 0.3576 * g + 0.1805 * b) / 0.95047
+    y = 0.2126 * r + 0.7152 * g + 0.0722 * b
+    z = (0.0193 * r + 0.1192 * g + 0.9505 * b) / 1.08883
+
+    def f(t):
+        return t ** (1 / 3) if t > 0.008856 else 7.787 * t + 16 / 116
+
+    fx, fy, fz = f(x), f(y), f(z)
+    return 116 * fy - 16, 500 * (fx - fy), 200 * (fy - fz)
+
+
+def _build_tree(points, depth=0):
+    """
+    Build a KD-tree from a list of (lab, name) pairs, each node is (lab, name, axis, left, right)
+    """
+    if not points:
+        return None
+    axis = depth % 3
+    points = sorted(points, key=lambda p: p[0][axis])
+    middle = len(points) // 2
+    lab, name = points[middle]
+    return lab, name, axis, _build_tree(points[:middle], depth + 1), _build_tree(points[middle + 1:], depth + 1)
+
+
+def _search(node, target, best):
+    if node is None:
+        return best
+    lab, name, axis, left, right = node
+    dl, da, db = lab[0] - target[0], lab[1] - target[1], lab[2] - target[2]
+    distance = dl * dl + da * da + db * db
+    if distance < best[0]:
+        best = distance, name
+    offset = target[axis] - lab[axis]
+    near, far = (left, right) if offset < 0 else (right, left)
+    best = _search(near, target, best)
+    # Only search the other side of the split if it could contain something closer
+    if offset * offset < best[0]:
+        best = _search(far, target, best)
+    return best
+
+
+_TREE = _build_tree([(_rgb_to_lab(*colorsys.hsv_to_rgb(*hsv)), name) for name, hsv in sorted(CSS4_COLOURS.items())])
+
+
+@lru_cache(maxsize=4096)
+def _nearest(r, g, b):
+    return _search(_TREE, _rgb_to_lab(r / 255, g / 255, b / 255), (float('inf'), None))[1]
+
+
+@lru_cache(maxsize=1024)
+def nearest_colour_name(r, g, b):
+    """
+    Find the CSS4 colour name closest to an RGB colour, measured in CIELAB space. Colours are quantised to 8 bits per
+    channel before searching a KD-tree built when this module is imported. Results are cached both by the exact
+    values passed in and by the quantised colour, so repeated lookups, i.e. for status reporting, are a single
+    dictionary access.
+
+    :param r:
+        Red, 0.0 to 1.0
+    :param g:
+        Green, 0.0 to 1.0
+    :param b:
+        Blue, 0.0 to 1.0
+    :return:
+        The name of the nearest CSS4 colour
+    """
+    return _nearest(round(min(max(r, 0.0), 1.0) * 255),
+                    round(min(max(g, 0.0), 1.0) * 255),
+                    round(min(max(b, 0.0), 1.0) * 255))
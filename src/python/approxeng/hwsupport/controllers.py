@@ -0,0 +1,303 @@
+import logging
+import re
+import threading
+import time
+
+from approxeng.hwsupport.adcs import ADCS
+from approxeng.hwsupport.encoders import ENCODERS
+from approxeng.hwsupport.loop import LoopStatistics
+from approxeng.hwsupport.motors import MOTORS
+from approxeng.hwsupport.servos import SERVOS
+
+LOGGER = logging.getLogger(name='approxeng.hwsupport.controllers')
+CONTROLLERS = 'controllers'
+
+_INPUT = re.compile(r'^(adc|enc)(\d+)(_velocity)?$')
+_OUTPUT = re.compile(r'^(m|s)(\d+)$')
+
+
+def _check_limits(limits, output):
+    try:
+        low, high = (float(limit) for limit in limits)
+    except (TypeError, ValueError):
+        raise ValueError(f'controller for {output} limits must be a pair of numbers, was {limits}')
+    if not -1.0 <= low < high <= 1.0:
+        raise ValueError(f'controller for {output} limits must satisfy -1.0 <= low < high <= 1.0, was {limits}')
+    return low, high
+
+
+class Controller:
+    """
+    A PID controller reading one channel and writing another, returned by add_controller. You won't create this class
+    directly, but can change its kp, ki, kd and setpoint attributes and its limits property at any time.
+
+    The integral term is accumulated in output units, so changing ki doesn't make the output jump. To stop it winding
+    up while the output is held at a limit, it isn't accumulated on any tick where doing so would push the output
+    further past that limit. The derivative term is taken from the change in the measurement rather than the error, so
+    changing the setpoint doesn't kick the output.
+    """
+
+    def __init__(self, board, input, output, kp, ki, kd, setpoint, limits):
+        input_match = _INPUT.match(input)
+        if input_match is None:
+            raise ValueError(f'controller input must be adcN, encN or encN_velocity, was {input}')
+        kind, channel, velocity = input_match.group(1), int(input_match.group(2)), input_match.group(3)
+        if kind == 'adc' and channel not in board._config.get(ADCS, {}):
+            raise ValueError(f'controller input {input} is not an ADC channel on this board')
+        if kind == 'enc' and channel not in board._config.get(ENCODERS, {}):
+            raise ValueError(f'controller input {input} is not an encoder on this board')
+        if kind == 'adc' and velocity:
+            raise ValueError(f'controller input {input} is not valid, only encoders have velocities')
+        output_match = _OUTPUT.match(output)
+        if output_match is None:
+            raise ValueError(f'controller output must be mN or sN, was {output}')
+        output_kind, output_channel = output_match.group(1), int(output_match.group(2))
+        if output_kind == 'm' and (output_channel not in board._config.get(MOTORS, {}) or
+                                   not callable(getattr(board, 'set_motor_speeds', None))):
+            raise ValueError(f'controller output {output} is not a motor on this board')
+        if output_kind == 's' and (output_channel not in board._config.get(SERVOS, {}) or
+                                   not callable(getattr(board, 'set_servo', None))):
+            raise ValueError(f'controller output {output} is not a servo on this board')
+        self.input = input
+        self.input_kind = kind
+        self.input_channel = channel
+        self.output = output
+        self.output_kind = output_kind
+        self.output_channel = output_channel
+        self.kp = kp
+        self.ki = ki
+        self.kd = kd
+        self.setpoint = setpoint
+        self._limits = _check_limits(limits, output)
+        self.integral = 0.0
+        self.last_measurement = None
+        self.last_output = None
+
+    @property
+    def limits(self):
+        """
+        The (low, high) range the output is clamped to, within -1.0 to 1.0
+        """
+        return self._limits
+
+    @limits.setter
+    def limits(self, value):
+        self._limits = _check_limits(value, self.output)
+
+    @property
+    def config(self):
+        return {'input': self.input, 'kp': self.kp, 'ki': self.ki, 'kd': self.kd, 'setpoint': self.setpoint,
+                'limits': list(self._limits)}
+
+    @config.setter
+    def config(self, d):
+        if 'input' in d and d['input'] != self.input:
+            LOGGER.warning(f'config for controller {self.output} has input {d["input"]}, controller uses '
+                           f'{self.input}, not changing input')
+        for name in ('kp', 'ki', 'kd', 'setpoint'):
+            if name in d:
+                setattr(self, name, float(d[name]))
+        if 'limits' in d:
+            self.limits = d['limits']
+
+    def reset(self):
+        """
+        Clear the integral and derivative history, as if the controller had just been created
+        """
+        self.integral = 0.0
+        self.last_measurement = None
+        self.last_output = None
+
+    def update(self, measurement, dt):
+        """
+        Calculate a new output from a measurement taken dt seconds after the previous one
+        """
+        low, high = self._limits
+        error = self.setpoint - measurement
+        derivative = 0.0
+        if self.last_measurement is not None and dt > 0:
+            derivative = -(measurement - self.last_measurement) / dt
+        self.last_measurement = measurement
+        proportional = self.kp * error
+        integral = min(high, max(low, self.integral + self.ki * error * dt))
+        output = proportional + integral + self.kd * derivative
+        if output > high:
+            output = high
+            # Only accept the new integral if it's moving back towards the limit
+            if integral < self.integral:
+                self.integral = integral
+        elif output < low:
+            output = low
+            if integral > self.integral:
+                self.integral = integral
+        else:
+            self.integral = integral
+        self.last_output = output
+        return output
+
+
+class ControllerScheduler:
+    """
+    Runs every controller on a board at a fixed rate on a single thread, started by run_controllers. You won't use
+    this class directly.
+    """
+
+    def __init__(self, board, hz):
+        self.board = board
+        self.statistics = LoopStatistics(hz)
+        self._stopped = threading.Event()
+        self._thread = threading.Thread(target=self._run, name='hwsupport-controllers', daemon=True)
+        self._thread.start()
+
+    def _run(self):
+        period = self.statistics.period
+        start = time.monotonic()
+        previous = None
+        tick = 0
+        while True:
+            deadline = start + tick * period
+            if self._stopped.wait(max(0.0, deadline - time.monotonic())):
+                return
+            now = time.monotonic()
+            self.statistics.jitter.append(now - deadline)
+            try:
+                self.board._update_controllers(period if previous is None else now - previous)
+            except Exception:
+                LOGGER.exception('error running controllers, stopping board')
+                self.board.stop()
+                return
+            previous = now
+            end = time.monotonic()
+            self.statistics.ticks += 1
+            self.statistics.driver_time += end - now
+            # Same catching up behaviour as run_loop, at most one late tick and the rest skipped
+            tick += 1
+            latest_passed = int((end - start) / period)
+            if latest_passed >= tick:
+                self.statistics.overruns += 1
+                self.statistics.skipped += latest_passed - tick
+                tick = latest_passed
+
+    def close(self):
+        self._stopped.set()
+        if threading.current_thread() is not self._thread:
+            self._thread.join()
+
+
+class ControllersMixin:
+    """
+    Mixed into the new class used for the augmented instance to provide the add_controller, remove_controller and
+    run_controllers methods
+    """
+
+    def add_controller(self, input, output, kp=0.0, ki=0.0, kd=0.0, setpoint=0.0, limits=(-1.0, 1.0)):
+        """
+        Add a PID controller which reads one channel and drives a motor or servo to bring it to a setpoint. Controllers
+        don't do anything until run_controllers is called, which runs all of them together. If configuration for this
+        output was loaded before the controller was added, its gains, setpoint and limits replace the ones supplied.
+
+        :param input:
+            The channel to read, adcN for an ADC channel, encN for an encoder count, or encN_velocity for an encoder's
+            velocity in revolutions per second
+        :param output:
+            The channel to drive, mN for a motor or sN for a servo. Each can only have one controller
+        :param kp:
+            Proportional gain, defaults to 0.0
+        :param ki:
+            Integral gain, defaults to 0.0
+        :param kd:
+            Derivative gain, defaults to 0.0
+        :param setpoint:
+            The value the input should be brought to, defaults to 0.0. Can be changed through the controller's setpoint
+            attribute
+        :param limits:
+            A (low, high) range to clamp the output to, defaults to (-1.0, 1.0)
+        :return:
+            The Controller
+        :raises:
+            ValueError if either channel doesn't exist, the output already has a controller, or the limits are invalid
+        """
+        if output in self._controllers:
+            raise ValueError(f'{output} already has a controller, remove it first')
+        controller = Controller(board=self, input=input, output=output, kp=kp, ki=ki, kd=kd, setpoint=setpoint,
+                                limits=limits)
+        if output in self._controller_config:
+            controller.config = self._controller_config[output]
+            del self._controller_config[output]
+        self._controllers[output] = controller
+        return controller
+
+    def remove_controller(self, output):
+        """
+        Remove the controller driving a channel. The channel is left at its last value.
+
+        :param output:
+            The channel the controller drives, i.e. m0
+        :raises:
+            ValueError if there isn't a controller for this channel
+        """
+        if output not in self._controllers:
+            raise ValueError(f'{output} has no controller, controllers are {list(self._controllers.keys())}')
+        del self._controllers[output]
+
+    @property
+    def controllers(self):
+        """
+        A dict of output channel name to Controller
+        """
+        return dict(self._controllers)
+
+    def run_controllers(self, hz):
+        """
+        Start or stop running all controllers on a single background thread at a fixed rate. Each tick reads every
+        controller input in one call to read_adcs and one to read_encoders, updates all the controllers, then writes
+        all motor outputs in one call to set_motor_speeds, followed by any servo outputs. If a tick fails the board is
+        stopped. Calling stop() also stops the controllers.
+
+        :param hz:
+            Ticks per second, or None to stop
+        :return:
+            The LoopStatistics for the new scheduler, or None if stopping
+        """
+        if self._controller_scheduler is not None:
+            self._controller_scheduler.close()
+            self._controller_scheduler = None
+        if hz is None:
+            return None
+        if hz <= 0:
+            raise ValueError(f'controller rate must be > 0, was {hz}')
+        for controller in self._controllers.values():
+            controller.reset()
+        self._controller_scheduler = ControllerScheduler(board=self, hz=hz)
+        return self._controller_scheduler.statistics
+
+    def _update_controllers(self, dt):
+        """
+        Run one tick of every controller
+        """
+        controllers = list(self._controllers.values())
+        if not controllers:
+            return
+        readings = {}
+        adcs = sorted(set(c.input_channel for c in controllers if c.input_kind == 'adc'))
+        if adcs:
+            for adc, value in self.read_adcs(adcs).items():
+                readings[f'adc{adc}'] = value
+        encoders = sorted(set(c.input_channel for c in controllers if c.input_kind == 'enc'))
+        if encoders:
+            for encoder, count in self.read_encoders(encoders).items():
+                readings[f'enc{encoder}'] = count
+            for encoder, velocity in self.encoder_velocities(encoders).items():
+                readings[f'enc{encoder}_velocity'] = velocity
+        motors = {}
+        servos = {}
+        for controller in controllers:
+            output = controller.update(readings[controller.input], dt)
+            if controller.output_kind == 'm':
+                motors[controller.output_channel] = output
+            else:
+                servos[controller.output_channel] = output
+        if motors:
+            self.set_motor_speeds(motors)
+        for servo, position in servos.items():
+            self.set_servo(servo, position)
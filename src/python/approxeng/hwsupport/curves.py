@@ -0,0 +1,81 @@
+import logging
+from bisect import bisect_right
+
+LOGGER = logging.getLogger(name='approxeng.hwsupport.curves')
+
+# Number of intervals in the lookup table spanning inputs from -1.0 to 1.0
+TABLE_SIZE = 512
+
+
+class Curve:
+    """
+    A piecewise-linear calibration curve mapping values from -1.0 to 1.0 onto values in the same range, used to correct
+    for dead-bands, non-linear linkages, and asymmetric forward / reverse response on motors and servos. You won't
+    normally use this class directly, set the mXX_curve or sXX_curve properties instead.
+
+    The curve is compiled into a lookup table when created, so mapping a value is a single table lookup with linear
+    interpolation between adjacent entries, regardless of how many points define the curve.
+    """
+
+    def __init__(self, points):
+        """
+        :param points:
+            A sequence of at least two (input, output) pairs, inputs must be distinct and between -1.0 and 1.0. Inputs
+            below the lowest or above the highest point map to the output of that point.
+        :raises:
+            ValueError if the points are invalid
+        """
+        try:
+            points = sorted((float(i), float(o)) for i, o in points)
+        except (TypeError, ValueError):
+            raise ValueError(f'curve must be a sequence of (input, output) pairs, was {points}')
+        if len(points) < 2:
+            raise ValueError(f'curve must have at least two points, was {points}')
+        for (i1, _), (i2, _) in zip(points, points[1:]):
+            if i1 == i2:
+                raise ValueError(f'curve has more than one point with input {i1}')
+        for i, o in points:
+            if i < -1.0 or i > 1.0:
+                raise ValueError(f'curve inputs must be between -1.0 and 1.0, was {i}')
+        self.points = [(i, min(max(o, -1.0), 1.0)) for i, o in points]
+        inputs = [i for i, _ in self.points]
+        self.table = [self._interpolate(inputs, -1.0 + 2.0 * n / TABLE_SIZE) for n in range(TABLE_SIZE + 1)]
+        # Extra entry so a lookup at exactly 1.0 can interpolate without a bounds check
+        self.table.append(self.table[-1])
+
+    def _interpolate(self, inputs, x):
+        index = bisect_right(inputs, x)
+        if index == 0:
+            return self.points[0][1]
+        if index == len(self.points):
+            return self.points[-1][1]
+        (i1, o1), (i2, o2) = self.points[index - 1], self.points[index]
+        return o1 + (o2 - o1) * (x - i1) / (i2 - i1)
+
+    def __call__(self, value):
+        """
+        Map a single value, which must already be in the range -1.0 to 1.0
+        """
+        position = (value + 1.0) * (TABLE_SIZE / 2)
+        index = int(position)
+        low = self.table[index]
+        return low + (self.table[index + 1] - low) * (position - index)
+
+    @property
+    def config(self):
+        """
+        The curve's points as a list of [input, output] lists, suitable for YAML
+        """
+        return [[i, o] for i, o in self.points]
+
+
+def make_curve(value):
+    """
+    Build a Curve from a sequence of points, returning None if the value is None or an empty sequence, and returning
+    the value unchanged if it's already a Curve
+    """
+    if value is None or isinstance(value, Curve):
+        return value
+    if len(value) == 0:
+        return None
+    return Curve(value)
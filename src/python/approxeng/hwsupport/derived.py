@@ -0,0 +1,123 @@
+import inspect
+import logging
+
+LOGGER = logging.getLogger(name='approxeng.hwsupport.derived')
+
+
+class DerivedChannel:
+    """
+    A read-only channel calculated from ADC channels and other derived channels, you won't use this class directly.
+    """
+
+    def __init__(self, name, function, board):
+        self.name = name
+        self.function = function
+        self.board = board
+        self.inputs = list(inspect.signature(function).parameters.keys())
+        # Filled in by build_derived_channels, the derived channels needed to calculate this one (including itself)
+        # in evaluation order, and the ADC channels they read
+        self.order = None
+        self.adcs = None
+
+    def get_value(self, _):
+        return self.board.read_derived(self.name)[self.name]
+
+
+def build_derived_channels(derived, adcs, board):
+    """
+    Check a dict of derived channel functions and work out the evaluation order for each
+
+    :param derived:
+        A dict of name to function, each function's parameter names are the names of the channels it reads, either
+        adcXX for ADC channels or the name of another derived channel
+    :param adcs:
+        The list of ADC channel numbers available on this board
+    :param board:
+        The board being augmented
+    :return:
+        A dict of name to DerivedChannel, in an order where every channel comes after those it depends on
+    :raises:
+        ValueError if a name isn't a valid identifier, a function reads a channel that doesn't exist, or channels
+        depend on each other in a loop
+    """
+    channels = {}
+    for name, function in derived.items():
+        if not name.isidentifier():
+            raise ValueError(f'derived channel name must be a valid identifier, was {name}')
+        if not callable(function):
+            raise ValueError(f'derived channel {name} must be a function, was {function}')
+        channels[name] = DerivedChannel(name=name, function=function, board=board)
+    adc_names = {f'adc{adc}': adc for adc in adcs}
+    for channel in channels.values():
+        for channel_input in channel.inputs:
+            if channel_input not in adc_names and channel_input not in channels:
+                raise ValueError(f'derived channel {channel.name} reads {channel_input}, which is not an ADC channel '
+                                 f'or derived channel')
+
+    # Depth first topological sort, giving an evaluation order for all channels
+    ordered = []
+    state = {}
+
+    def visit(name, path):
+        if state.get(name) == 'done':
+            return
+        if state.get(name) == 'visiting':
+            raise ValueError(f'derived channels depend on each other in a loop: {" -> ".join(path + [name])}')
+        state[name] = 'visiting'
+        for channel_input in channels[name].inputs:
+            if channel_input in channels:
+                visit(channel_input, path + [name])
+        state[name] = 'done'
+        ordered.append(name)
+
+    for name in channels:
+        visit(name, [])
+
+    # For each channel, the subset of the global order it needs and the ADC channels underneath it
+    positions = {name: index for index, name in enumerate(ordered)}
+    for name in ordered:
+        channel = channels[name]
+        needed = {name}
+        adc_inputs = set()
+        for channel_input in channel.inputs:
+            if channel_input in channels:
+                needed.update(channels[channel_input].order)
+                adc_inputs.update(channels[channel_input].adcs)
+            else:
+                adc_inputs.add(adc_names[channel_input])
+        channel.order = sorted(needed, key=positions.get)
+        channel.adcs = sorted(adc_inputs)
+    return {name: channels[name] for name in ordered}
+
+
+class DerivedChannelsMixin:
+    """
+    Mixed into the new class used for the augmented instance to provide the read_derived method
+    """
+
+    def read_derived(self, *names):
+        """
+        Read one or more derived channels. The ADC channels needed by any of the requested channels are read in a
+        single call to read_adcs, so any cache time configured on each channel is honoured, and each derived channel
+        is calculated at most once, even if several of the requested channels depend on it.
+
+        :param names:
+            Names of the derived channels to read
+        :return:
+            A dict of name to value
+        :raises:
+            ValueError if any of the names are not derived channels on this board
+        """
+        for name in names:
+            if name not in self._derived:
+                raise ValueError(f'derived channel {name} not in {list(self._derived.keys())}')
+        needed = set()
+        adcs = set()
+        for name in names:
+            needed.update(self._derived[name].order)
+            adcs.update(self._derived[name].adcs)
+        values = {f'adc{adc}': value for adc, value in self.read_adcs(sorted(adcs)).items()}
+        for name, channel in self._derived.items():
+            if name in needed:
+                values[name] = channel.function(*[values[channel_input] for channel_input in channel.inputs])
+        return {name: values[name] for name in names}
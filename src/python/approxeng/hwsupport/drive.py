@@ -0,0 +1,112 @@
+import logging
+
+from approxeng.hwsupport.motors import MOTORS
+from approxeng.hwsupport.util import check_range
+
+LOGGER = logging.getLogger(name='approxeng.hwsupport.drive')
+
+
+class Mixer:
+    """
+    Converts a requested (x, y, rotate) motion into a set of wheel speeds. Each motor has a row of three coefficients,
+    and the wheel speeds are the product of this matrix and the (x, y, rotate) vector. If any wheel would exceed the
+    -1.0 to 1.0 range all wheels are scaled down by the same amount, so the direction of motion is preserved even
+    though the magnitude can't be.
+
+    You can use this directly with your own matrix for unusual chassis designs, or use one of the subclasses below.
+    """
+
+    def __init__(self, matrix):
+        """
+        :param matrix:
+            A dict of motor index to an (x, y, rotate) tuple of coefficients for that motor
+        """
+        self.motors = list(matrix.keys())
+        self.rows = [tuple(float(c) for c in matrix[motor]) for motor in self.motors]
+        for motor, row in zip(self.motors, self.rows):
+            if len(row) != 3:
+                raise ValueError(f'mixer row for m{motor} must have three coefficients, was {row}')
+
+    def mix(self, x, y, rotate):
+        """
+        Calculate wheel speeds
+
+        :param x:
+            Sideways motion from -1.0 (left) to 1.0 (right)
+        :param y:
+            Forwards motion from -1.0 (backwards) to 1.0 (forwards)
+        :param rotate:
+            Rotation from -1.0 (anticlockwise) to 1.0 (clockwise)
+        :return:
+            A dict of motor index to speed, all in the range -1.0 to 1.0
+        """
+        x, y, rotate = check_range(x), check_range(y), check_range(rotate)
+        speeds = [kx * x + ky * y + kr * rotate for kx, ky, kr in self.rows]
+        peak = max(abs(speed) for speed in speeds)
+        if peak > 1.0:
+            speeds = [speed / peak for speed in speeds]
+        return dict(zip(self.motors, speeds))
+
+
+class DifferentialDrive(Mixer):
+    """
+    Two motors, one on each side. Sideways motion is ignored.
+    """
+
+    def __init__(self, left, right):
+        super(DifferentialDrive, self).__init__({left: (0, 1, 1), right: (0, 1, -1)})
+
+
+class SkidSteerDrive(Mixer):
+    """
+    Any number of motors on each side of the robot, all motors on a side are driven together. Sideways motion is
+    ignored.
+    """
+
+    def __init__(self, left, right):
+        """
+        :param left:
+            A list of motor indices on the left hand side
+        :param right:
+            A list of motor indices on the right hand side
+        """
+        matrix = {motor: (0, 1, 1) for motor in left}
+        matrix.update({motor: (0, 1, -1) for motor in right})
+        super(SkidSteerDrive, self).__init__(matrix)
+
+
+class MecanumDrive(Mixer):
+    """
+    Four mecanum wheels, or four omni wheels mounted at 45 degrees in an X configuration, the mixing is the same
+    """
+
+    def __init__(self, front_left, front_right, rear_left, rear_right):
+        super(MecanumDrive, self).__init__({front_left: (1, 1, 1),
+                                            front_right: (-1, 1, -1),
+                                            rear_left: (-1, 1, 1),
+                                            rear_right: (1, 1, -1)})
+
+
+class DriveMixin:
+    """
+    Mixed into the new class used for the augmented instance to provide the drive method when a mixer is configured
+    """
+
+    def drive(self, x: float = 0, y: float = 0, rotate: float = 0, **kwargs):
+        """
+        Move the robot using the mixer configured when the board was created. Each motor's scale and invert settings
+        are applied, and all motors are set in a single call to set_motor_speeds
+
+        :param x:
+            Sideways motion from -1.0 (left) to 1.0 (right), ignored by differential and skid-steer mixers
+        :param y:
+            Forwards motion from -1.0 (backwards) to 1.0 (forwards)
+        :param rotate:
+            Rotation from -1.0 (anticlockwise) to 1.0 (clockwise)
+        :param kwargs:
+            Any additional arguments to pass to the underlying motor methods
+        """
+        LOGGER.debug(f'drive x={x}, y={y}, rotate={rotate}')
+        speeds = self._mixer.mix(x, y, rotate)
+        motors = self._config[MOTORS]
+        self.set_motor_speeds({motor: speed * motors[motor].scale for motor, speed in speeds.items()}, **kwargs)
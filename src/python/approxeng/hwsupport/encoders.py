@@ -0,0 +1,186 @@
+import logging
+import time
+from collections import deque
+
+LOGGER = logging.getLogger(name='approxeng.hwsupport.encoders')
+ENCODERS = 'encoders'
+
+# Number of recent readings kept for each encoder, the velocity window can't reach back further than this
+HISTORY_SIZE = 64
+
+
+class Encoder:
+    """
+    Holds configuration and recent readings for a single encoder, you won't use this class directly.
+    """
+
+    def __init__(self, encoder, board, counts_per_revolution=1.0, invert=False, velocity_window=0.1):
+        self.encoder = encoder
+        self.board = board
+        self.counts_per_revolution = counts_per_revolution
+        self.invert = invert
+        self.velocity_window = velocity_window
+        # (time, count) for recent readings, oldest first
+        self.history = deque(maxlen=HISTORY_SIZE)
+        self.last_count = None
+        self.read_count = 0
+
+    @property
+    def config(self):
+        return {'counts_per_revolution': self.counts_per_revolution, 'invert': self.invert,
+                'velocity_window': self.velocity_window}
+
+    @config.setter
+    def config(self, d):
+        if 'counts_per_revolution' in d:
+            self.set_counts_per_revolution(None, d['counts_per_revolution'])
+        if 'invert' in d:
+            self.set_invert(None, d['invert'])
+        if 'velocity_window' in d:
+            self.set_velocity_window(None, d['velocity_window'])
+
+    def record(self, count, now):
+        """
+        Store a raw count read from the hardware, returning the count after inversion
+        """
+        if self.invert:
+            count = -count
+        with self.board._state_lock:
+            self.read_count += 1
+            self.last_count = count
+            self.history.append((now, count))
+        return count
+
+    def velocity(self):
+        """
+        Revolutions per second from the readings already taken, comparing the latest reading with the oldest one inside
+        the velocity window, or with the one before it if that's the only reading in the window. Zero until there are
+        two readings taken at different times.
+        """
+        history = self.history
+        if len(history) < 2:
+            return 0.0
+        latest_time, latest_count = history[-1]
+        start = latest_time - self.velocity_window
+        earliest_time, earliest_count = history[-2]
+        for reading_time, count in history:
+            if reading_time >= start:
+                if reading_time < latest_time:
+                    earliest_time, earliest_count = reading_time, count
+                break
+        if latest_time <= earliest_time:
+            return 0.0
+        return (latest_count - earliest_count) / (latest_time - earliest_time) / self.counts_per_revolution
+
+    def get_value(self, _):
+        return self.board.read_encoder(encoder=self.encoder)
+
+    def get_velocity(self, _):
+        self.board.read_encoder(encoder=self.encoder)
+        return self.velocity()
+
+    def get_counts_per_revolution(self, _):
+        return self.counts_per_revolution
+
+    def set_counts_per_revolution(self, _, value):
+        if isinstance(value, int):
+            value = float(value)
+        if not isinstance(value, float) or value <= 0:
+            raise ValueError(f'enc{self.encoder}_counts_per_revolution must be a number > 0, value was {value}')
+        self.counts_per_revolution = value
+
+    def get_invert(self, _):
+        return self.invert
+
+    def set_invert(self, _, value):
+        if not isinstance(value, bool):
+            raise ValueError(f'enc{self.encoder}_invert must be a boolean, value was {value}')
+        if value != self.invert:
+            # Readings taken before the change have the wrong sign for velocity calculations
+            self.history.clear()
+        self.invert = value
+
+    def get_velocity_window(self, _):
+        return self.velocity_window
+
+    def set_velocity_window(self, _, value):
+        if isinstance(value, int):
+            value = float(value)
+        if not isinstance(value, float) or value <= 0:
+            raise ValueError(f'enc{self.encoder}_velocity_window must be a number of seconds > 0, value was {value}')
+        self.velocity_window = value
+
+
+class ReadEncodersMixin:
+    """
+    Mixed into the new class used for the augmented instance to provide the read_encoder and read_encoders methods
+    """
+
+    def read_encoder(self, encoder, **kwargs):
+        """
+        Read the count from an encoder, applying its invert setting and adding it to the history used for velocity
+
+        :param encoder:
+            The encoder to read, must be a value in the array of encoders
+        :param kwargs:
+            Any additional arguments to provide to the underlying _read_encoder method
+        :return:
+            The count
+        :raises:
+            ValueError if the supplied encoder doesn't exist
+        """
+        if encoder not in self._config[ENCODERS]:
+            raise ValueError(f'encoder enc{encoder} is not in {list(self._config[ENCODERS].keys())}')
+        LOGGER.debug(f'read enc{encoder}')
+        if callable(getattr(self, '_read_encoder', None)):
+            count = self._read_encoder(encoder=encoder, **kwargs)
+        else:
+            count = self._read_encoders([encoder], **kwargs)[encoder]
+        return self._config[ENCODERS][encoder].record(count, time.monotonic())
+
+    def read_encoders(self, encoders=None, **kwargs):
+        """
+        Read several encoders at once, typically once at the start of each tick of a control loop. If the underlying
+        board provides a _read_encoders(encoders) method returning a dict of encoder to count this is called once,
+        otherwise _read_encoder is called for each encoder in turn.
+
+        :param encoders:
+            A list of encoders to read, defaults to None to read all encoders
+        :param kwargs:
+            Any additional arguments to provide to the underlying _read_encoders or _read_encoder method
+        :return:
+            A dict of encoder to count
+        :raises:
+            ValueError if any of the supplied encoders don't exist, in which case none are read
+        """
+        if encoders is None:
+            encoders = list(self._config[ENCODERS].keys())
+        for encoder in encoders:
+            if encoder not in self._config[ENCODERS]:
+                raise ValueError(f'encoder enc{encoder} is not in {list(self._config[ENCODERS].keys())}')
+        LOGGER.debug(f'read encoders {encoders}')
+        if callable(getattr(self, '_read_encoders', None)):
+            counts = self._read_encoders(list(encoders), **kwargs)
+        else:
+            counts = {encoder: self._read_encoder(encoder=encoder, **kwargs) for encoder in encoders}
+        now = time.monotonic()
+        return {encoder: self._config[ENCODERS][encoder].record(counts[encoder], now) for encoder in encoders}
+
+    def encoder_velocities(self, encoders=None):
+        """
+        Velocities in revolutions per second calculated from the readings already taken, without reading the hardware.
+        Call after read_encoders to get the velocities for the same tick.
+
+        :param encoders:
+            A list of encoders, defaults to None for all encoders
+        :return:
+            A dict of encoder to velocity
+        :raises:
+            ValueError if any of the supplied encoders don't exist
+        """
+        if encoders is None:
+            encoders = list(self._config[ENCODERS].keys())
+        for encoder in encoders:
+            if encoder not in self._config[ENCODERS]:
+                raise ValueError(f'encoder enc{encoder} is not in {list(self._config[ENCODERS].keys())}')
+        return {encoder: self._config[ENCODERS][encoder].velocity() for encoder in encoders}
@@ -0,0 +1,285 @@
+import logging
+import threading
+import time
+
+LOGGER = logging.getLogger(name='approxeng.hwsupport.gpios')
+GPIOS = 'gpios'
+
+EDGES = ('rising', 'falling', 'both')
+
+
+class GPIO:
+    """
+    Holds configuration and debounce state for a single digital I/O pin, you won't use this class directly.
+
+    The debounced state only changes once the pin has read the same new level for at least the debounce time, so
+    contact bounce on a switch shorter than that is ignored. With a debounce time of 0 every change is accepted.
+    """
+
+    def __init__(self, gpio, board, invert=False, debounce=0.0):
+        self.gpio = gpio
+        self.board = board
+        self.invert = invert
+        self.debounce = debounce
+        # Debounced level, None until the first reading
+        self.state = None
+        # A level different to the debounced one and the time it was first seen, or None
+        self.candidate = None
+        self.candidate_since = None
+        self.output = None
+        self.read_count = 0
+        self.subscriptions = []
+        self._lock = threading.Lock()
+
+    @property
+    def config(self):
+        return {'invert': self.invert, 'debounce': self.debounce}
+
+    @config.setter
+    def config(self, d):
+        if 'invert' in d:
+            self.set_invert(None, d['invert'])
+        if 'debounce' in d:
+            self.set_debounce(None, d['debounce'])
+
+    def sample(self, raw, now):
+        """
+        Apply a raw level read from the hardware to the debounced state
+
+        :return:
+            'rising' or 'falling' if the debounced state changed, None otherwise, including for the first reading
+        """
+        level = bool(raw) != self.invert
+        with self._lock:
+            self.read_count += 1
+            if self.state is None:
+                self.state = level
+                return None
+            if level == self.state:
+                self.candidate = None
+                return None
+            if self.candidate != level:
+                self.candidate = level
+                self.candidate_since = now
+            if now - self.candidate_since < self.debounce:
+                return None
+            self.state = level
+            self.candidate = None
+            return 'rising' if level else 'falling'
+
+    def get_value(self, _):
+        return self.board.read_gpio(gpio=self.gpio)
+
+    def set_value(self, _, value):
+        self.board.write_gpio(gpio=self.gpio, value=value)
+
+    def get_invert(self, _):
+        return self.invert
+
+    def set_invert(self, _, value):
+        if not isinstance(value, bool):
+            raise ValueError(f'gpio{self.gpio}_invert must be a boolean, value was {value}')
+        with self._lock:
+            if value != self.invert:
+                # The debounced state is stored after inversion, so start again from the next reading
+                self.state = None
+                self.candidate = None
+            self.invert = value
+
+    def get_debounce(self, _):
+        return self.debounce
+
+    def set_debounce(self, _, value):
+        if isinstance(value, int):
+            value = float(value)
+        if not isinstance(value, float) or value < 0:
+            raise ValueError(f'gpio{self.gpio}_debounce must be a number of seconds >= 0, value was {value}')
+        self.debounce = value
+
+
+class GPIOSubscription:
+    """
+    An edge subscription on a GPIO pin, returned by on_gpio. Call cancel() to remove it.
+    """
+
+    def __init__(self, gpio, callback, edge, board):
+        if edge not in EDGES:
+            raise ValueError(f'edge must be one of {EDGES}, was {edge}')
+        self.gpio = gpio
+        self.callback = callback
+        self.edge = edge
+        self.board = board
+
+    def cancel(self):
+        """
+        Stop receiving callbacks from this subscription
+        """
+        self.board._config[GPIOS][self.gpio].subscriptions.remove(self)
+
+
+class GPIOPoller:
+    """
+    Reads every GPIO pin at a fixed interval and calls edge subscriptions, started by poll_gpios. You won't use this
+    class directly.
+    """
+
+    def __init__(self, board, interval):
+        self.board = board
+        self.interval = interval
+        self._stopped = threading.Event()
+        self._thread = threading.Thread(target=self._run, name='hwsupport-gpio-poller', daemon=True)
+        self._thread.start()
+
+    def _run(self):
+        while not self._stopped.wait(self.interval):
+            try:
+                edges = self.board._sample_gpios(list(self.board._config[GPIOS].keys()))
+            except Exception:
+                LOGGER.exception('error polling gpios')
+                continue
+            for gpio, edge in edges.items():
+                for subscription in list(self.board._config[GPIOS][gpio].subscriptions):
+                    if subscription.edge in (edge, 'both'):
+                        try:
+                            subscription.callback(gpio, edge == 'rising', edge)
+                        except Exception:
+                            LOGGER.exception(f'error in gpio{gpio} {edge} callback')
+
+    def close(self):
+        self._stopped.set()
+        if threading.current_thread() is not self._thread:
+            self._thread.join()
+
+
+class GPIOsMixin:
+    """
+    Mixed into the new class used for the augmented instance to provide the read_gpio, read_gpios, write_gpio, on_gpio
+    and poll_gpios methods
+    """
+
+    def _check_gpios(self, gpios):
+        for gpio in gpios:
+            if gpio not in self._config[GPIOS]:
+                raise ValueError(f'gpio gpio{gpio} is not in {list(self._config[GPIOS].keys())}')
+
+    def _sample_gpios(self, gpios, **kwargs):
+        """
+        Read pins from the hardware, in one call to _read_gpios if the board provides it, and update their debounced
+        states
+
+        :return:
+            A dict of gpio to 'rising' or 'falling' for pins whose debounced state changed
+        """
+        if callable(getattr(self, '_read_gpios', None)):
+            mask = self._read_gpios(**kwargs)
+            raw = {gpio: mask >> gpio & 1 for gpio in gpios}
+        elif callable(getattr(self, '_read_gpio', None)):
+            raw = {gpio: self._read_gpio(gpio=gpio, **kwargs) for gpio in gpios}
+        else:
+            raise ValueError('board has no gpio read functions')
+        now = time.monotonic()
+        edges = {}
+        for gpio in gpios:
+            edge = self._config[GPIOS][gpio].sample(raw[gpio], now)
+            if edge is not None:
+                edges[gpio] = edge
+        return edges
+
+    def read_gpio(self, gpio, **kwargs):
+        """
+        Read the debounced level of a GPIO pin. If poll_gpios has been called this returns the level from the most
+        recent poll without reading the hardware, otherwise the pin is read first.
+
+        :param gpio:
+            The pin to read, must be a value in the array of gpios
+        :param kwargs:
+            Any additional arguments to provide to the underlying _read_gpios or _read_gpio method
+        :return:
+            True for high, False for low, after applying the pin's invert setting
+        :raises:
+            ValueError if the supplied pin doesn't exist, or the board can't read pins
+        """
+        return self.read_gpios([gpio], **kwargs)[gpio]
+
+    def read_gpios(self, gpios=None, **kwargs):
+        """
+        Read the debounced levels of several GPIO pins. If poll_gpios has been called these are the levels from the
+        most recent poll, otherwise the pins are read first, with a single call to _read_gpios if the board provides it.
+
+        :param gpios:
+            A list of pins to read, defaults to None to read all pins
+        :param kwargs:
+            Any additional arguments to provide to the underlying _read_gpios or _read_gpio method
+        :return:
+            A dict of gpio to level
+        :raises:
+            ValueError if any of the supplied pins don't exist, or the board can't read pins
+        """
+        if gpios is None:
+            gpios = list(self._config[GPIOS].keys())
+        self._check_gpios(gpios)
+        configs = self._config[GPIOS]
+        if self._gpio_poller is None or any(configs[gpio].state is None for gpio in gpios):
+            LOGGER.debug(f'read gpios {gpios}')
+            self._sample_gpios(gpios, **kwargs)
+        return {gpio: configs[gpio].state for gpio in gpios}
+
+    def write_gpio(self, gpio, value, **kwargs):
+        """
+        Set the level of a GPIO pin
+
+        :param gpio:
+            The pin to set, must be a value in the array of gpios
+        :param value:
+            True for high, False for low, inverted before being sent if the pin's invert setting is True
+        :param kwargs:
+            Any additional arguments to provide to the underlying _write_gpio method
+        :raises:
+            ValueError if the supplied pin doesn't exist, or the board can't write to pins
+        """
+        self._check_gpios([gpio])
+        if not callable(getattr(self, '_write_gpio', None)):
+            raise ValueError(f'board has no gpio write function, unable to write gpio{gpio}')
+        config = self._config[GPIOS][gpio]
+        config.output = bool(value)
+        LOGGER.debug(f'write gpio{gpio} = {config.output}')
+        self._write_gpio(gpio, config.output != config.invert, **kwargs)
+
+    def on_gpio(self, gpio, callback, edge='both'):
+        """
+        Subscribe to edges on a GPIO pin. Callbacks are called as callback(gpio, level, edge) from the polling thread
+        started by poll_gpios, so nothing is reported until that's been called. Edges are detected on the debounced
+        level, so a bouncing switch produces one callback per press.
+
+        :param gpio:
+            The pin to watch, must be a value in the array of gpios
+        :param callback:
+            Function called as callback(gpio, level, edge), where edge is 'rising' or 'falling'
+        :param edge:
+            'rising', 'falling', or 'both', the default
+        :return:
+            The subscription, call cancel() on this to unsubscribe
+        :raises:
+            ValueError if the pin doesn't exist or the edge isn't valid
+        """
+        self._check_gpios([gpio])
+        subscription = GPIOSubscription(gpio=gpio, callback=callback, edge=edge, board=self)
+        self._config[GPIOS][gpio].subscriptions.append(subscription)
+        return subscription
+
+    def poll_gpios(self, interval):
+        """
+        Start or stop a background thread reading every GPIO pin at a fixed interval, with a single call to _read_gpios
+        if the board provides it, and calling any edge subscriptions. The interval should be shorter than the debounce
+        times set on the pins.
+
+        :param interval:
+            Seconds between polls, or None to stop polling
+        """
+        if self._gpio_poller is not None:
+            self._gpio_poller.close()
+            self._gpio_poller = None
+        if interval is not None:
+            if interval <= 0:
+                raise ValueError(f'poll interval must be > 0, was {interval}')
+            self._gpio_poller = GPIOPoller(board=self, interval=interval)
@@ -1,144 +1,214 @@
-# -*- coding: future_fstrings -*-
-
 import curses
-import curses.textpad
-from math import floor
+import selectors
+import sys
+import time
+from bisect import bisect_left
+from collections import deque
 
 DEFAULT_MOTOR_KEYS = ('q', 'w', 'e', 'r', 't', 'y', 'u', 'i', 'o', 'p', '[', ']')
 DEFAULT_SERVO_KEYS = ('a', 's', 'd', 'f', 'g', 'h', 'j', 'k', 'l', ';', "'", '#')
 DEFAULT_ADC_KEYS = ('z', 'x', 'c', 'v', 'b', 'n', 'm', ',', '.', '/')
 DEFAULT_TITLE = 'Approxeng.hwsupport console by @Approx_Eng'
+DEFAULT_ADC_REFRESH = 0.5
+DEFAULT_MAX_FPS = 20
+DEFAULT_TELEMETRY_WINDOW = 120
 
 VALUE_KEYS = ['1', '2', '3', '4', '5', '6', '7', '8', '9', '0', '-']
 VALUE_ITEMS = list([round(i / ((len(VALUE_KEYS) - 1) / 2) - 1, 1) for i in range(0, len(VALUE_KEYS))])
 
+GRID_COLUMNS = 4
+CELL_WIDTH = 20
+# Lines needed below the channel grid for the value list and config editors
+LINES_BELOW_GRID = len(VALUE_ITEMS) + 2
+
+SPARKLINE_WIDTH = 24
+SPARKLINE_CHARACTERS = '▁▂▃▄▅▆▇█'
+
+# Used for DisplayState.pending_value when there's no value waiting to be written, as None disables a servo
+NO_VALUE = object()
+
 
 def run_curses_gui(board, motor_keys=DEFAULT_MOTOR_KEYS, servo_keys=DEFAULT_SERVO_KEYS, adc_keys=DEFAULT_ADC_KEYS,
-                   title=DEFAULT_TITLE):
+                   title=DEFAULT_TITLE, adc_refresh=DEFAULT_ADC_REFRESH, max_fps=DEFAULT_MAX_FPS,
+                   telemetry_window=DEFAULT_TELEMETRY_WINDOW):
     """
     Build and run the GUI for the supplied board. See build_curses_gui for parameter documentation
     """
-    curses.wrapper(build_curses_gui(board, motor_keys, servo_keys, adc_keys, title))
+    curses.wrapper(build_curses_gui(board, motor_keys, servo_keys, adc_keys, title, adc_refresh, max_fps,
+                                    telemetry_window))
 
 
 def build_curses_gui(board, motor_keys=DEFAULT_MOTOR_KEYS, servo_keys=DEFAULT_SERVO_KEYS, adc_keys=DEFAULT_ADC_KEYS,
-                     title=DEFAULT_TITLE):
+                     title=DEFAULT_TITLE, adc_refresh=DEFAULT_ADC_REFRESH, max_fps=DEFAULT_MAX_FPS,
+                     telemetry_window=DEFAULT_TELEMETRY_WINDOW):
     """
     Build the GUI for a given board instance.
     :param board:
         A board which must have been augmented by the approxeng.hwsupport module
     :param motor_keys:
-        Keys used to select motor driver channels, defaults to the QWERTYUIOP[] row on the keyboard. Must contain at
-        least as many items as you have motor driver channels, only those corresponding to motor drivers on the supplied
-        board will be shown.
+        Keys used to select motor driver channels, defaults to the QWERTYUIOP[] row on the keyboard. If there are more
+        motors than keys, the remaining motors can be selected with the arrow, page, and TAB keys.
     :param servo_keys:
-        Keys used to select servos, defaults to the ASDFGHKL;'# row on the keyboard. Must contain at least as many items
-        as you have servos, only those corresponding to servos on the supplied board will be shown.
+        Keys used to select servos, defaults to the ASDFGHKL;'# row on the keyboard. If there are more servos than
+        keys, the remaining servos can be selected with the arrow, page, and TAB keys.
     :param adc_keys:
-        Keys used to select ADC channels, defaults to ZXCVBNM,./ row on the keyboard. Must contain at least as many
-        items as you have ADCs, only those corresponding to ADCs on the supplied board will be shown.
+        Keys used to select ADC channels, defaults to ZXCVBNM,./ row on the keyboard. If there are more ADC channels
+        than keys, the remaining channels can be selected with the arrow, page, and TAB keys.
     :param title:
         Shown on the first line of the generated console
+    :param adc_refresh:
+        Minimum time in seconds between reads of the ADC channels shown in the console, defaults to 0.5. Each read goes
+        through the adcXX property so will also honour any cache time configured for that channel. This is also the
+        interval at which channel values are recorded for the telemetry panel
+    :param max_fps:
+        Maximum number of times per second the console is redrawn, defaults to 20. The console only redraws when a key
+        is pressed or ADC values are refreshed, and any motor or servo value changes made by keys pressed between
+        frames are written to the board once per frame
+    :param telemetry_window:
+        Number of samples of each channel kept for the telemetry panel, shown with 'T', defaults to 120
     :return:
         A function which can be used as the argument to curses.wrapper(..) to show the GUI
     """
 
+    def render(display):
+        """
+        Draw a single frame, returning the config editor for the selected control, if any
+        """
+        display.start()
+
+        # Draw title
+        display.println(title)
+        display.println('Letters or TAB to select, numbers to set, T for telemetry, SPACE stops all, CTRL-C to exit')
+
+        # Visible part of the grid of motors, servos, ADCs and LEDs
+        display.show_grid()
+        display.newline()
+
+        # Telemetry replaces the value list and editors when shown
+        if display.telemetry_visible:
+            display.show_telemetry()
+            display.finish()
+            return None
+
+        # Show values if either motor or servo, doesn't make any sense for e.g. ADCs
+        if display.control_is_servo or display.control_is_motor:
+            display.println('Values - number key row or up / down arrows to set, BACKSPACE to stop / disable')
+            current_value = display.value
+            for index, value in enumerate(VALUE_ITEMS):
+                display.show_value(display.line + len(VALUE_ITEMS) - index - 1, 2, value, current_value)
+
+        # Show editor if the selected control has one
+        if display.control_is_servo:
+            editor = ServoConfigEditor(display=display, row=display.line + 1, column=40, height=4)
+            editor.render()
+        elif display.control_is_motor:
+            editor = MotorConfigEditor(display=display, row=display.line + 1, column=40, height=3)
+            editor.render()
+        elif display.control_is_adc:
+            editor = ADCConfigEditor(display=display, row=display.line, column=40, height=3)
+            editor.render()
+        elif display.control_is_led:
+            editor = LEDConfigEditor(display=display, row=display.line, column=40, height=4)
+            editor.render()
+        else:
+            editor = None
+
+        # Draw only the lines which have changed since the previous frame
+        display.finish()
+        return editor
+
+    def handle_key(display, key, editor):
+        """
+        Respond to a single key press. Value changes are held in the display state until the next frame so that
+        repeated keys, i.e. from holding down an arrow, result in a single write to the board.
+        """
+        if display.search is not None:
+            display.search_key(key)
+            return
+        if key in display.key_controls:
+            display.control = display.key_controls[key]
+        elif key == '\t':
+            display.search = ''
+        elif key == 'KEY_NPAGE':
+            display.select_page(1)
+        elif key == 'KEY_PPAGE':
+            display.select_page(-1)
+        elif key == 'KEY_HOME':
+            display.control = display.all_controls[0]
+        elif key == 'KEY_END':
+            display.control = display.all_controls[-1]
+        elif key == ' ':
+            display.pending_value = NO_VALUE
+            board.stop()
+        elif key == 'KEY_LEFT':
+            display.select_previous_control()
+        elif key == 'KEY_RIGHT':
+            display.select_next_control()
+        elif key == 'T':
+            display.telemetry_visible = not display.telemetry_visible
+        elif key == 'KEY_RESIZE':
+            display.invalidate()
+        elif key == '=' and editor is not None:
+            display.apply_pending_value()
+            display.screen.nodelay(False)
+            editor.edit()
+            display.invalidate()
+            curses.cbreak()
+            display.screen.nodelay(True)
+        elif key == 'KEY_BACKSPACE':
+            if display.control_is_servo:
+                display.pending_value = None
+            elif display.control_is_motor:
+                display.pending_value = 0
+        # Setting value is only meaningful if we've got a servo or motor selected
+        if display.control_is_servo or display.control_is_motor:
+            if key in VALUE_KEYS:
+                display.pending_value = VALUE_ITEMS[VALUE_KEYS.index(key)]
+            elif key == 'KEY_UP':
+                value = display.value
+                display.pending_value = round(min(value + 0.2, 1.0), 1) if value is not None else 0
+            elif key == 'KEY_DOWN':
+                value = display.value
+                display.pending_value = round(max(value - 0.2, -1.0), 1) if value is not None else 0
+
     def curses_main(screen):
         try:
             display = DisplayState(screen=screen, board=board, motor_keys=motor_keys, servo_keys=servo_keys,
-                                   adc_keys=adc_keys)
+                                   adc_keys=adc_keys, adc_refresh=adc_refresh, telemetry_window=telemetry_window)
             curses.cbreak()
-            curses.halfdelay(1)
+            screen.nodelay(True)
+            selector = selectors.DefaultSelector()
+            selector.register(sys.stdin, selectors.EVENT_READ)
+            frame_interval = 1.0 / max_fps
+            last_frame = None
+            dirty = True
+            editor = None
             while True:
-                display.start()
-
-                # Draw title
-                display.println(title)
-                display.println('Letters to select control, numbers to set value, SPACE stops all, CTRL-C to exit')
-                display.newline()
-
-                # Motors, if present
-                if display.motors:
-                    display.print_header('Motors')
-                    for index, motor in enumerate(display.motors):
-                        row, col = divmod(index, 4)
-                        display.show_motor(display.line + row, col * 20, motor)
-                    display.line += floor((len(display.motors) - 1) / 4) + 1
-                    display.newline()
-
-                # Servos, if present
-                if display.servo_pins:
-                    display.print_header('Servos')
-                    for index, servo in enumerate(display.servo_pins):
-                        row, col = divmod(index, 4)
-                        display.show_servo(display.line + row, col * 20, servo)
-                    display.line += floor((len(display.servo_pins) - 1) / 4) + 1
-                    display.newline()
-
-                # ADC channels, if present
-                if display.adcs:
-                    display.print_header('ADC Channels')
-                    for index, adc in enumerate(display.adcs):
-                        row, col = divmod(index, 4)
-                        display.show_adc(display.line + row, col * 20, adc)
-                    display.line += floor((len(display.adcs) - 1) / 4) + 1
-                    display.newline()
-
-                # Show values if either motor or servo, doesn't make any sense for e.g. ADCs
-                if display.control_is_servo or display.control_is_motor:
-                    display.println('Values - number key row or up / down arrows to set, BACKSPACE to stop / disable')
-                    for value in VALUE_ITEMS:
-                        index = VALUE_ITEMS.index(value)
-                        display.show_value(display.line + len(VALUE_ITEMS) - index - 1, 2, value)
-
-                # Show editor if the selected control has one
-                if display.control_is_servo:
-                    editor = ServoConfigEditor(display=display, row=display.line + 1, column=40, height=4)
-                    editor.render()
-                elif display.control_is_motor:
-                    editor = MotorConfigEditor(display=display, row=display.line + 1, column=40, height=3)
-                    editor.render()
-                elif display.control_is_adc:
-                    editor = ADCConfigEditor(display=display, row=display.line, column=40, height=3)
-                    editor.render()
-                else:
-                    editor = None
-
-                # Wait for a keypress and respond to it
-                try:
-                    key = screen.getkey()
-                    if key in motor_keys and motor_keys.index(key) < board.num_motors:
-                        display.control = f'm{display.motors[motor_keys.index(key)]}'
-                    elif key in servo_keys and servo_keys.index(key) < len(display.servo_pins):
-                        display.control = f's{display.servo_pins[servo_keys.index(key)]}'
-                    elif key in adc_keys and adc_keys.index(key) < len(display.adcs):
-                        display.control = f'adc{display.adcs[adc_keys.index(key)]}'
-                    elif key == ' ':
-                        board.stop()
-                    elif key == 'KEY_LEFT':
-                        display.select_previous_control()
-                    elif key == 'KEY_RIGHT':
-                        display.select_next_control()
-                    elif key == '=' and editor is not None:
-                        editor.edit()
-                        curses.cbreak()
-                        curses.halfdelay(1)
-                    elif key == 'KEY_BACKSPACE':
-                        if display.control_is_servo:
-                            display.value = None
-                        elif display.control_is_motor:
-                            display.value = 0
-                    # Setting value is only meaningful if we've got a servo or motor selected
-                    if display.control_is_servo or display.control_is_motor:
-                        if key in VALUE_KEYS:
-                            display.value = VALUE_ITEMS[VALUE_KEYS.index(key)]
-                        elif key == 'KEY_UP':
-                            display.value = round(min(display.value + 0.2, 1.0), 1) if display.value is not None else 0
-                        elif key == 'KEY_DOWN':
-                            display.value = round(max(display.value - 0.2, -1.0), 1) if display.value is not None else 0
-                except curses.error:
-                    # No input available, perfectly normal
-                    pass
+                # Sleep until a key is pressed, the next frame is allowed, or the ADC values need refreshing
+                now = time.monotonic()
+                wake = display.next_adc_refresh
+                if dirty:
+                    next_frame = now if last_frame is None else last_frame + frame_interval
+                    wake = next_frame if wake is None else min(wake, next_frame)
+                selector.select(None if wake is None else max(0, wake - now))
+
+                # Respond to every key available, including any buffered by curses itself
+                while True:
+                    try:
+                        key = screen.getkey()
+                    except curses.error:
+                        break
+                    handle_key(display, key, editor)
+                    dirty = True
+
+                now = time.monotonic()
+                if display.next_adc_refresh is not None and now >= display.next_adc_refresh:
+                    dirty = True
+                if dirty and (last_frame is None or now - last_frame >= frame_interval):
+                    display.apply_pending_value()
+                    editor = render(display)
+                    last_frame = now
+                    dirty = False
         except KeyboardInterrupt:
             # Exit on CTRL-C, stopping the motors as we go
             board.stop()
@@ -147,20 +217,67 @@ def build_curses_gui(board, motor_keys=DEFAULT_MOTOR_KEYS, servo_keys=DEFAULT_SE
 
 
 class DisplayState:
+    """
+    Tracks the selected control and the content of the console. Widgets draw into a model of the current frame rather
+    than directly to the screen, and finish() only repaints those lines which differ from the previous frame.
+
+    Channels are laid out in a grid with a header row for each type of channel. Only the rows which fit on the screen
+    are drawn, scrolling to keep the selected control visible, so the cost of a frame doesn't depend on how many
+    channels the board has.
+    """
 
-    def __init__(self, screen, board, motor_keys, servo_keys, adc_keys):
+    def __init__(self, screen, board, motor_keys, servo_keys, adc_keys, adc_refresh=DEFAULT_ADC_REFRESH,
+                 telemetry_window=DEFAULT_TELEMETRY_WINDOW):
         self.screen = screen
+        self.telemetry = Telemetry(board=board, window=telemetry_window)
+        self.telemetry_visible = False
+        self.adcs_read = set()
+        self.frame = {}
+        self.previous_frame = {}
+        self.adc_refresh = adc_refresh
+        self.adc_values = {}
+        self.adc_read_time = None
+        self.pending_value = NO_VALUE
 
         self.line = 0
         self.servo_pins = board.servos
         self.board = board
         self.adcs = board.adcs
         self.motors = board.motors
-        self.motor_keys = motor_keys
-        self.servo_keys = servo_keys
-        self.adc_keys = adc_keys
-        self.all_controls = list([f'm{motor}' for motor in self.motors]) + list(
-            [f's{servo}' for servo in self.servo_pins]) + list([f'adc{adc}' for adc in self.adcs])
+        self.leds = board.leds
+        self.refresh_adcs = False
+        self.search = None
+        self.grid_offset = 0
+        self.grid_height = 1
+
+        # Lookup tables from control name to position, selection key, and the function used to draw it
+        sections = [('Motors', 'm', self.motors, motor_keys, self.show_motor),
+                    ('Servos', 's', self.servo_pins, servo_keys, self.show_servo),
+                    ('ADC Channels', 'adc', self.adcs, adc_keys, self.show_adc),
+                    ('LEDs', 'led', self.leds, (), self.show_led)]
+        self.all_controls = []
+        self.key_controls = {}
+        self.control_keys = {}
+        self.control_widgets = {}
+        self.grid = []
+        self.grid_rows = {}
+        for header, prefix, channels, keys, show in sections:
+            if not channels:
+                continue
+            self.grid.append(header)
+            for index, channel in enumerate(channels):
+                control = f'{prefix}{channel}'
+                if index % GRID_COLUMNS == 0:
+                    self.grid.append([])
+                self.grid[-1].append(control)
+                self.grid_rows[control] = len(self.grid) - 1
+                self.all_controls.append(control)
+                self.control_widgets[control] = show, channel
+                if index < len(keys):
+                    self.key_controls[keys[index]] = control
+                    self.control_keys[control] = keys[index]
+        self.control_indices = {control: index for index, control in enumerate(self.all_controls)}
+        self.sorted_controls = sorted(self.all_controls)
         self.control = self.all_controls[0]
         # Disable echo to terminal
         curses.noecho()
@@ -178,35 +295,199 @@ class DisplayState:
         screen.keypad(True)
 
     def start(self):
-        self.screen.clear()
+        """
+        Begin a new frame. If the refresh interval has passed, ADC channels are re-read as they're drawn, and the values
+        of all motors, servos, and LEDs are recorded for the telemetry panel
+        """
+        self.frame = {}
         self.line = 0
+        now = time.monotonic()
+        self.refresh_adcs = self.adc_read_time is None or now - self.adc_read_time >= self.adc_refresh
+        if self.refresh_adcs:
+            self.adc_read_time = now
+            self.adcs_read = set()
+            self.telemetry.sample(now)
+            for motor in self.motors:
+                self.telemetry.add(f'm{motor}', self.board.__getattribute__(f'm{motor}'))
+            for servo in self.servo_pins:
+                self.telemetry.add(f's{servo}', self.board.__getattribute__(f's{servo}'))
+            for led in self.leds:
+                self.telemetry.add(f'led{led}', self.board.__getattribute__(f'led{led}')[2])
+
+    def read_adc(self, adc):
+        """
+        Value of an ADC channel, read at most once per refresh interval
+        """
+        if adc not in self.adcs_read or adc not in self.adc_values:
+            self.adcs_read.add(adc)
+            try:
+                self.adc_values[adc] = self.board.__getattribute__(f'adc{adc}')
+            except AttributeError:
+                self.adc_values[adc] = None
+            self.telemetry.add(f'adc{adc}', self.adc_values[adc])
+        return self.adc_values[adc]
+
+    def addstr(self, row, col, string, attr=0):
+        """
+        Add a string to the current frame
+        """
+        self.frame.setdefault(row, []).append((col, string, attr))
+
+    def box(self, top, left, bottom, right):
+        """
+        Add a rectangle to the current frame
+        """
+        width = right - left - 1
+        self.addstr(top, left, '┌' + '─' * width + '┐')
+        for row in range(top + 1, bottom):
+            self.addstr(row, left, '│')
+            self.addstr(row, right, '│')
+        self.addstr(bottom, left, '└' + '─' * width + '┘')
+
+    def finish(self):
+        """
+        Repaint any lines which differ from the previous frame, then update the terminal
+        """
+        for row in set(self.frame) | set(self.previous_frame):
+            segments = self.frame.get(row)
+            if segments == self.previous_frame.get(row):
+                continue
+            try:
+                self.screen.move(row, 0)
+                self.screen.clrtoeol()
+                for col, string, attr in segments or []:
+                    self.screen.addstr(row, col, string, attr)
+            except curses.error:
+                pass
+        self.previous_frame = self.frame
+        self.screen.noutrefresh()
+        curses.doupdate()
+
+    def invalidate(self):
+        """
+        Forget the previous frame, used when something other than finish() has drawn to the screen
+        """
+        self.previous_frame = {}
+        self.screen.clear()
+
+    @property
+    def next_adc_refresh(self):
+        """
+        The monotonic time at which ADC values should next be read, or None if there are no ADC channels and telemetry
+        isn't shown
+        """
+        if not self.adcs and not self.telemetry_visible:
+            return None
+        if self.adc_read_time is None:
+            return time.monotonic()
+        return self.adc_read_time + self.adc_refresh
+
+    @property
+    def control(self):
+        return self._control
+
+    @control.setter
+    def control(self, control):
+        # Write any value for the previous control before switching
+        self.apply_pending_value()
+        self._control = control
 
     @property
     def value(self):
+        if self.pending_value is not NO_VALUE:
+            return self.pending_value
         return self.board.__getattribute__(self.control)
 
     @value.setter
     def value(self, value):
+        self.pending_value = NO_VALUE
         self.board.__setattr__(self.control, value)
 
+    def apply_pending_value(self):
+        """
+        Write any value set by key presses since the last frame to the selected control
+        """
+        if self.pending_value is not NO_VALUE:
+            self.value = self.pending_value
+
     def println(self, string, contrast=False):
-        try:
-            if contrast:
-                self.screen.addstr(self.line, 0, string, curses.color_pair(1))
-            else:
-                self.screen.addstr(self.line, 0, string)
-        except curses.error:
-            pass
+        self.addstr(self.line, 0, string, curses.color_pair(1) if contrast else 0)
         self.line += 1
 
     def select_next_control(self):
-        control_index = self.all_controls.index(self.control)
+        control_index = self.control_indices[self.control]
         self.control = self.all_controls[(control_index + 1) % len(self.all_controls)]
 
     def select_previous_control(self):
-        control_index = self.all_controls.index(self.control)
+        control_index = self.control_indices[self.control]
         self.control = self.all_controls[(control_index - 1) % len(self.all_controls)]
 
+    def select_page(self, direction):
+        """
+        Move the selection up (-1) or down (1) by a screen of grid rows, staying in the same column where possible
+        """
+        row = self.grid_rows[self.control]
+        column = self.grid[row].index(self.control)
+        target = min(max(row + direction * self.grid_height, 0), len(self.grid) - 1)
+        if isinstance(self.grid[target], str):
+            # Header rows are always followed by a row of controls
+            target += 1
+        self.control = self.grid[target][min(column, len(self.grid[target]) - 1)]
+
+    def search_key(self, key):
+        """
+        Handle a key while searching, selecting the first control whose name starts with what has been typed so far
+        """
+        if key in ('\n', '\x1b'):
+            self.search = None
+            return
+        if key in ('KEY_BACKSPACE', '\x7f', '\b'):
+            self.search = self.search[:-1]
+        elif len(key) == 1 and key.isprintable():
+            self.search += key
+        else:
+            return
+        if self.search in self.control_indices:
+            self.control = self.search
+        elif self.search:
+            index = bisect_left(self.sorted_controls, self.search)
+            if index < len(self.sorted_controls) and self.sorted_controls[index].startswith(self.search):
+                self.control = self.sorted_controls[index]
+
+    def show_grid(self):
+        """
+        Draw a status line and the rows of the channel grid which fit on the screen
+        """
+        screen_lines, _ = self.screen.getmaxyx()
+        self.grid_height = max(3, screen_lines - self.line - 1 - LINES_BELOW_GRID)
+        row = self.grid_rows[self.control]
+        # Scroll to show the selected row, and the section header above it where possible
+        if row <= self.grid_offset:
+            self.grid_offset = max(0, row - 1)
+        elif row >= self.grid_offset + self.grid_height:
+            self.grid_offset = row - self.grid_height + 1
+        self.grid_offset = max(0, min(self.grid_offset, len(self.grid) - self.grid_height))
+        last_row = min(len(self.grid), self.grid_offset + self.grid_height)
+        if self.search is not None:
+            self.println(f'Jump to channel: {self.search}_, RETURN when done', contrast=True)
+        else:
+            self.println(f'Rows {self.grid_offset + 1}-{last_row} of {len(self.grid)}, PGUP / PGDN to scroll')
+        for grid_row in self.grid[self.grid_offset:last_row]:
+            if isinstance(grid_row, str):
+                self.print_header(grid_row)
+            else:
+                for column, control in enumerate(grid_row):
+                    show, channel = self.control_widgets[control]
+                    show(self.line, column * CELL_WIDTH, channel)
+                self.newline()
+
+    def label(self, control):
+        """
+        Control name, followed by its selection key if it has one
+        """
+        key = self.control_keys.get(control)
+        return control if key is None else f'{control}[{key}]'
+
     def newline(self):
         self.line += 1
 
@@ -217,18 +498,12 @@ class DisplayState:
 
     def show_motor(self, row, col, motor):
         try:
-            try:
-                speed = self.board.__getattribute__(f'm{motor}')
-            except AttributeError:
-                speed = None
-            speed_string = '??' if speed is None else f'{speed:.1f}'
-            rep = f'm{motor}[{self.motor_keys[motor]}] = {speed_string}'
-            if self.control == f'm{motor}':
-                self.screen.addstr(row, col, rep, curses.color_pair(2))
-            else:
-                self.screen.addstr(row, col, rep)
-        except curses.error:
-            pass
+            speed = self.board.__getattribute__(f'm{motor}')
+        except AttributeError:
+            speed = None
+        speed_string = '??' if speed is None else f'{speed:.1f}'
+        rep = f'{self.label(f"m{motor}")} = {speed_string}'
+        self.addstr(row, col, rep, curses.color_pair(2) if self.control == f'm{motor}' else 0)
 
     @property
     def control_is_servo(self):
@@ -242,46 +517,169 @@ class DisplayState:
     def control_is_adc(self):
         return self.control[:1] == 'a'
 
+    @property
+    def control_is_led(self):
+        return self.control[:1] == 'l'
+
     def show_servo(self, row, col, servo):
         try:
-            try:
-                value = self.board.__getattribute__(f's{servo}')
-            except AttributeError:
-                value = None
-            value_string = '--' if value is None else f'{value:.1f}'
-            rep = f's{servo:02}[{self.servo_keys[self.servo_pins.index(servo)]}] = {value_string}'
-            if self.control == f's{servo}':
-                self.screen.addstr(row, col, rep, curses.color_pair(2))
-            else:
-                self.screen.addstr(row, col, rep)
-        except curses.error:
-            pass
+            value = self.board.__getattribute__(f's{servo}')
+        except AttributeError:
+            value = None
+        value_string = '--' if value is None else f'{value:.1f}'
+        rep = f'{self.label(f"s{servo}")} = {value_string}'
+        self.addstr(row, col, rep, curses.color_pair(2) if self.control == f's{servo}' else 0)
 
     def show_adc(self, row, col, adc):
-        try:
-            try:
-                value = self.board.__getattribute__(f'adc{adc}')
-            except AttributeError:
-                value = None
-            value_string = '--' if value is None else f'{value:.2f}'
-            rep = f'adc{adc:01}[{self.adc_keys[self.adcs.index(adc)]}] = {value_string}v'
-            if self.control == f'adc{adc}':
-                self.screen.addstr(row, col, rep, curses.color_pair(2))
-            else:
-                self.screen.addstr(row, col, rep)
-        except curses.error:
-            pass
+        # Only ADC channels which are visible are read
+        value = self.read_adc(adc)
+        value_string = '--' if value is None else f'{value:.2f}'
+        rep = f'{self.label(f"adc{adc}")} = {value_string}v'
+        self.addstr(row, col, rep, curses.color_pair(2) if self.control == f'adc{adc}' else 0)
 
-    def show_value(self, row, col, value):
+    def show_led(self, row, col, led):
         try:
-            current_value = self.value
-            string = f'[{VALUE_KEYS[VALUE_ITEMS.index(round(value, 1))]}]={round(value, 1)}'
-            if current_value is not None and round(current_value, 1) == round(value, 1):
-                self.screen.addstr(row, col, string, curses.color_pair(2))
+            r, g, b = self.board.__getattribute__(f'led{led}_rgb')
+            value_string = f'#{round(r * 255):02x}{round(g * 255):02x}{round(b * 255):02x}'
+        except AttributeError:
+            value_string = '--'
+        rep = f'{self.label(f"led{led}")} = {value_string}'
+        self.addstr(row, col, rep, curses.color_pair(2) if self.control == f'led{led}' else 0)
+
+    def show_telemetry(self):
+        """
+        Show history, min / mean / max, and update rate for the selected control and those following it
+        """
+        self.print_header('Telemetry, T to hide')
+        self.println(f'{"":8}{"history":{SPARKLINE_WIDTH + 1}}{"min":>8}{"mean":>8}{"max":>8}{"rate":>10}', True)
+        screen_lines, _ = self.screen.getmaxyx()
+        start = self.control_indices[self.control]
+        for control in self.all_controls[start:start + max(0, screen_lines - self.line)]:
+            if control.startswith('adc'):
+                self.read_adc(self.control_widgets[control][1])
+            history = self.telemetry.history.get(control)
+            rate = self.telemetry.rates.get(control)
+            rate_string = '--' if rate is None else f'{rate:.1f}/s'
+            if history is None or not history.count:
+                self.println(f'{control:8}{"":{SPARKLINE_WIDTH + 25}}{rate_string:>10}')
             else:
-                self.screen.addstr(row, col, string)
-        except curses.error:
-            pass
+                self.println(f'{control:8}{history.sparkline(SPARKLINE_WIDTH):{SPARKLINE_WIDTH + 1}}'
+                             f'{history.min:8.2f}{history.mean:8.2f}{history.max:8.2f}{rate_string:>10}')
+
+    def show_value(self, row, col, value, current_value):
+        string = f'[{VALUE_KEYS[VALUE_ITEMS.index(round(value, 1))]}]={round(value, 1)}'
+        if current_value is not None and round(current_value, 1) == round(value, 1):
+            self.addstr(row, col, string, curses.color_pair(2))
+        else:
+            self.addstr(row, col, string)
+
+
+class RollingWindow:
+    """
+    Fixed size ring buffer of numbers which tracks the minimum, maximum, and mean of its contents in constant amortised
+    time per sample, regardless of size
+    """
+
+    def __init__(self, size):
+        self.size = size
+        self.values = [0.0] * size
+        self.count = 0
+        self.total = 0.0
+        # Index of the next sample to be added, counts up forever so older samples can be recognised in the queues
+        self.sequence = 0
+        # Monotonic queues of (sequence, value), the front of each is the current minimum / maximum
+        self.minima = deque()
+        self.maxima = deque()
+
+    def add(self, value):
+        value = float(value)
+        position = self.sequence % self.size
+        if self.count == self.size:
+            self.total -= self.values[position]
+            expired = self.sequence - self.size
+            if self.minima[0][0] == expired:
+                self.minima.popleft()
+            if self.maxima[0][0] == expired:
+                self.maxima.popleft()
+        else:
+            self.count += 1
+        self.values[position] = value
+        self.total += value
+        while self.minima and self.minima[-1][1] >= value:
+            self.minima.pop()
+        self.minima.append((self.sequence, value))
+        while self.maxima and self.maxima[-1][1] <= value:
+            self.maxima.pop()
+        self.maxima.append((self.sequence, value))
+        self.sequence += 1
+
+    @property
+    def min(self):
+        return self.minima[0][1]
+
+    @property
+    def max(self):
+        return self.maxima[0][1]
+
+    @property
+    def mean(self):
+        return self.total / self.count
+
+    def latest(self, n):
+        """
+        The most recent n samples, oldest first
+        """
+        n = min(n, self.count)
+        return [self.values[(self.sequence - n + i) % self.size] for i in range(n)]
+
+    def sparkline(self, width):
+        """
+        The most recent samples drawn as a string of block characters, scaled to the minimum and maximum of the window
+        """
+        low, high = self.min, self.max
+        top = len(SPARKLINE_CHARACTERS) - 1
+        if high == low:
+            return SPARKLINE_CHARACTERS[top // 2] * min(width, self.count)
+        scale = top / (high - low)
+        return ''.join(SPARKLINE_CHARACTERS[round((value - low) * scale)] for value in self.latest(width))
+
+
+class Telemetry:
+    """
+    Rolling history of channel values, along with the rate of writes to each motor, servo, and LED and the rate of
+    hardware reads from each ADC channel
+    """
+
+    def __init__(self, board, window):
+        self.board = board
+        self.window = window
+        self.history = {}
+        self.rates = {}
+        self.counters = {}
+        self.sample_time = None
+
+    def add(self, control, value):
+        """
+        Record a value for a control, None values, i.e. from disabled servos, are ignored
+        """
+        if value is None:
+            return
+        history = self.history.get(control)
+        if history is None:
+            history = self.history[control] = RollingWindow(self.window)
+        history.add(value)
+
+    def sample(self, now):
+        """
+        Update rates from the board's write and read counters
+        """
+        counters = self.board.counters
+        if self.sample_time is not None and now > self.sample_time:
+            interval = now - self.sample_time
+            for control, count in counters.items():
+                self.rates[control] = (count - self.counters.get(control, count)) / interval
+        self.counters = counters
+        self.sample_time = now
 
 
 class MotorConfigEditor:
@@ -292,15 +690,12 @@ class MotorConfigEditor:
         self.height = height
 
     def render(self):
-        try:
-            screen = self.display.screen
-            curses.textpad.rectangle(screen, self.row, self.column, self.row + self.height, 79)
-            screen.addstr(self.row + 1, self.column + 1, f'Motor {self.display.control}, \'=\' to toggle invert:',
-                          curses.color_pair(1))
-            invert = self.display.board.__getattribute__(f'{self.display.control}_invert')
-            screen.addstr(self.row + 2, self.column + 1, f'Invert direction = {invert}')
-        except curses.error:
-            pass
+        display = self.display
+        display.box(self.row, self.column, self.row + self.height, 79)
+        display.addstr(self.row + 1, self.column + 1, f'Motor {display.control}, \'=\' to toggle invert:',
+                       curses.color_pair(1))
+        invert = display.board.__getattribute__(f'{display.control}_invert')
+        display.addstr(self.row + 2, self.column + 1, f'Invert direction = {invert}')
 
     def edit(self):
         invert = self.display.board.__getattribute__(f'{self.display.control}_invert')
@@ -315,36 +710,79 @@ class ADCConfigEditor:
         self.height = height
 
     def render(self):
+        display = self.display
+        display.box(self.row, self.column, self.row + self.height, 79)
+        display.addstr(self.row + 1, self.column + 1, f'ADC {display.control}, \'=\' to calibrate:',
+                       curses.color_pair(1))
+        calibration = display.board.__getattribute__(f'{display.control}_calibration')
+        if calibration:
+            display.addstr(self.row + 2, self.column + 1, f'Calibrated from {len(calibration)} point(s)')
+        else:
+            divisor = display.board.__getattribute__(f'{display.control}_divisor')
+            display.addstr(self.row + 2, self.column + 1, f'Current divisor = {divisor:.1f}')
+
+    def edit(self):
+        """
+        Collect (raw, measured) calibration points until an empty value is entered. The raw value is read again for
+        each point, so the input can be changed between points, i.e. by adjusting a bench power supply.
+        """
+        board = self.display.board
+        control = self.display.control
+        points = []
         try:
             screen = self.display.screen
-            curses.textpad.rectangle(screen, self.row, self.column, self.row + self.height, 79)
-            screen.addstr(self.row + 1, self.column + 1, f'ADC {self.display.control}, \'=\' to calibrate:',
-                          curses.color_pair(1))
-            divisor = self.display.board.__getattribute__(f'{self.display.control}_divisor')
-            screen.addstr(self.row + 2, self.column + 1, f'Current divisor = {divisor:.1f}')
+            curses.echo()
+            curses.curs_set(2)
+            while True:
+                raw = board.__getattribute__(f'{control}_raw')
+                screen.addstr(self.row + 1, self.column + 1, f'Point {len(points) + 1}, raw = {raw}'.ljust(37),
+                              curses.color_pair(1))
+                screen.addstr(self.row + 2, self.column + 1, f'Measured (blank ends) ='.ljust(37))
+                measured_voltage = screen.getstr(self.row + 2, self.column + 25, 10)
+                try:
+                    points.append((raw, float(measured_voltage)))
+                except ValueError:
+                    break
         except curses.error:
             pass
+        curses.noecho()
+        curses.curs_set(0)
+        if points:
+            try:
+                board.__setattr__(f'{control}_calibration', points)
+            except ValueError:
+                # Points which can't be fitted, i.e. two different measurements for the same raw value
+                pass
+
+
+class LEDConfigEditor:
+    def __init__(self, display, row, column, height):
+        self.display = display
+        self.row = row
+        self.column = column
+        self.height = height
+
+    def render(self):
+        display = self.display
+        display.box(self.row, self.column, self.row + self.height, 79)
+        display.addstr(self.row + 1, self.column + 1, f'LED {display.control}, \'=\' to set colour:',
+                       curses.color_pair(1))
+        h, s, v = display.board.__getattribute__(display.control)
+        brightness = display.board.__getattribute__(f'{display.control}_brightness')
+        display.addstr(self.row + 2, self.column + 1, f'HSV = {h:.2f}, {s:.2f}, {v:.2f}')
+        display.addstr(self.row + 3, self.column + 1, f'Brightness = {brightness:.2f}')
 
     def edit(self):
         try:
             screen = self.display.screen
-            screen.addstr(self.row + 1, self.column + 1, f'Enter observed voltage, then RETURN:  ',
+            screen.addstr(self.row + 1, self.column + 1, f'Enter colour name, then RETURN:     ',
                           curses.color_pair(1))
-            screen.addstr(self.row + 2, self.column + 1, f'Measured voltage =                    ')
+            screen.addstr(self.row + 2, self.column + 1, f'Colour =                     ')
             curses.echo()
             curses.curs_set(2)
-            measured_voltage = screen.getstr(self.row + 2, self.column + 20, 10)
-
-            parsed_measured_voltage = None
-            try:
-                parsed_measured_voltage = float(measured_voltage)
-            except ValueError:
-                pass
-            if parsed_measured_voltage:
-                current_voltage = self.display.value
-                current_divisor = self.display.board.__getattribute__(f'{self.display.control}_divisor')
-                new_divisor = current_divisor * (current_voltage / parsed_measured_voltage)
-                self.display.board.__setattr__(f'{self.display.control}_divisor', new_divisor)
+            colour = screen.getstr(self.row + 2, self.column + 10, 20).decode('utf-8').strip()
+            if colour:
+                self.display.board.__setattr__(self.display.control, colour)
             curses.noecho()
             curses.curs_set(0)
         except curses.error:
@@ -360,16 +798,13 @@ class ServoConfigEditor:
         self.height = height
 
     def render(self):
-        try:
-            screen = self.display.screen
-            curses.textpad.rectangle(screen, self.row, self.column, self.row + self.height, 79)
-            screen.addstr(self.row + 1, self.column + 1, f'Servo {self.display.control}, \'=\' to edit config:',
-                          curses.color_pair(1))
-            pulse_min, pulse_max = self.display.board.__getattribute__(f'{self.display.control}_config')
-            screen.addstr(self.row + 2, self.column + 1, f'Min pulse width = {pulse_min} μs')
-            screen.addstr(self.row + 3, self.column + 1, f'Max pulse width = {pulse_max} μs')
-        except curses.error:
-            pass
+        display = self.display
+        display.box(self.row, self.column, self.row + self.height, 79)
+        display.addstr(self.row + 1, self.column + 1, f'Servo {display.control}, \'=\' to edit config:',
+                       curses.color_pair(1))
+        pulse_min, pulse_max = display.board.__getattribute__(f'{display.control}_config')
+        display.addstr(self.row + 2, self.column + 1, f'Min pulse width = {pulse_min} μs')
+        display.addstr(self.row + 3, self.column + 1, f'Max pulse width = {pulse_max} μs')
 
     def edit(self):
         try:
@@ -1,15 +1,19 @@
-# -*- coding: future_fstrings -*-
-
 import colorsys
 import logging
+import math
 
-from approxeng.hwsupport.css4_colours import CSS4_COLOURS
+from approxeng.hwsupport.colours import parse_colour, nearest_colour_name
 from approxeng.hwsupport.util import check_positive, check_positive_range
 
 LOGGER = logging.getLogger(name='approxeng.hwsupport.leds')
 
 LEDS = 'leds'
 
+# Temporal dithering thresholds step through a low discrepancy sequence, each colour component of each LED starting at a
+# different point so they don't all change level on the same frame
+_DITHER_STEP = (math.sqrt(5) - 1) / 2
+_DITHER_PHASE = 1 - _DITHER_STEP
+
 
 class LED:
     def __init__(self, led, board):
@@ -19,14 +23,22 @@ class LED:
         self.gamma = 1.0
         self.saturation = 1.0
         self.hsv = (0, 0, 0)
+        self.bits = None
+        self.dither = False
+        self.frame = 0
+        self.output = None
+        self.write_count = 0
 
     def set_colour(self, _, value):
-        if isinstance(value, tuple):
-            self.board.set_led_hsv(self.led, *value)
-        elif value in CSS4_COLOURS:
-            self.board.set_led_hsv(self.led, *CSS4_COLOURS[value])
-        else:
-            LOGGER.warning(f'colour for led{self.led} is neither a triple or a colour name')
+        try:
+            hsv = parse_colour(value)
+        except ValueError:
+            LOGGER.warning(f'colour for led{self.led} is not a triple, colour name, or parsable colour, was {value}')
+            return
+        self.board.set_led_hsv(self.led, *hsv)
+
+    def get_colour_name(self, _):
+        return nearest_colour_name(*colorsys.hsv_to_rgb(*self.hsv))
 
     def set_gamma(self, _, value):
         self.board.set_led_gamma(self.led, value)
@@ -56,6 +68,25 @@ class LED:
     def get_brightness(self, _):
         return self.brightness
 
+    def set_bits(self, _, value):
+        if value is not None and (not isinstance(value, int) or isinstance(value, bool) or not 1 <= value <= 16):
+            raise ValueError(f'led{self.led}_bits must be None or an int from 1 to 16, was {value}')
+        self.bits = value
+        self.output = None
+        self.board._update_led(self)
+
+    def get_bits(self, _):
+        return self.bits
+
+    def set_dither(self, _, value):
+        if not isinstance(value, bool):
+            raise ValueError(f'led{self.led}_dither must be True|False, was {value}')
+        self.dither = value
+        self.board._update_led(self)
+
+    def get_dither(self, _):
+        return self.dither
+
 
 class SetLEDsMixin:
 
@@ -71,18 +102,21 @@ class SetLEDsMixin:
 
     def set_led_brightness(self, led, brightness):
         config = self._check_led_index(led)
-        config.brightness = check_positive_range(brightness)
-        self._update_led(config)
+        with self._state_lock:
+            config.brightness = check_positive_range(brightness)
+            self._update_led(config)
 
     def set_led_gamma(self, led, gamma):
         config = self._check_led_index(led)
-        config.gamma = check_positive(gamma)
-        self._update_led(config)
+        with self._state_lock:
+            config.gamma = check_positive(gamma)
+            self._update_led(config)
 
     def set_led_saturation(self, led, saturation):
         config = self._check_led_index(led)
-        config.saturation = check_positive(saturation)
-        self._update_led(config)
+        with self._state_lock:
+            config.saturation = check_positive(saturation)
+            self._update_led(config)
 
     def set_led_hsv(self, led, h, s, v):
         config = self._check_led_index(led)
@@ -92,8 +126,11 @@ class SetLEDsMixin:
             v = check_positive_range(float(v))
         except ValueError:
             raise ValueError('argument to set_led_hsv must be parsable as three numbers (hue, saturation, value')
-        config.hsv = h, s, v
-        self._update_led(config)
+        with self._state_lock:
+            config.hsv = h, s, v
+            if self._shared_state is not None:
+                self._shared_state.update(LEDS, {led: config.hsv})
+            self._update_led(config)
 
     def set_led_rgb(self, led, r, g, b):
         try:
@@ -105,8 +142,39 @@ class SetLEDsMixin:
         self.set_led_hsv(led, *colorsys.rgb_to_hsv(r, g, b))
 
     def _update_led(self, config):
-        h, s, v = config.hsv
-        v = v * config.brightness
-        s = s ** (1 / config.saturation) if config.saturation > 0 else 0
-        r, g, b = colorsys.hsv_to_rgb(h, s, v)
-        self._set_led_rgb(config.led, r ** config.gamma, g ** config.gamma, b ** config.gamma)
+        with self._state_lock:
+            h, s, v = config.hsv
+            v = v * config.brightness
+            s = s ** (1 / config.saturation) if config.saturation > 0 else 0
+            r, g, b = colorsys.hsv_to_rgb(h, s, v)
+            r, g, b = r ** config.gamma, g ** config.gamma, b ** config.gamma
+            if config.bits is not None:
+                levels = (1 << config.bits) - 1
+                if config.dither:
+                    phase = config.frame * _DITHER_STEP + config.led * 3 * _DITHER_PHASE
+                    output = tuple(min(levels, int(c * levels + (phase + n * _DITHER_PHASE) % 1.0))
+                                   for n, c in enumerate((r, g, b)))
+                else:
+                    output = (int(r * levels + 0.5), int(g * levels + 0.5), int(b * levels + 0.5))
+                if output == config.output:
+                    # Nothing would change on the hardware
+                    return
+                r, g, b = (c / levels for c in output)
+            config.write_count += 1
+            self._set_led_rgb(config.led, r, g, b)
+            if config.bits is not None:
+                # Only once the driver has accepted it, so a failed write is retried by the next identical one
+                config.output = output
+
+    def advance_led_frame(self):
+        """
+        Move on to the next frame of temporal dithering, for any LEDs with both ledXX_bits and ledXX_dither set. Call
+        this once per frame of an animation, or once per tick of a control loop. Over successive frames each LED's
+        output alternates between the quantised levels either side of the requested colour, so that on average it
+        shows the colour more accurately than the bit depth alone would allow. Only LEDs whose output actually changes
+        are written to.
+        """
+        for config in self._config[LEDS].values():
+            if config.dither and config.bits is not None:
+                config.frame += 1
+                self._update_led(config)
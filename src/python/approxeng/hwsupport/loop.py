@@ -0,0 +1,128 @@
+import logging
+import time
+from collections import deque
+
+LOGGER = logging.getLogger(name='approxeng.hwsupport.loop')
+
+# Number of recent ticks used to calculate jitter percentiles
+JITTER_WINDOW = 1000
+
+
+class LoopStatistics:
+    """
+    Timing statistics for a loop started with run_loop. All times are in seconds.
+    """
+
+    def __init__(self, hz, window=JITTER_WINDOW):
+        self.hz = hz
+        self.period = 1.0 / hz
+        # Lateness of the start of each recent tick relative to its deadline
+        self.jitter = deque(maxlen=window)
+        self.ticks = 0
+        self.overruns = 0
+        self.skipped = 0
+        self.callback_time = 0.0
+        self.driver_time = 0.0
+
+    def percentile(self, p):
+        """
+        The p-th percentile of jitter over recent ticks, i.e. percentile(99)
+        """
+        if not self.jitter:
+            return 0.0
+        ordered = sorted(self.jitter)
+        return ordered[min(len(ordered) - 1, int(len(ordered) * p / 100))]
+
+    @property
+    def summary(self):
+        """
+        A dict of tick and overrun counts, jitter percentiles, and the mean time per tick spent in the callback and
+        in reading from or writing to the board
+        """
+        ticks = max(self.ticks, 1)
+        return {'ticks': self.ticks, 'overruns': self.overruns, 'skipped': self.skipped,
+                'jitter_p50': self.percentile(50), 'jitter_p90': self.percentile(90),
+                'jitter_p99': self.percentile(99), 'jitter_max': self.percentile(100),
+                'callback_mean': self.callback_time / ticks, 'driver_mean': self.driver_time / ticks}
+
+
+class RunLoopMixin:
+    """
+    Mixed into the new class used for the augmented instance to provide the run_loop method
+    """
+
+    def run_loop(self, callback, hz, adcs=None, ticks=None, statistics=None):
+        """
+        Call a function at a fixed rate until it returns False. Deadlines are calculated from the time the loop
+        started rather than from the end of the previous tick, so the loop doesn't drift however long each tick takes.
+        If a tick runs past the next deadline that's counted as an overrun and the next tick starts straight away, but
+        any further deadlines which have also passed are skipped rather than run back to back to catch up.
+
+        Each tick:
+
+        1. Reads the requested ADC channels in one call to read_adcs
+        2. Calls callback(readings) with a dict of channel to value for those channels
+        3. If the bus thread is enabled, waits for all writes made by the callback to reach the hardware
+
+        If the callback raises an exception, or the loop is interrupted, the board's stop() method is called before
+        the exception is passed on.
+
+        :param callback:
+            Function taking a dict of ADC channel to value, return False to end the loop
+        :param hz:
+            Number of ticks per second
+        :param adcs:
+            ADC channels to read before each tick, defaults to None to read none
+        :param ticks:
+            Maximum number of ticks to run, defaults to None to run until the callback returns False
+        :param statistics:
+            A LoopStatistics to update, which can be watched from another thread while the loop runs, defaults to None
+            to create a new one
+        :return:
+            The LoopStatistics for this loop
+        """
+        if hz <= 0:
+            raise ValueError(f'loop rate must be > 0, was {hz}')
+        adcs = list(adcs or [])
+        if statistics is None:
+            statistics = LoopStatistics(hz)
+        period = 1.0 / hz
+        start = time.monotonic()
+        tick = 0
+        completed = 0
+        try:
+            while ticks is None or completed < ticks:
+                deadline = start + tick * period
+                now = time.monotonic()
+                if now < deadline:
+                    time.sleep(deadline - now)
+                    now = time.monotonic()
+                statistics.jitter.append(now - deadline)
+
+                readings = self.read_adcs(adcs) if adcs else {}
+                before_callback = time.monotonic()
+                result = callback(readings)
+                after_callback = time.monotonic()
+                if self._bus is not None:
+                    self._bus.flush()
+                end = time.monotonic()
+
+                completed += 1
+                statistics.ticks += 1
+                statistics.callback_time += after_callback - before_callback
+                statistics.driver_time += (before_callback - now) + (end - after_callback)
+                if result is False:
+                    break
+
+                # Move to the next deadline. If that's already passed, run straight away but skip any earlier ones
+                tick += 1
+                latest_passed = int((end - start) / period)
+                if latest_passed >= tick:
+                    statistics.overruns += 1
+                    statistics.skipped += latest_passed - tick
+                    tick = latest_passed
+        except BaseException:
+            LOGGER.warning('control loop ended by an exception, stopping board')
+            self.stop()
+            raise
+        return statistics
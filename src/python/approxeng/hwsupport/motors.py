@@ -1,7 +1,6 @@
-# -*- coding: future_fstrings -*-
-
 import logging
 
+from approxeng.hwsupport.curves import make_curve
 from approxeng.hwsupport.util import check_range, check_positive_range
 
 LOGGER = logging.getLogger(name='approxeng.hwsupport.motors')
@@ -18,11 +17,13 @@ class Motor:
         self.invert = invert
         self.scale = scale
         self.board = board
+        self.curve = None
         self.value = None
+        self.write_count = 0
 
     @property
     def config(self):
-        return {'invert': self.invert, 'scale': self.scale}
+        return {'invert': self.invert, 'scale': self.scale, 'curve': self.curve.config if self.curve else None}
 
     @config.setter
     def config(self, d):
@@ -30,6 +31,8 @@ class Motor:
             self.set_invert(None, d['invert'])
         if 'scale' in d:
             self.set_scale(None, d['scale'])
+        if 'curve' in d:
+            self.set_curve(None, d['curve'])
 
     def set_value(self, _, value):
         self.board.set_motor_speed(motor=self.motor, speed=value * self.scale)
@@ -59,6 +62,17 @@ class Motor:
     def get_scale(self, _):
         return self.scale
 
+    def set_curve(self, _, value):
+        try:
+            self.curve = make_curve(value)
+        except ValueError as e:
+            raise ValueError(f'm{self.motor}_curve invalid, {e}')
+        if self.value is not None:
+            self.board.set_motor_speed(motor=self.motor, speed=self.value)
+
+    def get_curve(self, _):
+        return self.curve.config if self.curve else None
+
 
 class SetMotorsMixin:
     """
@@ -85,7 +99,53 @@ class SetMotorsMixin:
                 raise ValueError(f'motor m{motor} not in {list(self._config[MOTORS].keys())}')
             speed = check_range(speed)
             config = self._config[MOTORS][motor]
-            config.value = speed
-            self._set_motor_speed(motor, speed if not config.invert else -speed, **kwargs)
+            with self._state_lock:
+                config.value = speed
+                config.write_count += 1
+                if self._shared_state is not None:
+                    self._shared_state.update(MOTORS, {motor: speed})
+                if config.curve is not None:
+                    speed = config.curve(speed)
+                self._set_motor_speed(motor, speed if not config.invert else -speed, **kwargs)
         else:
             raise ValueError(f'board has no motor functions, unable to set m{motor}')
+
+    def set_motor_speeds(self, speeds: dict, **kwargs):
+        """
+        Set several motor speeds at once
+
+        If the underlying board provides a _set_motor_speeds(speeds) method this is called exactly once with a dict of
+        motor index to range-checked speed, with calibration curves and inversion applied, otherwise _set_motor_speed
+        is called once for each motor.
+
+        :param speeds:
+            A dict of motor index to speed from -1.0 to 1.0, values outside this range will be clamped to it
+        :param kwargs:
+            Any additional arguments to be passed to the underlying _set_motor_speeds or _set_motor_speed method
+        :raises:
+            ValueError if any of the supplied indices aren't in the array of motors, or no motors are defined. In this
+            case no motors are set.
+        """
+        if MOTORS not in self._config:
+            raise ValueError(f'board has no motor functions, unable to set {list(speeds.keys())}')
+        for motor in speeds:
+            if motor not in self._config[MOTORS]:
+                raise ValueError(f'motor m{motor} not in {list(self._config[MOTORS].keys())}')
+        LOGGER.debug(f'set motors {speeds}')
+        with self._state_lock:
+            hardware_speeds = {}
+            for motor, speed in speeds.items():
+                speed = check_range(speed)
+                config = self._config[MOTORS][motor]
+                config.value = speed
+                config.write_count += 1
+                if config.curve is not None:
+                    speed = config.curve(speed)
+                hardware_speeds[motor] = speed if not config.invert else -speed
+            if self._shared_state is not None:
+                self._shared_state.update(MOTORS, {motor: self._config[MOTORS][motor].value for motor in speeds})
+            if callable(getattr(self, '_set_motor_speeds', None)):
+                self._set_motor_speeds(hardware_speeds, **kwargs)
+            else:
+                for motor, speed in hardware_speeds.items():
+                    self._set_motor_speed(motor, speed, **kwargs)
@@ -0,0 +1,390 @@
+import logging
+import queue
+import random
+import threading
+import time
+
+LOGGER = logging.getLogger(name='approxeng.hwsupport.resilience')
+
+# Circuit breaker states
+CLOSED = 'closed'
+OPEN = 'open'
+HALF_OPEN = 'half_open'
+
+
+class _Call:
+    """
+    A driver call handed to the worker thread
+    """
+
+    def __init__(self, hook, args, kwargs):
+        self.hook = hook
+        self.args = args
+        self.kwargs = kwargs
+        self.done = threading.Event()
+        self.abandoned = False
+        self.value = None
+        self.error = None
+
+
+class _Worker:
+    """
+    A single daemon thread making driver calls, so the caller can stop waiting for a call which has hung. Calls are
+    made one at a time, so a hung call holds up the ones behind it rather than running alongside it, and calls whose
+    caller has already given up are skipped.
+    """
+
+    def __init__(self):
+        self._queue = queue.Queue()
+        self._thread = threading.Thread(target=self._run, name='hwsupport-driver', daemon=True)
+        self._thread.start()
+
+    def _run(self):
+        while True:
+            call = self._queue.get()
+            if call is None:
+                return
+            if call.abandoned:
+                continue
+            try:
+                call.value = call.hook(*call.args, **call.kwargs)
+            except BaseException as e:
+                call.error = e
+            call.done.set()
+
+    def call(self, hook, args, kwargs, deadline):
+        call = _Call(hook, args, kwargs)
+        self._queue.put(call)
+        if not call.done.wait(timeout=deadline):
+            call.abandoned = True
+            raise TimeoutError(f'{getattr(hook, "__name__", hook)} took longer than {deadline}s')
+        if call.error is not None:
+            raise call.error
+        return call.value
+
+    def close(self):
+        self._queue.put(None)
+
+
+class ResiliencePolicy:
+    """
+    Protects a board from an unreliable bus when add_properties is called with resilience=True. You won't normally
+    create this class directly, use the board's resilience property to configure it.
+
+    The board's _set_motor_speed, _set_motor_speeds, _set_servo_pulsewidth, _set_led_rgb, _write_gpio, _read_adc,
+    _read_adcs, _read_encoder, _read_encoders, _read_gpio and _read_gpios methods are replaced on the instance by
+    versions which:
+
+    1. Give up on any call taking longer than the deadline, raising TimeoutError. Python can't interrupt a call that has
+    hung, so while a deadline is set calls are made on a separate driver thread, one at a time.
+    2. Retry writes which raise one of the exceptions in 'exceptions', OSError by default, up to 'retries' times,
+    waiting a random time of up to backoff * 2^n seconds before retry n. Writes set absolute values so are safe to
+    repeat. Reads and calls which timed out aren't retried.
+    3. Open a circuit breaker after 'failure_threshold' calls in a row have failed. While the breaker is open no calls
+    are made to the hardware: writes are stored, only the latest for each channel being kept, and reads return the
+    last value read from that channel, raising OSError if there isn't one. After 'reset_timeout' seconds the next call
+    goes to the hardware as a trial, if it succeeds the breaker closes and the stored writes are sent, if not it stays
+    open for another 'reset_timeout' seconds.
+
+    Writes which fail while the breaker is closed raise the exception as normal, but are also stored, so if the
+    breaker later opens and closes again every channel is set back to the last value requested for it.
+    """
+
+    def __init__(self, board, deadline=None, retries=2, backoff=0.005, failure_threshold=5, reset_timeout=1.0,
+                 exceptions=(OSError,)):
+        self.deadline = deadline
+        self.retries = retries
+        self.backoff = backoff
+        self.failure_threshold = failure_threshold
+        self.reset_timeout = reset_timeout
+        self.exceptions = exceptions
+        self._lock = threading.Lock()
+        self._worker = None
+        self._state = CLOSED
+        self._opened_at = 0.0
+        self._consecutive_failures = 0
+        self._replay = {}
+        self._cached = {}
+        self.calls = 0
+        self.failed_attempts = 0
+        self.failed_calls = 0
+        self.retries_made = 0
+        self.timeouts = 0
+        self.trips = 0
+        self.served_from_cache = 0
+        self.coalesced = 0
+        self.last_error = None
+
+        # Capture the original driver methods, then shadow them on the instance
+        self._set_motor_speed = getattr(board, '_set_motor_speed', None)
+        self._set_motor_speeds = getattr(board, '_set_motor_speeds', None)
+        self._set_servo_pulsewidth = getattr(board, '_set_servo_pulsewidth', None)
+        self._set_led_rgb = getattr(board, '_set_led_rgb', None)
+        self._read_adc = getattr(board, '_read_adc', None)
+        self._read_adcs = getattr(board, '_read_adcs', None)
+        self._write_gpio = getattr(board, '_write_gpio', None)
+        self._read_encoder = getattr(board, '_read_encoder', None)
+        self._read_encoders = getattr(board, '_read_encoders', None)
+        self._read_gpio = getattr(board, '_read_gpio', None)
+        self._read_gpios = getattr(board, '_read_gpios', None)
+        if callable(self._set_motor_speed):
+            board._set_motor_speed = lambda motor, speed, **kwargs: self._write('motor', motor, (speed,), kwargs)
+        if callable(self._set_motor_speeds):
+            board._set_motor_speeds = self.set_motor_speeds
+        if callable(self._set_servo_pulsewidth):
+            board._set_servo_pulsewidth = lambda servo, pulse_width, **kwargs: self._write('servo', servo,
+                                                                                          (pulse_width,), kwargs)
+        if callable(self._set_led_rgb):
+            board._set_led_rgb = lambda led, r, g, b, **kwargs: self._write('led', led, (r, g, b), kwargs)
+        if callable(self._read_adc):
+            board._read_adc = self.read_adc
+        if callable(self._read_adcs):
+            board._read_adcs = self.read_adcs
+        if callable(self._write_gpio):
+            board._write_gpio = lambda gpio, level, **kwargs: self._write('gpio', gpio, (level,), kwargs)
+        if callable(self._read_encoder):
+            board._read_encoder = self.read_encoder
+        if callable(self._read_encoders):
+            board._read_encoders = self.read_encoders
+        if callable(self._read_gpio):
+            board._read_gpio = self.read_gpio
+        if callable(self._read_gpios):
+            board._read_gpios = self.read_gpios
+
+    @property
+    def state(self):
+        """
+        The circuit breaker state, one of 'closed', 'open' or 'half_open'
+        """
+        return self._state
+
+    @property
+    def telemetry(self):
+        """
+        A dict of breaker state and failure counts. Attempts count each try at a call, including retries, while calls
+        count each write or read requested by the board.
+        """
+        with self._lock:
+            return {'state': self._state, 'calls': self.calls, 'failed_attempts': self.failed_attempts,
+                    'failed_calls': self.failed_calls, 'consecutive_failures': self._consecutive_failures,
+                    'retries': self.retries_made, 'timeouts': self.timeouts, 'trips': self.trips,
+                    'served_from_cache': self.served_from_cache, 'coalesced': self.coalesced,
+                    'waiting_for_replay': len(self._replay), 'last_error': self.last_error}
+
+    def _hooks(self):
+        return {'motor': self._set_motor_speed, 'servo': self._set_servo_pulsewidth, 'led': self._set_led_rgb,
+                'gpio': self._write_gpio}
+
+    def _allow(self):
+        """
+        Whether a call may go to the hardware now. Once reset_timeout has passed since the breaker opened, the first
+        caller to ask moves it to half open and makes the trial call, everyone else is treated as if it were open.
+        """
+        with self._lock:
+            self.calls += 1
+            if self._state == CLOSED:
+                return True
+            if self._state == OPEN and time.monotonic() - self._opened_at >= self.reset_timeout:
+                self._state = HALF_OPEN
+                return True
+            return False
+
+    def _run(self, hook, args, kwargs):
+        if self.deadline is None:
+            return hook(*args, **kwargs)
+        with self._lock:
+            if self._worker is None:
+                self._worker = _Worker()
+        return self._worker.call(hook, args, kwargs, self.deadline)
+
+    def _call(self, hook, args, kwargs, retries):
+        """
+        Make a driver call, retrying up to 'retries' times, and update the breaker with the outcome
+        """
+        attempt = 0
+        while True:
+            try:
+                result = self._run(hook, args, kwargs)
+            except self.exceptions as e:
+                timed_out = isinstance(e, TimeoutError)
+                with self._lock:
+                    self.failed_attempts += 1
+                    self.timeouts += timed_out
+                    self.last_error = repr(e)
+                    give_up = attempt >= retries or timed_out or self._state == HALF_OPEN
+                    if give_up:
+                        self._failed()
+                    else:
+                        self.retries_made += 1
+                if give_up:
+                    raise
+                time.sleep(random.uniform(0, self.backoff * 2 ** attempt))
+                attempt += 1
+            else:
+                with self._lock:
+                    self._consecutive_failures = 0
+                    recovered = self._state == HALF_OPEN
+                    if recovered:
+                        self._state = CLOSED
+                if recovered:
+                    LOGGER.info('driver calls succeeding again, circuit breaker closed')
+                    self._send_replay()
+                return result
+
+    def _failed(self):
+        """
+        Record a failed call, opening the breaker if there have been too many in a row. Must be called holding the lock.
+        """
+        self.failed_calls += 1
+        self._consecutive_failures += 1
+        if self._state == HALF_OPEN or self._consecutive_failures >= self.failure_threshold:
+            if self._state != OPEN:
+                LOGGER.warning(f'{self._consecutive_failures} driver calls failed, circuit breaker open, '
+                               f'last error {self.last_error}')
+                self.trips += 1
+            self._state = OPEN
+            self._opened_at = time.monotonic()
+
+    def _store(self, kind, channel, args, kwargs):
+        with self._lock:
+            self._replay[(kind, channel)] = (args, kwargs)
+
+    def _write(self, kind, channel, args, kwargs):
+        if not self._allow():
+            with self._lock:
+                self.coalesced += 1
+            self._store(kind, channel, args, kwargs)
+            return
+        # Drop any stored write for this channel first, so if this is the trial call the replay doesn't overwrite it
+        with self._lock:
+            self._replay.pop((kind, channel), None)
+        try:
+            self._call(self._hooks()[kind], (channel,) + args, kwargs, retries=self.retries)
+        except self.exceptions:
+            self._store(kind, channel, args, kwargs)
+            raise
+
+    def set_motor_speeds(self, speeds, **kwargs):
+        """
+        Set several motors in one call to the hardware
+        """
+        if not self._allow():
+            with self._lock:
+                self.coalesced += len(speeds)
+            for motor, speed in speeds.items():
+                self._store('motor', motor, (speed,), kwargs)
+            return
+        with self._lock:
+            for motor in speeds:
+                self._replay.pop(('motor', motor), None)
+        try:
+            self._call(self._set_motor_speeds, (speeds,), kwargs, retries=self.retries)
+        except self.exceptions:
+            for motor, speed in speeds.items():
+                self._store('motor', motor, (speed,), kwargs)
+            raise
+
+    def _send_replay(self):
+        """
+        Send the stored writes once the breaker has closed, motors without extra arguments in a single call if the board
+        has a _set_motor_speeds method. Writes which fail stay stored.
+        """
+        with self._lock:
+            pending, self._replay = self._replay, {}
+        try:
+            if callable(self._set_motor_speeds):
+                speeds = {channel: args[0] for (kind, channel), (args, kwargs) in pending.items()
+                          if kind == 'motor' and not kwargs}
+                if speeds:
+                    self._call(self._set_motor_speeds, (speeds,), {}, retries=self.retries)
+                    for motor in speeds:
+                        del pending[('motor', motor)]
+            hooks = self._hooks()
+            for key in list(pending.keys()):
+                args, kwargs = pending[key]
+                self._call(hooks[key[0]], (key[1],) + args, kwargs, retries=self.retries)
+                del pending[key]
+        except self.exceptions as e:
+            LOGGER.warning(f'unable to send {len(pending)} stored writes, keeping them for later: {e!r}')
+            with self._lock:
+                for key, value in pending.items():
+                    self._replay.setdefault(key, value)
+
+    def read_adc(self, adc, **kwargs):
+        """
+        Read a raw value from the hardware, or the last value read from this channel while the breaker is open
+        """
+        return self._read_one('adc', adc, self._read_adc, dict(adc=adc, **kwargs))
+
+    def read_adcs(self, adcs, **kwargs):
+        """
+        Read several raw values from the hardware in one call, or the last values read while the breaker is open
+        """
+        return self._read_many('adc', adcs, self._read_adcs, (adcs,), kwargs)
+
+    def read_encoder(self, encoder, **kwargs):
+        """
+        Read an encoder count from the hardware, or the last count read while the breaker is open
+        """
+        return self._read_one('enc', encoder, self._read_encoder, dict(encoder=encoder, **kwargs))
+
+    def read_encoders(self, encoders, **kwargs):
+        """
+        Read several encoder counts from the hardware in one call, or the last counts read while the breaker is open
+        """
+        return self._read_many('enc', encoders, self._read_encoders, (encoders,), kwargs)
+
+    def read_gpio(self, gpio, **kwargs):
+        """
+        Read a pin level from the hardware, or the last level read while the breaker is open
+        """
+        return self._read_one('gpio', gpio, self._read_gpio, dict(gpio=gpio, **kwargs))
+
+    def read_gpios(self, **kwargs):
+        """
+        Read every pin as a bitmask in one call, or the last bitmask read while the breaker is open
+        """
+        return self._read_one('gpios', None, self._read_gpios, kwargs)
+
+    def _read_one(self, kind, channel, hook, kwargs):
+        if not self._allow():
+            return self._from_cache(kind, [channel])[channel]
+        value = self._call(hook, (), kwargs, retries=0)
+        with self._lock:
+            self._cached[(kind, channel)] = value
+        return value
+
+    def _read_many(self, kind, channels, hook, args, kwargs):
+        if not self._allow():
+            return self._from_cache(kind, channels)
+        values = self._call(hook, args, kwargs, retries=0)
+        with self._lock:
+            self._cached.update({(kind, channel): value for channel, value in values.items()})
+        return values
+
+    def _from_cache(self, kind, channels):
+        with self._lock:
+            missing = [channel for channel in channels if (kind, channel) not in self._cached]
+            if missing:
+                raise OSError(f'circuit breaker open and no cached value for {kind} channels {missing}')
+            self.served_from_cache += len(channels)
+            return {channel: self._cached[(kind, channel)] for channel in channels}
+
+    def reset(self):
+        """
+        Close the breaker and clear the failure count without waiting for reset_timeout, then send any stored writes
+        """
+        with self._lock:
+            self._state = CLOSED
+            self._consecutive_failures = 0
+        self._send_replay()
+
+    def close(self):
+        """
+        Stop the driver thread used for deadlines, if one was started. Called by the board's stop(). A new thread is
+        started if another call needs a deadline.
+        """
+        with self._lock:
+            if self._worker is not None:
+                self._worker.close()
+                self._worker = None
@@ -0,0 +1,571 @@
+import logging
+import os
+import selectors
+import socket
+import struct
+import threading
+
+LOGGER = logging.getLogger(name='approxeng.hwsupport.server')
+
+# Operation codes within a request frame
+OP_SET = 1
+OP_GET = 2
+OP_CALL = 3
+OP_DESCRIBE = 4
+
+# Result status codes within a response frame
+STATUS_OK = 0
+STATUS_ERROR = 1
+
+# Methods which clients are allowed to call, only those actually present on the board are exposed
+CALLABLE_METHODS = ('stop', 'drive', 'set_motor_speed', 'set_motor_speeds', 'set_servo', 'disable_servo', 'read_adc',
+                    'read_adcs', 'read_derived', 'read_encoder', 'read_encoders', 'encoder_velocities', 'read_gpio',
+                    'read_gpios', 'write_gpio', 'set_led_hsv', 'set_led_rgb', 'set_led_brightness', 'set_led_gamma',
+                    'set_led_saturation', 'advance_led_frame')
+
+# Properties returning helper objects rather than data, which can't be sent to clients
+HELPER_PROPERTIES = ('bus_writer', 'controllers', 'resilience', 'shared_state')
+
+# Longest error message sent in place of a result which couldn't be encoded
+MAX_ERROR_LENGTH = 200
+
+MAX_FRAME_SIZE = 1 << 20
+
+# Deepest nesting of tuples and dicts accepted in a request, deeper values are rejected as malformed
+MAX_NESTING = 32
+
+_LENGTH = struct.Struct('!I')
+_HEADER = struct.Struct('!IH')
+_INT = struct.Struct('!q')
+_FLOAT = struct.Struct('!d')
+_SHORT = struct.Struct('!H')
+
+
+def encode_value(value, out):
+    """
+    Append a compact tagged binary encoding of a value to a bytearray. Supports None, bool, int, float, str, and
+    tuples, lists, and dicts of these. Lists are decoded as tuples.
+    """
+    if value is None:
+        out += b'N'
+    elif value is True:
+        out += b'T'
+    elif value is False:
+        out += b'F'
+    elif isinstance(value, int):
+        out += b'i'
+        out += _INT.pack(value)
+    elif isinstance(value, float):
+        out += b'd'
+        out += _FLOAT.pack(value)
+    elif isinstance(value, str):
+        data = value.encode('utf-8')
+        out += b's'
+        out += _SHORT.pack(len(data))
+        out += data
+    elif isinstance(value, (tuple, list)):
+        out += b't'
+        out += _SHORT.pack(len(value))
+        for item in value:
+            encode_value(item, out)
+    elif isinstance(value, dict):
+        out += b'D'
+        out += _SHORT.pack(len(value))
+        for key, item in value.items():
+            encode_value(key, out)
+            encode_value(item, out)
+    else:
+        raise ValueError(f'unable to encode value {value} of type {type(value)}')
+
+
+def decode_value(data, offset, depth=0):
+    """
+    Decode a value written by encode_value, returning the value and the offset of the following byte
+
+    :raises:
+        ValueError if the data is malformed, nested more than MAX_NESTING deep, or has a dict key which can't be hashed
+    """
+    if depth > MAX_NESTING:
+        raise ValueError(f'value nested more than {MAX_NESTING} deep')
+    tag = data[offset:offset + 1]
+    offset += 1
+    if tag == b'N':
+        return None, offset
+    if tag == b'T':
+        return True, offset
+    if tag == b'F':
+        return False, offset
+    if tag == b'i':
+        return _INT.unpack_from(data, offset)[0], offset + _INT.size
+    if tag == b'd':
+        return _FLOAT.unpack_from(data, offset)[0], offset + _FLOAT.size
+    if tag == b's':
+        length = _SHORT.unpack_from(data, offset)[0]
+        offset += _SHORT.size
+        return bytes(data[offset:offset + length]).decode('utf-8'), offset + length
+    if tag == b't':
+        count = _SHORT.unpack_from(data, offset)[0]
+        offset += _SHORT.size
+        items = []
+        for _ in range(count):
+            item, offset = decode_value(data, offset, depth + 1)
+            items.append(item)
+        return tuple(items), offset
+    if tag == b'D':
+        count = _SHORT.unpack_from(data, offset)[0]
+        offset += _SHORT.size
+        result = {}
+        for _ in range(count):
+            key, offset = decode_value(data, offset, depth + 1)
+            try:
+                hash(key)
+            except TypeError:
+                raise ValueError(f'dict key {key} is not hashable')
+            result[key], offset = decode_value(data, offset, depth + 1)
+        return result, offset
+    raise ValueError(f'unknown value tag {tag}')
+
+
+def _encode_name(name, out):
+    data = name.encode('utf-8')
+    out.append(len(data))
+    out += data
+
+
+def _decode_name(data, offset):
+    length = data[offset]
+    offset += 1
+    return bytes(data[offset:offset + length]).decode('utf-8'), offset + length
+
+
+def encode_request(request_id, ops):
+    """
+    Build a request frame from a list of operations. Each operation is a tuple of (OP_SET, name, value),
+    (OP_GET, name), (OP_CALL, name, args), or (OP_DESCRIBE,)
+    """
+    out = bytearray(_LENGTH.size)
+    out += _HEADER.pack(request_id, len(ops))
+    for op in ops:
+        code = op[0]
+        out.append(code)
+        if code == OP_DESCRIBE:
+            continue
+        _encode_name(op[1], out)
+        if code == OP_SET:
+            encode_value(op[2], out)
+        elif code == OP_CALL:
+            encode_value(tuple(op[2]), out)
+    _LENGTH.pack_into(out, 0, len(out) - _LENGTH.size)
+    return out
+
+
+def decode_request(data):
+    """
+    Decode the body of a request frame, returning the request ID and a list of operation tuples
+    """
+    request_id, count = _HEADER.unpack_from(data, 0)
+    offset = _HEADER.size
+    ops = []
+    for _ in range(count):
+        code = data[offset]
+        offset += 1
+        if code == OP_DESCRIBE:
+            ops.append((code,))
+            continue
+        name, offset = _decode_name(data, offset)
+        if code == OP_SET or code == OP_CALL:
+            value, offset = decode_value(data, offset)
+            ops.append((code, name, value))
+        elif code == OP_GET:
+            ops.append((code, name))
+        else:
+            raise ValueError(f'unknown operation code {code}')
+    return request_id, ops
+
+
+def encode_response(request_id, results):
+    """
+    Build a response frame from a list of (status, value) pairs, one per operation in the request. A value which can't
+    be encoded is sent as an error for that operation instead.
+    """
+    out = bytearray(_LENGTH.size)
+    out += _HEADER.pack(request_id, len(results))
+    for status, value in results:
+        encoded = bytearray()
+        try:
+            encode_value(value, encoded)
+        except (ValueError, struct.error) as e:
+            status, encoded = STATUS_ERROR, bytearray()
+            encode_value(f'{type(e).__name__}: unable to encode result: {e}'[:MAX_ERROR_LENGTH], encoded)
+        out.append(status)
+        out += encoded
+    _LENGTH.pack_into(out, 0, len(out) - _LENGTH.size)
+    return out
+
+
+def decode_response(data):
+    """
+    Decode the body of a response frame, returning the request ID and a list of (status, value) pairs
+    """
+    request_id, count = _HEADER.unpack_from(data, 0)
+    offset = _HEADER.size
+    results = []
+    for _ in range(count):
+        status = data[offset]
+        value, offset = decode_value(data, offset + 1)
+        results.append((status, value))
+    return request_id, results
+
+
+def _split_frames(buffer):
+    """
+    Remove and return all complete frame bodies from the front of a bytearray
+    """
+    frames = []
+    offset = 0
+    while len(buffer) - offset >= _LENGTH.size:
+        length = _LENGTH.unpack_from(buffer, offset)[0]
+        if length > MAX_FRAME_SIZE:
+            raise ValueError(f'frame of {length} bytes exceeds maximum of {MAX_FRAME_SIZE}')
+        if len(buffer) - offset - _LENGTH.size < length:
+            break
+        start = offset + _LENGTH.size
+        frames.append(bytes(buffer[start:start + length]))
+        offset = start + length
+    del buffer[:offset]
+    return frames
+
+
+def _describe(board):
+    """
+    Find the public data properties, leaving out helper objects, and callable methods of an augmented board
+    """
+    cls = type(board)
+    properties = tuple(sorted(name for name in dir(cls)
+                              if not name.startswith('_') and name not in HELPER_PROPERTIES and
+                              isinstance(getattr(cls, name, None), property)))
+    methods = tuple(name for name in CALLABLE_METHODS if callable(getattr(board, name, None)))
+    return properties, methods
+
+
+class _Connection:
+    """
+    Per-client buffers, you won't use this class directly.
+    """
+
+    def __init__(self, sock):
+        self.sock = sock
+        self.inbound = bytearray()
+        self.outbound = bytearray()
+        self.closed = False
+
+
+class BoardServer:
+    """
+    Exposes a board augmented by add_properties to other processes over a Unix domain socket or, optionally, TCP.
+
+    A single event loop owns the board, so all hardware access is serialised regardless of how many clients are
+    connected. Each request frame may contain any number of operations, which are applied in order, and clients may
+    send further requests before receiving responses to earlier ones.
+
+    Channels added or removed with add_channels or remove_channels are served, or no longer served, from the next
+    operation. Proxies returned by connect_board only have the properties the board had when they connected, call
+    connect_board again to get the new ones.
+    """
+
+    def __init__(self, board, path=None, host=None, port=None):
+        """
+        :param board:
+            A board which must have been augmented by the approxeng.hwsupport module
+        :param path:
+            Filesystem path for a Unix domain socket, any existing socket at this path is replaced
+        :param host:
+            Host to bind to if using TCP, only used if path is None
+        :param port:
+            Port to bind to if using TCP, only used if path is None
+        """
+        if path is None and port is None:
+            raise ValueError('must specify either a socket path or a TCP port')
+        self.board = board
+        self.path = path
+        self._generation = None
+        self._refresh()
+        if path is not None:
+            if os.path.exists(path):
+                os.unlink(path)
+            self._listener = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+            self._listener.bind(path)
+        else:
+            self._listener = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+            self._listener.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+            self._listener.bind((host or 'localhost', port))
+        self._listener.listen()
+        self._listener.setblocking(False)
+        self._selector = selectors.DefaultSelector()
+        self._selector.register(self._listener, selectors.EVENT_READ)
+        self._wake_read, self._wake_write = socket.socketpair()
+        self._wake_read.setblocking(False)
+        self._selector.register(self._wake_read, selectors.EVENT_READ)
+        self._running = False
+        self._thread = None
+
+    @property
+    def address(self):
+        """
+        The address the server is listening on, either a path or a (host, port) tuple
+        """
+        return self._listener.getsockname()
+
+    def start(self):
+        """
+        Run the event loop in a background daemon thread
+        """
+        self._thread = threading.Thread(target=self.serve_forever, name='hwsupport-server', daemon=True)
+        self._thread.start()
+        return self
+
+    def serve_forever(self):
+        """
+        Run the event loop in the current thread until close() is called
+        """
+        self._running = True
+        try:
+            while self._running:
+                for key, events in self._selector.select():
+                    if key.fileobj is self._listener:
+                        self._accept()
+                    elif key.fileobj is self._wake_read:
+                        self._wake_read.recv(64)
+                    else:
+                        if events & selectors.EVENT_READ:
+                            self._read(key.data)
+                        if events & selectors.EVENT_WRITE and not key.data.closed:
+                            self._write(key.data)
+        finally:
+            for key in list(self._selector.get_map().values()):
+                if isinstance(key.data, _Connection):
+                    self._drop(key.data)
+            self._selector.close()
+            self._listener.close()
+            self._wake_read.close()
+            self._wake_write.close()
+            if self.path is not None and os.path.exists(self.path):
+                os.unlink(self.path)
+
+    def close(self):
+        """
+        Stop the event loop and close all connections
+        """
+        self._running = False
+        try:
+            self._wake_write.send(b'\0')
+        except OSError:
+            pass
+        if self._thread is not None and self._thread is not threading.current_thread():
+            self._thread.join()
+
+    def _accept(self):
+        sock, _ = self._listener.accept()
+        sock.setblocking(False)
+        self._selector.register(sock, selectors.EVENT_READ, _Connection(sock))
+
+    def _drop(self, connection):
+        connection.closed = True
+        self._selector.unregister(connection.sock)
+        connection.sock.close()
+
+    def _read(self, connection):
+        try:
+            data = connection.sock.recv(65536)
+        except (BlockingIOError, InterruptedError):
+            return
+        except OSError:
+            data = b''
+        if not data:
+            self._drop(connection)
+            return
+        connection.inbound += data
+        try:
+            frames = _split_frames(connection.inbound)
+        except ValueError as e:
+            LOGGER.warning(f'dropping client after malformed request: {e}')
+            self._drop(connection)
+            return
+        for frame in frames:
+            try:
+                request_id, ops = decode_request(frame)
+            except (ValueError, IndexError, struct.error) as e:
+                LOGGER.warning(f'dropping client after malformed request: {e}')
+                self._drop(connection)
+                return
+            connection.outbound += encode_response(request_id, [self._apply(op) for op in ops])
+        if connection.outbound:
+            self._write(connection)
+
+    def _write(self, connection):
+        try:
+            sent = connection.sock.send(connection.outbound)
+        except (BlockingIOError, InterruptedError):
+            sent = 0
+        except OSError:
+            self._drop(connection)
+            return
+        del connection.outbound[:sent]
+        events = selectors.EVENT_READ | selectors.EVENT_WRITE if connection.outbound else selectors.EVENT_READ
+        self._selector.modify(connection.sock, events, connection)
+
+    def _refresh(self):
+        """
+        Find the board's properties and methods again if channels have been added or removed since they were last found
+        """
+        generation = getattr(self.board, '_channel_generation', 0)
+        if generation != self._generation:
+            self.properties, self.methods = _describe(self.board)
+            self._property_names = set(self.properties)
+            self._method_names = set(self.methods)
+            self._generation = generation
+
+    def _apply(self, op):
+        """
+        Apply a single operation to the board, returning a (status, value) pair
+        """
+        code = op[0]
+        self._refresh()
+        try:
+            if code == OP_DESCRIBE:
+                return STATUS_OK, (self.properties, self.methods)
+            name = op[1]
+            if code == OP_CALL:
+                if name not in self._method_names:
+                    raise ValueError(f'method {name} is not available')
+                return STATUS_OK, getattr(self.board, name)(*op[2])
+            if name not in self._property_names:
+                raise ValueError(f'property {name} is not available')
+            if code == OP_SET:
+                setattr(self.board, name, op[2])
+                return STATUS_OK, None
+            return STATUS_OK, getattr(self.board, name)
+        except Exception as e:
+            return STATUS_ERROR, f'{type(e).__name__}: {e}'
+
+
+class BoardClient:
+    """
+    Connects to a BoardServer. Instances returned by connect_board have the same properties, such as m0, s3, adc1 and
+    led0, and the same methods, such as stop() and set_motor_speed(), as the served board.
+    """
+
+    def __init__(self, path=None, host=None, port=None):
+        if path is not None:
+            sock = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+            sock.connect(path)
+        elif port is not None:
+            sock = socket.create_connection((host or 'localhost', port))
+            sock.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+        else:
+            raise ValueError('must specify either a socket path or a TCP port')
+        self._sock = sock
+        self._lock = threading.RLock()
+        self._next_id = 0
+        self._inbound = bytearray()
+        self._responses = {}
+
+    def submit(self, ops):
+        """
+        Send a batch of operations without waiting for the response, allowing further requests to be pipelined
+
+        :param ops:
+            A list of operation tuples, see encode_request
+        :return:
+            A request ID which can be passed to result()
+        """
+        with self._lock:
+            request_id = self._next_id
+            self._next_id = (request_id + 1) & 0xffffffff
+            self._sock.sendall(encode_request(request_id, ops))
+            return request_id
+
+    def result(self, request_id):
+        """
+        Wait for the response to a previously submitted request
+
+        :return:
+            A list of values, one per operation
+        :raises:
+            ValueError if any operation failed on the server
+        """
+        with self._lock:
+            while request_id not in self._responses:
+                data = self._sock.recv(65536)
+                if not data:
+                    raise ConnectionError('board server closed the connection')
+                self._inbound.extend(data)
+                for frame in _split_frames(self._inbound):
+                    response_id, results = decode_response(frame)
+                    self._responses[response_id] = results
+            results = self._responses.pop(request_id)
+        for status, value in results:
+            if status == STATUS_ERROR:
+                raise ValueError(value)
+        return [value for _, value in results]
+
+    def request(self, ops):
+        """
+        Send a batch of operations and wait for the results
+        """
+        return self.result(self.submit(ops))
+
+    def set(self, **values):
+        """
+        Set several properties in a single request, i.e. client.set(m0=0.5, m1=-0.5, s2=0.1)
+        """
+        self.request([(OP_SET, name, value) for name, value in values.items()])
+
+    def get(self, *names):
+        """
+        Read several properties in a single request, returning a dict of name to value
+        """
+        return dict(zip(names, self.request([(OP_GET, name) for name in names])))
+
+    def call(self, name, *args):
+        """
+        Call one of the board's methods, returning its result
+        """
+        return self.request([(OP_CALL, name, args)])[0]
+
+    def close(self):
+        self._sock.close()
+
+
+def connect_board(path=None, host=None, port=None):
+    """
+    Connect to a BoardServer and return a proxy object with the same properties and methods as the served board.
+
+    :param path:
+        Filesystem path of the server's Unix domain socket
+    :param host:
+        Host if using TCP, defaults to localhost
+    :param port:
+        Port if using TCP, only used if path is None
+    """
+    client = BoardClient(path=path, host=host, port=port)
+    properties, methods = client.request([(OP_DESCRIBE,)])[0]
+
+    class RemoteBoard(BoardClient):
+        """
+        Created dynamically to match the served board's properties and methods
+        """
+
+    def make_property(name):
+        return property(fget=lambda self: self.request([(OP_GET, name)])[0],
+                        fset=lambda self, value: self.request([(OP_SET, name, value)]))
+
+    def make_method(name):
+        return lambda self, *args: self.call(name, *args)
+
+    for name in properties:
+        setattr(RemoteBoard, name, make_property(name))
+    for name in methods:
+        setattr(RemoteBoard, name, make_method(name))
+    client.__class__ = RemoteBoard
+    return client
@@ -1,5 +1,6 @@
 import logging
 
+from approxeng.hwsupport.curves import make_curve
 from approxeng.hwsupport.util import check_range
 
 LOGGER = logging.getLogger(name='approxeng.hwsupport.servos')
@@ -15,18 +16,23 @@ class Servo:
         self.servo = servo
         self.pulse_max = pulse_max
         self.pulse_min = pulse_min
+        self.curve = None
         self.value = None
         self.board = board
+        self.write_count = 0
 
     @property
     def config(self):
-        return {'pulse_min': self.pulse_min, 'pulse_max': self.pulse_max}
+        return {'pulse_min': self.pulse_min, 'pulse_max': self.pulse_max,
+                'curve': self.curve.config if self.curve else None}
 
     @config.setter
     def config(self, d):
         pulse_min = d['pulse_min'] if 'pulse_min' in d else None
         pulse_max = d['pulse_max'] if 'pulse_max' in d else None
         self.set_config(None, (pulse_min, pulse_max))
+        if 'curve' in d:
+            self.set_curve(None, d['curve'])
 
     def set_value(self, _, value):
         if value is not None:
@@ -56,6 +62,17 @@ class Servo:
     def get_config(self, _):
         return self.pulse_min, self.pulse_max
 
+    def set_curve(self, _, value):
+        try:
+            self.curve = make_curve(value)
+        except ValueError as e:
+            raise ValueError(f's{self.servo}_curve invalid, {e}')
+        if self.value is not None:
+            self.set_value(_, self.value)
+
+    def get_curve(self, _):
+        return self.curve.config if self.curve else None
+
 
 class SetServosMixin:
     """
@@ -80,7 +97,8 @@ class SetServosMixin:
             The servo to set, this must be a value in the array of servos
         :param position:
             Position from -1.0 (minimum PWM duty cycle) to 1.0 (max PWM). Values outside this range will be clamped to
-            it
+            it. If the servo has a calibration curve the position is mapped through it before conversion to a pulse
+            width
         :param kwargs:
             Any additional arguments to provide to the underlying _set_servo_pulsewidth method
         :raises:
@@ -95,11 +113,17 @@ class SetServosMixin:
         config = self._check_servo_index(servo)
         position = check_range(position)
         pulse_min, pulse_max = config.pulse_min, config.pulse_max
-        config.value = position
-        position = -position
-        scale = float((pulse_max - pulse_min) / 2)
-        centre = float((pulse_max + pulse_min) / 2)
-        self._set_servo_pulsewidth(servo, int(centre - scale * position), **kwargs)
+        with self._state_lock:
+            config.value = position
+            config.write_count += 1
+            if self._shared_state is not None:
+                self._shared_state.update(SERVOS, {servo: position})
+            if config.curve is not None:
+                position = config.curve(position)
+            position = -position
+            scale = float((pulse_max - pulse_min) / 2)
+            centre = float((pulse_max + pulse_min) / 2)
+            self._set_servo_pulsewidth(servo, int(centre - scale * position), **kwargs)
 
     def disable_servo(self, servo: int, **kwargs):
         """
@@ -114,5 +138,9 @@ class SetServosMixin:
         """
         LOGGER.debug(f'disable servo s{servo}')
         config = self._check_servo_index(servo)
-        config.value = None
-        self._set_servo_pulsewidth(servo, 0, **kwargs)
+        with self._state_lock:
+            config.value = None
+            config.write_count += 1
+            if self._shared_state is not None:
+                self._shared_state.update(SERVOS, {servo: None})
+            self._set_servo_pulsewidth(servo, 0, **kwargs)
@@ -0,0 +1,226 @@
+import logging
+import math
+import struct
+import threading
+import time
+from multiprocessing import shared_memory
+
+from approxeng.hwsupport.adcs import ADCS
+from approxeng.hwsupport.motors import MOTORS
+from approxeng.hwsupport.servos import SERVOS
+
+LOGGER = logging.getLogger(name='approxeng.hwsupport.shared')
+
+# Block layout, all little-endian:
+#
+# header   : magic, layout version, motor / servo / adc / led channel counts, padding, sequence number
+# channels : an int32 channel index for each motor, servo, adc and led in that order, padded to 8 bytes
+# values   : a float64 for each motor, servo and adc, then three (hue, saturation, value) for each led, NaN for None
+_HEADER = struct.Struct('<4sHHHHH2xQ')
+_SEQUENCE = struct.Struct('<Q')
+_SEQUENCE_OFFSET = 16
+_VALUE = struct.Struct('<d')
+_MAGIC = b'HWSS'
+_VERSION = 1
+
+# Same as approxeng.hwsupport.leds.LEDS, which would import the colour modules
+LEDS = 'leds'
+_KINDS = ((MOTORS, 'm', 1), (SERVOS, 's', 1), (ADCS, 'adc', 1), (LEDS, 'led', 3))
+
+# Names of blocks created by publishers in this process, which must stay registered with the resource tracker
+_PUBLISHED = set()
+
+# How many times a reader retries while the writer is part way through an update before giving up
+MAX_READ_ATTEMPTS = 1000
+
+
+def _layout(counts):
+    """
+    Offsets of the channel table and value array, and the total size, for a set of channel counts
+    """
+    channels_offset = _HEADER.size
+    values_offset = channels_offset + 4 * sum(counts)
+    values_offset += -values_offset % 8
+    size = values_offset + 8 * sum(count * width for count, (_, _, width) in zip(counts, _KINDS))
+    return channels_offset, values_offset, size
+
+
+class StatePublisher:
+    """
+    Mirrors the state of every motor, servo, ADC channel and LED into a named shared memory block, so other processes
+    on the same machine can monitor the board without asking the process that owns it. Created by add_properties when
+    called with shared_state, you won't use this class directly.
+
+    Updates are protected by a sequence lock: the writer makes the sequence number odd, writes the changed values, then
+    makes it even again. Readers copy the values and retry if the sequence number was odd or changed, so readers never
+    block the writer, and a slow or crashed reader can't affect the board.
+    """
+
+    def __init__(self, board, name=None):
+        """
+        :param board:
+            The board being augmented
+        :param name:
+            Name for the shared memory block, or None to have one generated
+        """
+        self.channels = {kind: list(board._config.get(kind, {}).keys()) for kind, _, _ in _KINDS}
+        counts = [len(self.channels[kind]) for kind, _, _ in _KINDS]
+        channels_offset, values_offset, size = _layout(counts)
+        self._memory = shared_memory.SharedMemory(name=name, create=True, size=size)
+        self.name = self._memory.name
+        _PUBLISHED.add(self.name)
+        self.board = board
+        self._buffer = self._memory.buf
+        self._lock = threading.Lock()
+        self._sequence = 0
+        _HEADER.pack_into(self._buffer, 0, _MAGIC, _VERSION, *counts, 0)
+        self._offsets = {}
+        offset = values_offset
+        for kind, _, width in _KINDS:
+            self._offsets[kind] = {}
+            for channel in self.channels[kind]:
+                struct.pack_into('<i', self._buffer, channels_offset, channel)
+                channels_offset += 4
+                self._offsets[kind][channel] = offset
+                offset += 8 * width
+        config = board._config
+        self.update(MOTORS, {motor: m.value for motor, m in config.get(MOTORS, {}).items()})
+        self.update(SERVOS, {servo: s.value for servo, s in config.get(SERVOS, {}).items()})
+        self.update(ADCS, {adc: a.last_reading_value for adc, a in config.get(ADCS, {}).items()})
+        self.update(LEDS, {led: l.hsv for led, l in config.get(LEDS, {}).items()})
+
+    def update(self, kind, values):
+        """
+        Publish new values for one or more channels of the same kind
+
+        :param kind:
+            One of 'motors', 'servos', 'adcs' or 'leds'
+        :param values:
+            A dict of channel index to value, None, or for LEDs an (h, s, v) tuple. Channels which aren't in the block
+            are ignored. Does nothing once the publisher has been closed
+        """
+        offsets = self._offsets[kind]
+        with self._lock:
+            buffer = self._buffer
+            if buffer is None:
+                return
+            self._sequence += 1
+            _SEQUENCE.pack_into(buffer, _SEQUENCE_OFFSET, self._sequence)
+            for channel, value in values.items():
+                offset = offsets.get(channel)
+                if offset is None:
+                    continue
+                if kind == LEDS:
+                    struct.pack_into('<3d', buffer, offset, *value)
+                else:
+                    _VALUE.pack_into(buffer, offset, math.nan if value is None else value)
+            self._sequence += 1
+            _SEQUENCE.pack_into(buffer, _SEQUENCE_OFFSET, self._sequence)
+
+    def close(self):
+        """
+        Stop publishing and remove the shared memory block, detaching this publisher from the board. Readers which
+        already have it open can still read the last published values. Called by the board's stop().
+        """
+        with self._lock:
+            if self._buffer is None:
+                return
+            self._buffer = None
+        if self.board._shared_state is self:
+            self.board._shared_state = None
+        self._memory.close()
+        self._memory.unlink()
+        _PUBLISHED.discard(self.name)
+
+
+class BoardState:
+    """
+    Read-only view of a board's state published by another process, returned by attach_board_state. Channels are
+    available as attributes named in the same way as the board's properties, i.e. state.m0, state.s3, state.adc1 or
+    state.led2, or all together and guaranteed consistent with each other from snapshot().
+    """
+
+    def __init__(self, name):
+        try:
+            self._memory = shared_memory.SharedMemory(name=name, create=False, track=False)
+        except TypeError:
+            # Before Python 3.13 attaching registers the block with this process's resource tracker, which would then
+            # remove it when this process exits even though the publisher still owns it. If the publisher is in this
+            # process the registration is the publisher's, and is removed when it closes the block.
+            self._memory = shared_memory.SharedMemory(name=name, create=False)
+            if name not in _PUBLISHED:
+                from multiprocessing import resource_tracker
+                resource_tracker.unregister(self._memory._name, 'shared_memory')
+        self.name = name
+        self._buffer = self._memory.buf
+        magic, version, *counts, _ = _HEADER.unpack_from(self._buffer, 0)
+        if magic != _MAGIC or version != _VERSION:
+            self._memory.close()
+            raise ValueError(f'shared memory block {name} is not a board state block')
+        channels_offset, self._values_offset, self._size = _layout(counts)
+        self._names = []
+        self._widths = []
+        for (kind, prefix, width), count in zip(_KINDS, counts):
+            for channel in struct.unpack_from(f'<{count}i', self._buffer, channels_offset):
+                self._names.append(f'{prefix}{channel}')
+                self._widths.append(width)
+            channels_offset += 4 * count
+        self._format = struct.Struct(f'<{sum(self._widths)}d')
+
+    def snapshot(self):
+        """
+        Read all channels at once
+
+        :return:
+            A dict of channel name to value, None for motors, servos and ADC channels which haven't been set or read,
+            and an (h, s, v) tuple for LEDs
+        :raises:
+            TimeoutError if a consistent copy couldn't be taken because the publisher was continually updating
+        """
+        buffer = self._buffer
+        for _ in range(MAX_READ_ATTEMPTS):
+            before = _SEQUENCE.unpack_from(buffer, _SEQUENCE_OFFSET)[0]
+            if before % 2 == 0:
+                raw = bytes(buffer[self._values_offset:self._size])
+                if _SEQUENCE.unpack_from(buffer, _SEQUENCE_OFFSET)[0] == before:
+                    break
+            time.sleep(0)
+        else:
+            raise TimeoutError(f'unable to read consistent state from {self.name}')
+        values = iter(self._format.unpack(raw))
+        result = {}
+        for name, width in zip(self._names, self._widths):
+            if width == 1:
+                value = next(values)
+                result[name] = None if math.isnan(value) else value
+            else:
+                result[name] = tuple(next(values) for _ in range(width))
+        return result
+
+    @property
+    def channels(self):
+        """
+        Names of all the channels in the block
+        """
+        return list(self._names)
+
+    def __getattr__(self, item):
+        if item.startswith('_') or item not in self._names:
+            raise AttributeError(item)
+        return self.snapshot()[item]
+
+    def close(self):
+        self._buffer = None
+        self._memory.close()
+
+
+def attach_board_state(name):
+    """
+    Open a read-only view of the state published by a board in another process created with shared_state
+
+    :param name:
+        Name of the shared memory block, from the publishing board's shared_state.name
+    :return:
+        A BoardState
+    """
+    return BoardState(name)
@@ -0,0 +1,248 @@
+import logging
+import math
+import os
+import struct
+import threading
+
+from approxeng.hwsupport.motors import MOTORS
+from approxeng.hwsupport.servos import SERVOS
+
+LOGGER = logging.getLogger(name='approxeng.hwsupport.snapshots')
+
+# Snapshot layout, all little-endian:
+#
+# header   : magic, layout version, motor / servo / led / gpio channel counts, padding
+# channels : an int32 channel index for each motor, servo, led and gpio in that order, padded to 8 bytes
+# values   : a float64 for each motor and servo, then four (hue, saturation, value, brightness) for each led, then one
+#            for each gpio output level, NaN for None or an led which has never been set
+_HEADER = struct.Struct('<4sHHHHH2x')
+_MAGIC = b'HWSN'
+_VERSION = 1
+
+# Same as approxeng.hwsupport.leds.LEDS and approxeng.hwsupport.gpios.GPIOS, which would import the colour and
+# GPIO modules
+LEDS = 'leds'
+GPIOS = 'gpios'
+_KINDS = ((MOTORS, 'm', 1), (SERVOS, 's', 1), (LEDS, 'led', 4), (GPIOS, 'gpio', 1))
+
+
+def _values(kind, config):
+    """
+    The live values of a channel to store in a snapshot
+    """
+    if kind == LEDS:
+        if config.write_count == 0:
+            return None, None, None, None
+        return tuple(config.hsv) + (config.brightness,)
+    if kind == GPIOS:
+        return (config.output,)
+    return (config.value,)
+
+
+def _pack(board):
+    channels = {kind: list(board._config.get(kind, {}).keys()) for kind, _, _ in _KINDS}
+    counts = [len(channels[kind]) for kind, _, _ in _KINDS]
+    indices = [channel for kind, _, _ in _KINDS for channel in channels[kind]]
+    values = [math.nan if value is None else float(value)
+              for kind, _, _ in _KINDS for channel in channels[kind]
+              for value in _values(kind, board._config[kind][channel])]
+    padding = -(_HEADER.size + 4 * len(indices)) % 8
+    return b''.join((_HEADER.pack(_MAGIC, _VERSION, *counts),
+                     struct.pack(f'<{len(indices)}i{padding}x', *indices),
+                     struct.pack(f'<{len(values)}d', *values)))
+
+
+def _unpack(snapshot):
+    """
+    Parse a snapshot
+
+    :return:
+        A dict of kind to a dict of channel to a tuple of values, with None in place of NaN
+    :raises:
+        ValueError if the snapshot isn't one produced by board.snapshot()
+    """
+    snapshot = bytes(snapshot)
+    if len(snapshot) < _HEADER.size:
+        raise ValueError(f'snapshot is {len(snapshot)} bytes, too short to contain a header')
+    magic, version, *counts = _HEADER.unpack_from(snapshot, 0)
+    if magic != _MAGIC or version != _VERSION:
+        raise ValueError(f'snapshot has magic {magic} and version {version}, expected {_MAGIC} and {_VERSION}')
+    channels_offset = _HEADER.size
+    values_offset = channels_offset + 4 * sum(counts)
+    values_offset += -values_offset % 8
+    size = values_offset + 8 * sum(count * width for count, (_, _, width) in zip(counts, _KINDS))
+    if len(snapshot) != size:
+        raise ValueError(f'snapshot is {len(snapshot)} bytes, header describes {size}')
+    indices = iter(struct.unpack_from(f'<{sum(counts)}i', snapshot, channels_offset))
+    values = iter(None if math.isnan(value) else value
+                  for value in struct.unpack_from(f'<{(size - values_offset) // 8}d', snapshot, values_offset))
+    result = {}
+    for count, (kind, _, width) in zip(counts, _KINDS):
+        result[kind] = {next(indices): tuple(next(values) for _ in range(width)) for _ in range(count)}
+    return result
+
+
+def _write_atomically(filename, data):
+    """
+    Write data to a file so that anything reading it, including after a crash or power loss, sees either the old
+    contents or the new ones
+    """
+    temporary = f'{filename}.tmp'
+    with open(temporary, 'wb') as file:
+        file.write(data)
+        file.flush()
+        os.fsync(file.fileno())
+    os.replace(temporary, filename)
+
+
+class SnapshotWriter:
+    """
+    Writes a snapshot of a board to a file at a fixed interval, started by persist_snapshots. You won't use this class
+    directly.
+    """
+
+    def __init__(self, board, filename, interval):
+        self.board = board
+        self.filename = filename
+        self.interval = interval
+        self.write_count = 0
+        self._last = None
+        self._lock = threading.Lock()
+        self._stopped = threading.Event()
+        self._thread = threading.Thread(target=self._run, name='hwsupport-snapshots', daemon=True)
+        self._thread.start()
+
+    def write(self, snapshot=None):
+        """
+        Write a snapshot if anything has changed since the last one
+
+        :param snapshot:
+            The snapshot to write, or None to take one now
+        """
+        with self._lock:
+            if snapshot is None:
+                snapshot = self.board.snapshot()
+            if snapshot != self._last:
+                _write_atomically(self.filename, snapshot)
+                self._last = snapshot
+                self.write_count += 1
+
+    def _run(self):
+        while not self._stopped.wait(self.interval):
+            try:
+                self.write()
+            except Exception:
+                LOGGER.exception(f'error writing snapshot to {self.filename}')
+
+    def halt(self):
+        """
+        Stop any further periodic writes without waiting for the thread
+        """
+        self._stopped.set()
+
+    def close(self, snapshot=None):
+        """
+        Stop the thread, then write a final snapshot
+
+        :param snapshot:
+            The snapshot to write, or None to take one now
+        """
+        self.halt()
+        if threading.current_thread() is not self._thread:
+            self._thread.join()
+        self.write(snapshot)
+
+
+class SnapshotMixin:
+    """
+    Mixed into the new class used for the augmented instance to provide the snapshot, restore, save_snapshot,
+    load_snapshot and persist_snapshots methods
+    """
+
+    def snapshot(self):
+        """
+        Capture the current value of every motor, servo, LED and GPIO output as a compact binary blob, which can be
+        passed to restore() later, including by another process. Calibration isn't included, use config for that.
+        Inputs such as ADC channels and encoders aren't included as they can't be restored.
+
+        :return:
+            The snapshot as bytes
+        """
+        return _pack(self)
+
+    def restore(self, snapshot):
+        """
+        Put every motor, servo, LED and GPIO output back to the value it had when a snapshot was taken. Everything is
+        set in a single transaction, so motors are sent in one call to _set_motor_speeds if the board provides it, and
+        every channel is written once. Servos which were disabled are disabled, and channels which had never been set
+        are left alone. Channels in the snapshot that don't exist
+        on this board are skipped with a warning.
+
+        :param snapshot:
+            Bytes returned by snapshot()
+        :raises:
+            ValueError if the snapshot can't be parsed, in which case nothing is changed
+        """
+        values = _unpack(snapshot)
+        for kind, prefix, _ in _KINDS:
+            missing = [channel for channel in values[kind] if channel not in self._config.get(kind, {})]
+            if missing:
+                LOGGER.warning(f'snapshot has channels {[f"{prefix}{channel}" for channel in missing]} which aren\'t '
+                               f'on this board, skipping')
+                for channel in missing:
+                    del values[kind][channel]
+        with self.transaction():
+            speeds = {motor: speed for motor, (speed,) in values[MOTORS].items() if speed is not None}
+            if speeds:
+                self.set_motor_speeds(speeds)
+            for servo, (position,) in values[SERVOS].items():
+                if position is not None:
+                    self.set_servo(servo, position)
+                elif self._config[SERVOS][servo].value is not None:
+                    self.disable_servo(servo)
+            for led, (h, s, v, brightness) in values[LEDS].items():
+                if h is None:
+                    continue
+                self.set_led_brightness(led, brightness)
+                self.set_led_hsv(led, h, s, v)
+            for gpio, (level,) in values[GPIOS].items():
+                if level is not None:
+                    self.write_gpio(gpio, bool(level))
+
+    def save_snapshot(self, filename):
+        """
+        Write a snapshot to the specified file, replacing it atomically so a crash part way through never leaves a
+        partial snapshot behind
+        """
+        _write_atomically(filename, self.snapshot())
+
+    def load_snapshot(self, filename):
+        """
+        Read a snapshot from the specified file and restore it
+        """
+        with open(filename, 'rb') as file:
+            self.restore(file.read())
+
+    def persist_snapshots(self, filename, interval=1.0):
+        """
+        Start or stop a background thread writing a snapshot to a file at a fixed interval, only when something has
+        changed. Each write replaces the file atomically. Calling stop() stops persisting and, once everything has been
+        stopped, writes a final snapshot of the values from before the board was stopped. A restarted
+        process can then call load_snapshot to pick up where it left off, rather than setting each channel in turn.
+
+        :param filename:
+            The file to write, or None to stop persisting, writing a final snapshot first
+        :param interval:
+            Seconds between checks for changes, defaults to 1.0
+        :return:
+            The SnapshotWriter, which has a write_count attribute, or None if stopping
+        """
+        if self._snapshot_writer is not None:
+            self._snapshot_writer.close()
+            self._snapshot_writer = None
+        if filename is None:
+            return None
+        if interval <= 0:
+            raise ValueError(f'snapshot interval must be > 0, was {interval}')
+        self._snapshot_writer = SnapshotWriter(board=self, filename=filename, interval=interval)
+        return self._snapshot_writer
@@ -0,0 +1,126 @@
+import logging
+import threading
+from concurrent.futures import ThreadPoolExecutor
+
+LOGGER = logging.getLogger(name='approxeng.hwsupport.subscriptions')
+
+# Callbacks waiting to run beyond this are dropped rather than queued, so a slow callback can't build up an unbounded
+# backlog of stale notifications
+MAX_PENDING_CALLBACKS = 64
+CALLBACK_THREADS = 2
+
+
+class Dispatcher:
+    """
+    Runs subscription callbacks on a small pool of threads, so slow callbacks never hold up the thread reading the
+    ADC. You won't use this class directly.
+    """
+
+    def __init__(self, max_pending=MAX_PENDING_CALLBACKS, threads=CALLBACK_THREADS):
+        self._executor = ThreadPoolExecutor(max_workers=threads, thread_name_prefix='hwsupport-callback')
+        self._pending = threading.BoundedSemaphore(max_pending)
+        self._threads = set()
+        self.dropped = 0
+
+    def submit(self, callback, *args):
+        if not self._pending.acquire(blocking=False):
+            self.dropped += 1
+            LOGGER.warning(f'too many callbacks waiting, dropped {callback!r}{args}')
+            return
+        self._executor.submit(self._run, callback, args)
+
+    def _run(self, callback, args):
+        self._threads.add(threading.get_ident())
+        try:
+            callback(*args)
+        except Exception:
+            LOGGER.exception(f'error in callback {callback!r}{args}')
+        finally:
+            self._pending.release()
+
+    def close(self):
+        """
+        Stop accepting callbacks and wait for any already running to finish, unless called from one of them
+        """
+        self._executor.shutdown(wait=threading.get_ident() not in self._threads)
+
+
+class ADCSubscription:
+    """
+    A threshold or change subscription on an ADC channel, returned by on_adc. Call cancel() to remove it.
+    """
+
+    def __init__(self, adc, callback, above, below, hysteresis, board):
+        if above is not None and below is not None and below >= above:
+            raise ValueError(f'below must be less than above, was below={below}, above={above}')
+        if hysteresis < 0:
+            raise ValueError(f'hysteresis must be >= 0, was {hysteresis}')
+        self.adc = adc
+        self.callback = callback
+        self.above = above
+        self.below = below
+        self.hysteresis = hysteresis
+        self.board = board
+        # For threshold subscriptions, one of 'above', 'below' or None for in range. For change subscriptions, the last
+        # value reported. Either way None until the first reading.
+        self.state = None
+        self.value = None
+        self._lock = threading.Lock()
+
+    def check(self, value):
+        """
+        Called with each new reading, returns the event to report or None
+        """
+        with self._lock:
+            if self.above is None and self.below is None:
+                if self.value is not None and abs(value - self.value) <= self.hysteresis:
+                    return None
+                self.value = value
+                return 'change'
+            state = self.state
+            if self.above is not None and (value > self.above or (state == 'above' and
+                                                                  value >= self.above - self.hysteresis)):
+                self.state = 'above'
+            elif self.below is not None and (value < self.below or (state == 'below' and
+                                                                    value <= self.below + self.hysteresis)):
+                self.state = 'below'
+            else:
+                self.state = 'in_range'
+            self.value = value
+            if self.state == state or (state is None and self.state == 'in_range'):
+                return None
+            return self.state
+
+    def cancel(self):
+        """
+        Stop receiving callbacks from this subscription
+        """
+        self.board._config['adcs'][self.adc].subscriptions.remove(self)
+
+
+class Sampler:
+    """
+    Reads every ADC channel with subscriptions at a fixed interval, started by sample_adcs. You won't use this class
+    directly.
+    """
+
+    def __init__(self, board, interval):
+        self.board = board
+        self.interval = interval
+        self._stopped = threading.Event()
+        self._thread = threading.Thread(target=self._run, name='hwsupport-adc-sampler', daemon=True)
+        self._thread.start()
+
+    def _run(self):
+        while not self._stopped.wait(self.interval):
+            for adc, config in list(self.board._config['adcs'].items()):
+                if config.subscriptions:
+                    try:
+                        self.board.read_adc(adc)
+                    except Exception:
+                        LOGGER.exception(f'error sampling adc{adc}')
+
+    def close(self):
+        self._stopped.set()
+        if threading.current_thread() is not self._thread:
+            self._thread.join()
@@ -0,0 +1,201 @@
+import functools
+import itertools
+import json
+import logging
+import time
+from contextlib import contextmanager
+
+LOGGER = logging.getLogger(name='approxeng.hwsupport.trace')
+
+DEFAULT_TRACE_SIZE = 65536
+
+# Methods which can be traced, mapped to the prefix and argument name used to find the channel for each call. Methods
+# not acting on a single channel are traced on a shared 'board' track.
+TRACED_METHODS = {
+    'set_motor_speed': ('m', 'motor'),
+    '_set_motor_speed': ('m', 'motor'),
+    'set_motor_speeds': (None, None),
+    '_set_motor_speeds': (None, None),
+    'drive': (None, None),
+    'set_servo': ('s', 'servo'),
+    'disable_servo': ('s', 'servo'),
+    '_set_servo_pulsewidth': ('s', 'servo'),
+    'read_adc': ('adc', 'adc'),
+    '_read_adc': ('adc', 'adc'),
+    'read_adcs': (None, None),
+    '_read_adcs': (None, None),
+    'read_derived': (None, None),
+    'read_encoder': ('enc', 'encoder'),
+    '_read_encoder': ('enc', 'encoder'),
+    'read_encoders': (None, None),
+    '_read_encoders': (None, None),
+    'read_gpio': ('gpio', 'gpio'),
+    '_read_gpio': ('gpio', 'gpio'),
+    'read_gpios': (None, None),
+    '_read_gpios': (None, None),
+    'write_gpio': ('gpio', 'gpio'),
+    '_write_gpio': ('gpio', 'gpio'),
+    'set_led_hsv': ('led', 'led'),
+    'set_led_rgb': ('led', 'led'),
+    'set_led_brightness': ('led', 'led'),
+    'set_led_gamma': ('led', 'led'),
+    'set_led_saturation': ('led', 'led'),
+    '_update_led': ('led', 'config'),
+    '_set_led_rgb': ('led', 'led'),
+    'advance_led_frame': (None, None),
+    'stop': (None, None),
+    '_stop': (None, None),
+}
+
+# Driver hooks, which are also traced on the bus thread if the board has one
+DRIVER_HOOKS = ('_set_motor_speed', '_set_motor_speeds', '_set_servo_pulsewidth', '_read_adc', '_read_adcs',
+                '_read_encoder', '_read_encoders', '_read_gpio', '_read_gpios', '_write_gpio', '_set_led_rgb')
+
+
+class Tracer:
+    """
+    Records the start and duration of every call to the board's public methods and its driver hooks, for viewing in
+    Perfetto (https://ui.perfetto.dev) or chrome://tracing. Calls are stored in a fixed size ring buffer allocated up
+    front, so tracing runs indefinitely with bounded memory and keeps the most recent calls. Recording a call takes no
+    locks. Use as a context manager, or call close() to stop tracing:
+
+    with Tracer(board) as tracer:
+        run_robot()
+    tracer.save('robot.json')
+
+    Each channel gets its own track, named after its property, i.e. m0 or adc3, so a slow write to one motor or a burst
+    of LED updates is easy to pick out. Calls made by the bus thread, if enabled, appear on tracks with a 'bus' suffix.
+    """
+
+    def __init__(self, board, size=DEFAULT_TRACE_SIZE):
+        """
+        :param board:
+            A board which has been through add_properties
+        :param size:
+            Number of calls to keep, defaults to 65536
+        """
+        self.size = size
+        self._names = [None] * size
+        self._tracks = [None] * size
+        self._starts = [0.0] * size
+        self._durations = [0.0] * size
+        self._counter = itertools.count()
+        self._wrapped = []
+        self.origin = time.perf_counter()
+        for name in TRACED_METHODS:
+            self._wrap(board, name, None)
+        bus = getattr(board, '_bus', None)
+        if bus is not None:
+            for name in DRIVER_HOOKS:
+                self._wrap(bus, name, 'bus')
+
+    def _wrap(self, target, name, suffix):
+        method = getattr(target, name, None)
+        if not callable(method):
+            return
+        prefix, argument = TRACED_METHODS[name]
+        record = self._record
+        perf_counter = time.perf_counter
+
+        @functools.wraps(method)
+        def traced(*args, **kwargs):
+            start = perf_counter()
+            try:
+                return method(*args, **kwargs)
+            finally:
+                if prefix is None:
+                    record(name, ('board', suffix), start)
+                else:
+                    channel = args[0] if args else kwargs.get(argument)
+                    if argument == 'config':
+                        channel = channel.led
+                    record(name, (f'{prefix}{channel}', suffix), start)
+
+        had_attribute = name in target.__dict__
+        setattr(target, name, traced)
+        self._wrapped.append((target, name, method if had_attribute else None))
+
+    def _record(self, name, track, start):
+        end = time.perf_counter()
+        # next() on itertools.count is atomic under the GIL, so each call gets its own slot without a lock
+        index = next(self._counter) % self.size
+        self._names[index] = name
+        self._tracks[index] = track
+        self._starts[index] = start
+        self._durations[index] = end - start
+
+    @contextmanager
+    def span(self, name):
+        """
+        Record a block of your own code on the 'user' track, so time spent outside the board is visible alongside it:
+
+        with tracer.span('plan path'):
+            ...
+        """
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self._record(name, ('user', None), start)
+
+    def close(self):
+        """
+        Stop tracing, restoring the board's original methods. Calls already recorded are kept.
+        """
+        for target, name, original in reversed(self._wrapped):
+            if original is None:
+                delattr(target, name)
+            else:
+                setattr(target, name, original)
+        self._wrapped = []
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        self.close()
+
+    def chrome_trace(self):
+        """
+        The recorded calls as a Chrome trace-event format dict, oldest first
+        """
+        # Taking a value from the counter claims an empty slot, calls finishing during this may or may not be included
+        count = next(self._counter)
+        self._names[count % self.size] = None
+        first = max(0, count - self.size)
+        track_ids = {}
+        events = []
+        for n in range(first, count):
+            index = n % self.size
+            if self._names[index] is None:
+                continue
+            track = self._tracks[index]
+            if track not in track_ids:
+                track_ids[track] = len(track_ids) + 1
+            events.append({'name': self._names[index], 'ph': 'X', 'pid': 1, 'tid': track_ids[track],
+                           'ts': (self._starts[index] - self.origin) * 1e6, 'dur': self._durations[index] * 1e6})
+        # Name each track, sorting so tracks for the same kind of channel sit together
+        for track, tid in track_ids.items():
+            channel, suffix = track
+            events.append({'name': 'thread_name', 'ph': 'M', 'pid': 1, 'tid': tid,
+                           'args': {'name': channel if suffix is None else f'{channel} {suffix}'}})
+        for rank, (track, tid) in enumerate(sorted(track_ids.items(), key=lambda item: _track_sort_key(item[0]))):
+            events.append({'name': 'thread_sort_index', 'ph': 'M', 'pid': 1, 'tid': tid, 'args': {'sort_index': rank}})
+        events.append({'name': 'process_name', 'ph': 'M', 'pid': 1, 'args': {'name': 'approxeng.hwsupport'}})
+        return {'traceEvents': events, 'displayTimeUnit': 'ms'}
+
+    def save(self, filename):
+        """
+        Write the recorded calls to a file in Chrome trace-event JSON format
+        """
+        with open(filename, 'w') as file:
+            json.dump(self.chrome_trace(), file)
+
+
+def _track_sort_key(track):
+    channel, suffix = track
+    prefix = channel.rstrip('0123456789')
+    number = channel[len(prefix):]
+    order = ['user', 'board', 'm', 's', 'adc', 'led']
+    return (order.index(prefix) if prefix in order else len(order), prefix, int(number) if number else 0,
+            suffix or '')
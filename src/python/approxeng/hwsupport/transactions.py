@@ -0,0 +1,189 @@
+import logging
+
+from approxeng.hwsupport.motors import MOTORS
+from approxeng.hwsupport.servos import SERVOS
+
+LOGGER = logging.getLogger(name='approxeng.hwsupport.transactions')
+
+# Same as approxeng.hwsupport.leds.LEDS and approxeng.hwsupport.gpios.GPIOS, which would import the colour and
+# GPIO modules
+LEDS = 'leds'
+GPIOS = 'gpios'
+
+# Driver hooks deferred by a transaction
+_HOOKS = ('_set_motor_speed', '_set_motor_speeds', '_set_servo_pulsewidth', '_set_led_rgb', '_write_gpio')
+
+
+class Transaction:
+    """
+    Defers all motor, servo, LED and GPIO writes on a board until the end of a with block, returned by
+    board.transaction(). You won't create this class directly.
+
+    While the transaction is open the board's driver hooks are replaced on the instance by versions which record the
+    latest value for each channel. Everything above the hooks runs as normal, so values are range checked, scaled and
+    calibrated when they're set, and reading a property returns the value set within the transaction. When the
+    transaction ends the latest value for each channel is sent, motors first in a single call to _set_motor_speeds if
+    the board provides it, then servos, then LEDs, then GPIO pins. Only the last level written to each GPIO pin is
+    sent, so a pulse on a pin can't be made inside a transaction.
+    """
+
+    def __init__(self, board, flush_on_error=False):
+        self.board = board
+        self.flush_on_error = flush_on_error
+        self._depth = 0
+        self._joined = None
+        self._pending = {}
+        self._hooks = {}
+        self._hooks_by_name = {}
+        self._snapshot = None
+
+    def __enter__(self):
+        board = self.board
+        if board._transaction is not None:
+            # Nested transactions join the one already open
+            self._joined = board._transaction
+            self._joined._depth += 1
+            return self._joined
+        self._depth = 1
+        self._snapshot = self._take_snapshot()
+        for name in _HOOKS:
+            hook = getattr(board, name, None)
+            if callable(hook):
+                self._hooks[name] = (hook, name in board.__dict__)
+        if '_set_motor_speed' in self._hooks:
+            board._set_motor_speed = lambda motor, speed, **kwargs: self._defer('motor', motor, (speed,), kwargs)
+        if '_set_motor_speeds' in self._hooks:
+            board._set_motor_speeds = self._defer_motor_speeds
+        if '_set_servo_pulsewidth' in self._hooks:
+            board._set_servo_pulsewidth = lambda servo, pulse_width, **kwargs: self._defer('servo', servo,
+                                                                                          (pulse_width,), kwargs)
+        if '_set_led_rgb' in self._hooks:
+            board._set_led_rgb = lambda led, r, g, b, **kwargs: self._defer('led', led, (r, g, b), kwargs)
+        if '_write_gpio' in self._hooks:
+            board._write_gpio = lambda gpio, level, **kwargs: self._defer('gpio', gpio, (level,), kwargs)
+        board._transaction = self
+        return self
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        if self._joined is not None:
+            return self._joined.__exit__(exc_type, exc_val, exc_tb)
+        if self._depth == 0:
+            # Already ended by cancel()
+            return False
+        self._depth -= 1
+        if self._depth > 0:
+            return False
+        self._close()
+        if exc_type is not None and not self.flush_on_error:
+            LOGGER.debug(f'discarding {len(self._pending)} writes after {exc_type.__name__}')
+            self._restore_snapshot()
+        else:
+            self._flush()
+        self._pending = {}
+        return False
+
+    @property
+    def pending(self):
+        """
+        The number of channels with a write waiting to be sent
+        """
+        return len(self._pending)
+
+    def _defer(self, kind, channel, args, kwargs):
+        self._pending[(kind, channel)] = (args, kwargs)
+
+    def _defer_motor_speeds(self, speeds, **kwargs):
+        for motor, speed in speeds.items():
+            self._pending[('motor', motor)] = ((speed,), kwargs)
+
+    def _close(self):
+        """
+        Put the board's own hooks back
+        """
+        board = self.board
+        for name, (hook, was_instance_attribute) in self._hooks.items():
+            if was_instance_attribute:
+                setattr(board, name, hook)
+            else:
+                delattr(board, name)
+        self._hooks_by_name = {name: hook for name, (hook, _) in self._hooks.items()}
+        self._hooks = {}
+        board._transaction = None
+
+    def cancel(self):
+        """
+        End the transaction immediately without sending any of its writes, leaving the board's channels reporting the
+        values set within the transaction. Used by stop(), which then sets every channel itself.
+        """
+        if self._depth > 0:
+            self._depth = 0
+            self._close()
+            self._pending = {}
+
+    def _flush(self):
+        hooks = self._hooks_by_name
+        pending = self._pending
+        motors = {channel: args[0] for (kind, channel), (args, kwargs) in pending.items()
+                  if kind == 'motor' and not kwargs}
+        if motors and '_set_motor_speeds' in hooks:
+            hooks['_set_motor_speeds'](motors)
+            pending = {key: value for key, value in pending.items() if key[0] != 'motor' or key[1] not in motors}
+        for hook_name, kind in (('_set_motor_speed', 'motor'), ('_set_servo_pulsewidth', 'servo'),
+                                ('_set_led_rgb', 'led'), ('_write_gpio', 'gpio')):
+            for (write_kind, channel), (args, kwargs) in pending.items():
+                if write_kind == kind:
+                    hooks[hook_name](channel, *args, **kwargs)
+
+    def _take_snapshot(self):
+        config = self.board._config
+        return {MOTORS: {motor: m.value for motor, m in config.get(MOTORS, {}).items()},
+                SERVOS: {servo: s.value for servo, s in config.get(SERVOS, {}).items()},
+                LEDS: {led: (l.hsv, l.brightness, l.gamma, l.saturation, l.output, l.frame)
+                       for led, l in config.get(LEDS, {}).items()},
+                GPIOS: {gpio: g.output for gpio, g in config.get(GPIOS, {}).items()}}
+
+    def _restore_snapshot(self):
+        board = self.board
+        config = board._config
+        for motor, value in self._snapshot[MOTORS].items():
+            config[MOTORS][motor].value = value
+        for servo, value in self._snapshot[SERVOS].items():
+            config[SERVOS][servo].value = value
+        for led, state in self._snapshot[LEDS].items():
+            l = config[LEDS][led]
+            l.hsv, l.brightness, l.gamma, l.saturation, l.output, l.frame = state
+        for gpio, output in self._snapshot[GPIOS].items():
+            config[GPIOS][gpio].output = output
+        if board._shared_state is not None:
+            board._shared_state.update(MOTORS, self._snapshot[MOTORS])
+            board._shared_state.update(SERVOS, self._snapshot[SERVOS])
+            board._shared_state.update(LEDS, {led: state[0] for led, state in self._snapshot[LEDS].items()})
+
+
+class TransactionMixin:
+    """
+    Mixed into the new class used for the augmented instance to provide the transaction method
+    """
+
+    def transaction(self, flush_on_error=False):
+        """
+        Group writes to motors, servos, LEDs and GPIO pins so they're sent together:
+
+        with board.transaction():
+            board.m0 = 0.5
+            board.m1 = 0.5
+            board.s0 = -0.2
+            board.led0 = 'green'
+
+        Writes made inside the with block, through properties or methods, are held back until the block ends, with
+        only the last write to each channel being sent. Reading a property inside the block returns the value set
+        inside the block. Transactions apply to every thread using the board, and a transaction opened while another
+        is already open joins it. Calling stop() ends the transaction without sending its writes.
+
+        :param flush_on_error:
+            If the block ends with an exception, True sends the writes made so far, False (the default) discards them,
+            putting every channel back to the value it had when the transaction started
+        :return:
+            A Transaction, used as a context manager
+        """
+        return Transaction(self, flush_on_error=flush_on_error)
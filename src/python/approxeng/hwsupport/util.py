@@ -1,10 +1,23 @@
-# -*- coding: future_fstrings -*-
-
 import logging
 
 LOGGER = logging.getLogger(name='approxeng.hwsupport.util')
 
 
+class _NoLock:
+    """
+    Stands in for a lock where none is needed, so code can always use 'with board._state_lock:'
+    """
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        return False
+
+
+NO_LOCK = _NoLock()
+
+
 def check_range(i):
     """
     Accepts a number, returns that number clamped to a range of -1.0 to 1.0, as a float
@@ -9,5 +9,6 @@ setup(
     description='Python robot hardware driver support',
     classifiers=['Programming Language :: Python :: 3.6'],
     packages=find_namespace_packages(),
-    install_requires=['future-fstrings', 'pyyaml'],
+    python_requires='>=3.6',
+    install_requires=['pyyaml'],
 )